@@ -0,0 +1,204 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialized
+    fcntl = None
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_REGISTRY_PATH = os.path.join(BACKEND_DIR, ".agent_registry.json")
+
+
+def spec_hash(model, instructions, tools=None):
+    """Hash of everything that defines an agent; a changed hash means the agent must be updated"""
+    payload = json.dumps({"model": model, "instructions": instructions, "tools": tools or []}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AgentRegistry:
+    """Locally persisted agent ids and spare thread ids for one project endpoint
+
+    The file maps each project endpoint to {"agents": {name: {"id", "hash"}},
+    "threads": [thread ids]} so a restarted process can reuse everything that
+    was created before without calling the service. Worker processes share
+    the file: every change re-reads it under an exclusive lock on a sidecar
+    `.lock` file, so a spare thread is handed to exactly one of them.
+    """
+
+    def __init__(self, path=DEFAULT_REGISTRY_PATH, scope="default"):
+        self.path = path
+        self.scope = scope
+        self._lock = threading.Lock()
+        with self._locked() as data:
+            self._data = data
+
+    @contextmanager
+    def _locked(self, save=False):
+        """This scope's data, read under the thread and file locks; written back afterwards with `save`"""
+        with self._lock, open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            data = self._read()
+            scoped = data.get(self.scope, {})
+            self._data = {"agents": scoped.get("agents", {}), "threads": scoped.get("threads", [])}
+            yield self._data
+            if save:
+                data[self.scope] = self._data
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp_path, self.path)
+            # Closing the lock file releases the lock
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, name):
+        """Return (agent id, spec hash) of a registered agent, or (None, None)"""
+        # Agents rarely change; the copy from the last read is good enough here
+        entry = self._data["agents"].get(name)
+        return (entry["id"], entry["hash"]) if entry else (None, None)
+
+    def record(self, name, agent_id, agent_hash):
+        with self._locked(save=True) as data:
+            data["agents"][name] = {"id": agent_id, "hash": agent_hash}
+
+    def forget(self, name):
+        with self._locked(save=True) as data:
+            data["agents"].pop(name, None)
+
+    def pop_thread(self):
+        with self._locked(save=True) as data:
+            return data["threads"].pop() if data["threads"] else None
+
+    def push_thread(self, thread_id):
+        with self._locked(save=True) as data:
+            data["threads"].append(thread_id)
+
+    def reset(self):
+        """Forget every agent and spare thread, e.g. after they were deleted on the service side"""
+        with self._locked(save=True) as data:
+            data["agents"].clear()
+            data["threads"].clear()
+
+    def spare_threads(self):
+        with self._locked() as data:
+            return len(data["threads"])
+
+
+async def ensure_agent(agents_client, registry, name, model, instructions, tools=None):
+    """Return the id of a long-lived agent, creating or updating it only when its spec changed"""
+    agent_hash = spec_hash(model, instructions, tools)
+    agent_id, known_hash = registry.lookup(name)
+    if agent_id is not None and known_hash == agent_hash:
+        return agent_id
+
+    if agent_id is not None:
+        try:
+            await agents_client.update_agent(agent_id, model=model, name=name, instructions=instructions, tools=tools)
+            registry.record(name, agent_id, agent_hash)
+            return agent_id
+        except Exception:
+            # The agent is gone or cannot be updated, fall back to a new one
+            registry.forget(name)
+
+    agent = await agents_client.create_agent(model=model, name=name, instructions=instructions, tools=tools)
+    registry.record(name, agent.id, agent_hash)
+    return agent.id
+
+
+class AsyncThreadPool:
+    """Pool of pre-created, unused threads for the async agents client
+
+    Threads cannot be emptied, so a used thread is deleted instead of being
+    handed out again; the pool is topped up in the background so `acquire()`
+    normally returns without any service call.
+    """
+
+    def __init__(self, agents_client, registry, size=8):
+        self.agents_client = agents_client
+        self.registry = registry
+        self.size = size
+        self._background = set()
+        self._filling = False
+
+    async def acquire(self):
+        thread_id = self.registry.pop_thread()
+        self._spawn(self._refill())
+        if thread_id is None:
+            thread_id = (await self.agents_client.threads.create()).id
+        return thread_id
+
+    def release(self, thread_id):
+        self._spawn(self.agents_client.threads.delete(thread_id))
+
+    async def fill(self):
+        """Create threads until `size` spares are available"""
+        while self.registry.spare_threads() < self.size:
+            self.registry.push_thread((await self.agents_client.threads.create()).id)
+
+    async def _refill(self):
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            await self.fill()
+        except Exception:
+            pass  # refilling is best effort, acquire() creates threads on demand
+        finally:
+            self._filling = False
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._background.discard(task)
+        if not task.cancelled():
+            task.exception()  # mark failed deletes as retrieved
+
+
+class SyncThreadPool:
+    """Thread-based counterpart of AsyncThreadPool for the synchronous agents client"""
+
+    def __init__(self, agents, registry, size=8, max_workers=2):
+        self.agents = agents
+        self.registry = registry
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._filling = threading.Lock()
+
+    def acquire(self):
+        thread_id = self.registry.pop_thread()
+        self._executor.submit(self._refill)
+        if thread_id is None:
+            thread_id = self.agents.threads.create().id
+        return thread_id
+
+    def release(self, thread_id):
+        self._executor.submit(self.agents.threads.delete, thread_id)
+
+    def fill(self):
+        while self.registry.spare_threads() < self.size:
+            self.registry.push_thread(self.agents.threads.create().id)
+
+    def _refill(self):
+        if not self._filling.acquire(blocking=False):
+            return
+        try:
+            self.fill()
+        except Exception:
+            pass  # refilling is best effort, acquire() creates threads on demand
+        finally:
+            self._filling.release()
@@ -1,37 +1,28 @@
-import os
-from openai import AzureOpenAI
+from clients import MODEL_DEPLOYMENT
+from llm_backend import get_backend
 
-endpoint = os.getenv("PROJECT_ENDPOINT", "https://hackathon-group6-123.services.ai.azure.com")
-model_name = os.getenv("MODEL_DEPLOYMENT_NAME", "gpt-4.1")
-deployment = os.getenv("MODEL_DEPLOYMENT_NAME", "gpt-4.1")
 
-subscription_key = os.getenv("SUBSCRIPTION_KEY", "ApkSH2yYEJr03QypDtkp7K6ub2Zd4FCEntVvUCPs68uzmDvyYpYdJQQJ99BGACYeBjFXJ3w3AAAAACOGauXV")
+def ask(question, system_prompt="You are a helpful assistant."):
+    """Send one question to the model and return the answer text"""
+    return get_backend().chat(
+        messages=[
+            {
+                "role": "system",
+                "content": system_prompt,
+            },
+            {
+                "role": "user",
+                "content": question,
+            }
+        ],
+        max_completion_tokens=800,
+        temperature=1.0,
+        top_p=1.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0,
+        model=MODEL_DEPLOYMENT
+    )
 
-api_version = os.getenv("API_VERSION", "2024-12-01-preview")
 
-client = AzureOpenAI(
-    api_version=api_version,
-    azure_endpoint=endpoint,
-    api_key=subscription_key,
-)
-
-response = client.chat.completions.create(
-    messages=[
-        {
-            "role": "system",
-            "content": "You are a helpful assistant.",
-        },
-        {
-            "role": "user",
-            "content": "I am going to Paris, what should I see?",
-        }
-    ],
-    max_completion_tokens=800,
-    temperature=1.0,
-    top_p=1.0,
-    frequency_penalty=0.0,
-    presence_penalty=0.0,
-    model=deployment
-)
-
-print(response.choices[0].message.content)
\ No newline at end of file
+if __name__ == "__main__":
+    print(ask("I am going to Paris, what should I see?"))
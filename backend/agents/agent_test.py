@@ -1,112 +1,117 @@
 import os
 import json
-import time
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
 from dotenv import load_dotenv
 
+from agents.news_cache import NewsRiskCache
+from agents.news_enrichment import NEWS_RESPONSE_FORMAT, enrich_shipments, enrich_table
+from agents.run_completion import timed_stage
+from ingestion import DEFAULT_DATASET_PATH, load_shipments
+from llm_backend import AgentSpec, get_backend
+from risk_scoring import score_shipments
+from shipment_table import ShipmentTable, dumps
+
+# Run from the backend directory: python -m agents.agent_test
 load_dotenv()
 
 # ——————————————
 # 1. Setup
 # ——————————————
-PROJECT_ENDPOINT = os.environ["PROJECT_ENDPOINT"]
-DATA_AGENT_ID    = os.environ["DATA_INGEST_AGENT_ID"]
-NEWS_AGENT_ID    = os.environ["NEWS_AGENT_ID"]
-RISK_AGENT_ID    = os.environ["RISK_MODEL_AGENT_ID"]
-
-client = AIProjectClient(
-    endpoint=PROJECT_ENDPOINT,
-    credential=DefaultAzureCredential()
+# Agent calls go through the LLM backend (LLM_BACKEND=azure|stub, see llm_backend.py)
+NEWS_AGENT = AgentSpec("news_agent", agent_id=os.getenv("NEWS_AGENT_ID"), response_format=NEWS_RESPONSE_FORMAT)
+RISK_AGENT = AgentSpec("risk_model_agent", agent_id=os.getenv("RISK_MODEL_AGENT_ID"))
+
+DATASET_PATH         = os.getenv("SCRM_DATASET_PATH", DEFAULT_DATASET_PATH)
+NEWS_MAX_CONCURRENCY = int(os.getenv("NEWS_MAX_CONCURRENCY", "8"))
+NEWS_WINDOW_DAYS     = int(os.getenv("NEWS_WINDOW_DAYS", "7"))
+RISK_WEIGHTS         = json.loads(os.getenv("RISK_WEIGHTS", "{}"))
+RISK_BOOTSTRAP_SAMPLES = int(os.getenv("RISK_BOOTSTRAP_SAMPLES", "1000"))
+
+# News for a location barely changes within an hour; set NEWS_CACHE_DB to keep lookups across runs
+news_cache = NewsRiskCache(
+    ttl=float(os.getenv("NEWS_CACHE_TTL_SECONDS", "3600")),
+    db_path=os.getenv("NEWS_CACHE_DB") or None,
 )
 
+
 # ——————————————
 # 2. Ingest CSV
 # ——————————————
-ingest_thread = client.agents.threads.create(agent_id=DATA_AGENT_ID)
-ingest_prompt = (
-    "Ingest the chip SCRM dataset located at "
-    "`/backend/data/realistic_chip_scrm_dataset_100rows.csv` and return a JSON array of objects with exactly these fields:\n"
-    "- productId (string)\n"
-    "- chipType (string)\n"
-    "- node (string)\n"
-    "- partNumber (string)\n"
-    "- unitPrice (number)\n"
-    "- supplierLocation (string)\n"
-    "- wipInventory (integer)\n"
-    "- safetyStockLevel (integer)\n"
-    "- supplierRiskScore (string)\n"
-    "- countryRiskLevel (string)\n"
-    "- leadTimeRisk (string)"
-)
-client.agents.messages.create(
-    thread_id=ingest_thread.id,
-    role="user",
-    content=ingest_prompt
-)
+def ingest_shipments(path=DATASET_PATH):
+    # Parsed and validated locally, no model call needed
+    return load_shipments(path)
 
-# simple wait; in production poll for new messages instead
-time.sleep(5)
 
-ingest_msgs   = list(client.agents.messages.list(thread_id=ingest_thread.id))
-raw_shipments = ingest_msgs[-1].content
-shipments     = json.loads(raw_shipments)
-
-print("🚚 Ingested Shipments:")
-print(json.dumps(shipments, indent=2))
+def ingest_table(path=DATASET_PATH):
+    # Same validation, but stored by column (see shipment_table.py)
+    return ShipmentTable.load(path)
 
 
 # ——————————————
 # 3. Enrich with News Risk
 # ——————————————
-news_thread = client.agents.threads.create(agent_id=NEWS_AGENT_ID)
-
-# Build queries per supplierLocation
-queries = [
-    f"{pkg['supplierLocation']} shipping conflict news last 7 days"
-    for pkg in shipments
-]
-news_payload = {"queries": queries}
-
-client.agents.messages.create(
-    thread_id=news_thread.id,
-    role="user",
-    content=json.dumps(news_payload)
-)
-
-time.sleep(5)
-
-news_msgs     = list(client.agents.messages.list(thread_id=news_thread.id))
-news_insights = json.loads(news_msgs[-1].content)
+def enrich_with_news(backend, shipments):
+    # One query per unique supplierLocation, sent concurrently and merged back by location
+    def ask(content):
+        return backend.ask_agent(NEWS_AGENT, content)
 
-# Merge riskArticleCount into each shipment
-for pkg, insight in zip(shipments, news_insights):
-    pkg["riskArticleCount"] = insight.get("riskCount", 0)
-
-print("\n📰 Shipments with News Risk:")
-print(json.dumps(shipments, indent=2))
+    enrich = enrich_table if isinstance(shipments, ShipmentTable) else enrich_shipments
+    return enrich(
+        shipments, ask,
+        max_concurrency=NEWS_MAX_CONCURRENCY, cache=news_cache, window_days=NEWS_WINDOW_DAYS,
+    )
 
 
 # ——————————————
 # 4. Compute Risk Scores & CIs
 # ——————————————
-risk_thread = client.agents.threads.create(agent_id=RISK_AGENT_ID)
-
-risk_request = {
-    "query": "Compute overall risk score and 95% confidence interval for each shipment",
-    "shipments": shipments
-}
-
-client.agents.messages.create(
-    thread_id=risk_thread.id,
-    role="user",
-    content=json.dumps(risk_request)
-)
-
-time.sleep(5)
-
-risk_msgs   = list(client.agents.messages.list(thread_id=risk_thread.id))
-final_output = json.loads(risk_msgs[-1].content)
-
-print("\n📊 Risk Modeling Results:")
-print(json.dumps(final_output, indent=2))
+def compute_risk(shipments):
+    # Scores and bootstrap CIs are computed locally with NumPy
+    return score_shipments(shipments, weights=RISK_WEIGHTS, n_boot=RISK_BOOTSTRAP_SAMPLES)
+
+
+def explain_risk(backend, shipments, risk_results, top_n=10):
+    # The Risk agent only writes the narrative for the riskiest shipments
+    # Risk results are in shipment order, so the riskiest shipments are found by position
+    riskiest = sorted(range(len(risk_results)), key=lambda index: risk_results[index]["riskScore"], reverse=True)[:top_n]
+    if isinstance(shipments, ShipmentTable):
+        rows = shipments.take(riskiest).records()
+    else:
+        rows = [shipments[index] for index in riskiest]
+    risk_request = {
+        "query": "Explain the main drivers behind these shipment risk scores and suggest mitigations",
+        "shipments": [{**row, **risk_results[index]} for row, index in zip(rows, riskiest)]
+    }
+    return backend.ask_agent(RISK_AGENT, dumps(risk_request))
+
+
+def main():
+    backend = get_backend()
+    timings = {}
+
+    with timed_stage("ingest", timings):
+        shipments = ingest_table()
+    print(f"🚚 Ingested Shipments ({len(shipments)} rows, {shipments.nbytes:,} bytes):")
+    print(shipments.to_json().decode("utf-8"))
+
+    with timed_stage("news", timings):
+        shipments = enrich_with_news(backend, shipments)
+    print(f"\n📰 Shipments with News Risk (cache: {news_cache.stats()}):")
+    print(shipments.to_json().decode("utf-8"))
+
+    with timed_stage("risk", timings):
+        final_output = compute_risk(shipments)
+    print("\n📊 Risk Modeling Results:")
+    print(dumps(final_output))
+
+    with timed_stage("narrative", timings):
+        narrative = explain_risk(backend, shipments, final_output)
+    print("\n📝 Risk Narrative:")
+    print(narrative)
+
+    print("\n⏱️ Stage timings:")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<10} {seconds:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
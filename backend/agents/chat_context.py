@@ -0,0 +1,105 @@
+import os
+
+from llm_backend import estimate_tokens
+
+# Prompt tokens sent per turn: system prompt, summary and the most recent turns
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "6000"))
+# Once over budget, older turns are folded into the summary until the window is back below this share
+CHAT_CONTEXT_LOW_WATER = 0.6
+# Length limit of the running summary of older turns
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "400"))
+# Role markers and separators the API adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own later reference. Keep facts, names, numbers, "
+    "decisions and open questions; drop greetings and small talk. Answer with the summary only."
+)
+
+
+def message_tokens(message):
+    return estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ChatContext:
+    """Sliding window over a chat: the pinned system prompt, a summary of older turns and the recent turns
+
+    `history` keeps the full transcript (for saving); messages() is what is
+    sent to the model and stays within `max_tokens` however long the session
+    runs. When the window grows past the budget, the oldest turns are folded
+    into a running summary with one extra model call, down to
+    `low_water` of the budget so that this happens every few turns rather
+    than on every turn. Without a backend (or when the summary call fails)
+    the evicted turns are dropped instead.
+    """
+
+    def __init__(self, system_prompt, backend=None, max_tokens=CHAT_CONTEXT_TOKENS,
+                 low_water=CHAT_CONTEXT_LOW_WATER, summary_tokens=CHAT_SUMMARY_TOKENS, model=None):
+        self.system = {"role": "system", "content": system_prompt}
+        self.backend = backend
+        self.max_tokens = max_tokens
+        self.low_water = low_water
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.summary = None
+        self.history = [self.system]
+        self._window = []
+        self._window_tokens = 0
+
+    def add(self, role, content):
+        message = {"role": role, "content": content}
+        self.history.append(message)
+        self._window.append(message)
+        self._window_tokens += message_tokens(message)
+        if self.tokens() > self.max_tokens:
+            self._compact()
+
+    def messages(self):
+        """The messages to send: system prompt, summary of older turns (if any) and the recent turns"""
+        pinned = [self.system]
+        if self.summary:
+            pinned.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return pinned + self._window
+
+    def tokens(self):
+        """Estimated prompt tokens of messages()"""
+        pinned = message_tokens(self.system)
+        if self.summary:
+            pinned += estimate_tokens(self.summary) + MESSAGE_OVERHEAD_TOKENS
+        return pinned + self._window_tokens
+
+    def _compact(self):
+        target = self.max_tokens * self.low_water
+        evicted = []
+        # Always keep the latest message (the question about to be answered)
+        while len(self._window) > 1 and self.tokens() > target:
+            message = self._window.pop(0)
+            self._window_tokens -= message_tokens(message)
+            evicted.append(message)
+        # Start the window on a user turn so it never opens with an orphaned reply
+        while len(self._window) > 1 and self._window[0]["role"] != "user":
+            message = self._window.pop(0)
+            self._window_tokens -= message_tokens(message)
+            evicted.append(message)
+        if evicted:
+            self.summary = self._summarize(evicted)
+
+    def _summarize(self, evicted):
+        if self.backend is None:
+            return self.summary
+        transcript = "\n\n".join(f"{message['role'].upper()}: {message['content']}" for message in evicted)
+        if self.summary:
+            transcript = f"Earlier summary:\n{self.summary}\n\n{transcript}"
+        params = {"model": self.model} if self.model else {}
+        try:
+            summary = self.backend.chat(
+                messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+                max_completion_tokens=self.summary_tokens,
+                temperature=0.2,
+                **params,
+            )
+        except Exception as e:
+            print(f"\nError summarizing earlier turns: {e}")
+            return self.summary
+        # Backends that ignore max_completion_tokens must not grow the pinned part past its share
+        return summary[:self.summary_tokens * 4]
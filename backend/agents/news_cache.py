@@ -0,0 +1,126 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from agents.news_enrichment import location_key
+
+
+def cache_key(location, window_days):
+    return f"{location_key(location)}|{window_days}d"
+
+
+class NewsRiskCache:
+    """LRU + TTL cache for News agent lookups, keyed by normalized location and time window
+
+    Entries live in memory (at most `max_entries`, least recently used evicted
+    first). When `db_path` is given they are also written to a SQLite file so a
+    fresh process can reuse lookups that have not expired yet.
+    """
+
+    def __init__(self, ttl=3600, max_entries=1024, db_path=None, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS news_risk ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, location, window_days=7):
+        """Return the cached value, or None when it is missing or expired"""
+        key = cache_key(location, window_days)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM news_risk WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self._store(key, entry)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._delete(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def expires_at(self, location, window_days=7):
+        """When the in-memory entry for a location expires, or None when it is not cached"""
+        with self._lock:
+            entry = self._entries.get(cache_key(location, window_days))
+        return entry[1] if entry is not None else None
+
+    def set(self, location, value, window_days=7):
+        key = cache_key(location, window_days)
+        entry = (value, self._clock() + self.ttl)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO news_risk (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), entry[1]),
+                )
+                self._db.commit()
+
+    def invalidate(self, location=None, window_days=None):
+        """Drop entries for one location (any window unless given), or everything when no location is passed"""
+        with self._lock:
+            if location is None:
+                keys = list(self._entries)
+                self._entries.clear()
+                if self._db is not None:
+                    self._db.execute("DELETE FROM news_risk")
+                    self._db.commit()
+                return len(keys)
+
+            if window_days is None:
+                prefix = f"{location_key(location)}|"
+                keys = [key for key in self._entries if key.startswith(prefix)]
+                if self._db is not None:
+                    # Escape LIKE wildcards so the prefix is matched literally
+                    pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                    self._db.execute("DELETE FROM news_risk WHERE key LIKE ? ESCAPE '\\'", (pattern,))
+            else:
+                keys = [cache_key(location, window_days)]
+                if self._db is not None:
+                    self._db.execute("DELETE FROM news_risk WHERE key = ?", (keys[0],))
+            for key in keys:
+                self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.commit()
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM news_risk WHERE key = ?", (key,))
+            self._db.commit()
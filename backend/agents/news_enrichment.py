@@ -0,0 +1,122 @@
+import json
+import contextvars
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from structured_output import ask_structured, json_schema_format
+
+NEWS_QUERY_TEMPLATE = "{location} shipping conflict news last {days} days"
+
+# What the News agent answers for one query; response_format asks for exactly this
+NEWS_INSIGHT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string"},
+        "riskCount": {"type": "integer", "minimum": 0},
+    },
+    "required": ["riskCount"],
+}
+NEWS_RESPONSE_FORMAT = json_schema_format("news_insight", NEWS_INSIGHT_SCHEMA)
+# Agents set up before the schema answer with a list of insights, one per query
+# (an empty list answers nothing and is repaired rather than read as riskCount 0)
+NEWS_REPLY_SCHEMA = {"anyOf": [NEWS_INSIGHT_SCHEMA, {"type": "array", "items": NEWS_INSIGHT_SCHEMA, "minItems": 1}]}
+
+
+def location_key(location):
+    """Normalize a supplierLocation so 'Taiwan', ' taiwan ' and 'TAIWAN' share one lookup"""
+    return " ".join(str(location).split()).lower()
+
+
+def unique_locations(shipments):
+    """Map each distinct location key to the first spelling seen in the shipments"""
+    locations = {}
+    for pkg in shipments:
+        key = location_key(pkg["supplierLocation"])
+        locations.setdefault(key, pkg["supplierLocation"])
+    return locations
+
+
+def risk_count(insights):
+    """riskCount of a parsed News agent reply (NEWS_REPLY_SCHEMA) for a single query"""
+    if isinstance(insights, list):
+        insights = insights[0]
+    return int(insights["riskCount"])
+
+
+def fetch_news_risk(ask, locations, max_concurrency=8, cache=None, window_days=7):
+    """Query the News agent once per unique location, at most `max_concurrency` at a time
+
+    `ask(content)` sends one message to the News agent and returns the reply text.
+    Locations found in `cache` (a NewsRiskCache) are not sent to the agent.
+    A reply that does not parse is repaired for its location alone (see
+    structured_output.ask_structured). Returns a dict of location key -> riskCount.
+    A lookup that fails is logged and left out (and out of the cache), so
+    callers can tell it from a count of 0; the others are still returned and cached.
+    """
+    def lookup(location):
+        query = NEWS_QUERY_TEMPLATE.format(location=location, days=window_days)
+        return risk_count(ask_structured(ask, json.dumps({"queries": [query]}), NEWS_REPLY_SCHEMA, stage="news"))
+
+    risk_counts = {}
+    pending = {}
+    for key, location in locations.items():
+        cached = cache.get(location, window_days) if cache is not None else None
+        if cached is None:
+            pending[key] = location
+        else:
+            risk_counts[key] = cached
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as pool:
+            # Each lookup runs in a copy of the caller's context, so its agent span nests under the current stage
+            futures = {
+                key: pool.submit(contextvars.copy_context().run, lookup, location)
+                for key, location in pending.items()
+            }
+            for key, future in futures.items():
+                try:
+                    risk_counts[key] = future.result()
+                except Exception as e:
+                    print(f"News lookup for {pending[key]} failed: {e}")
+                    continue
+                if cache is not None:
+                    cache.set(pending[key], risk_counts[key], window_days)
+    return risk_counts
+
+
+def merge_news_risk(shipments, risk_counts):
+    """Set riskArticleCount on every shipment from the per-location counts
+
+    A shipment whose location has no count (its lookup failed) is scored
+    with 0 and marked with `newsLookupFailed`, so it is not stored as
+    enriched (see supplychains.shipment_state()).
+    """
+    for pkg in shipments:
+        key = location_key(pkg["supplierLocation"])
+        pkg["riskArticleCount"] = risk_counts.get(key, 0)
+        if key not in risk_counts:
+            pkg["newsLookupFailed"] = True
+        else:
+            pkg.pop("newsLookupFailed", None)
+    return shipments
+
+
+def enrich_shipments(shipments, ask, max_concurrency=8, cache=None, window_days=7):
+    """Dedupe supplier locations, fan the news lookups out and merge the counts back by key"""
+    risk_counts = fetch_news_risk(
+        ask, unique_locations(shipments),
+        max_concurrency=max_concurrency, cache=cache, window_days=window_days,
+    )
+    return merge_news_risk(shipments, risk_counts)
+
+
+def enrich_table(table, ask, max_concurrency=8, cache=None, window_days=7):
+    """enrich_shipments() for a ShipmentTable: one lookup per distinct location, counts mapped through its dictionary"""
+    column = table.columns["supplierLocation"]
+    locations = {}
+    for location in column.categories:
+        locations.setdefault(location_key(location), location)
+    risk_counts = fetch_news_risk(ask, locations, max_concurrency=max_concurrency, cache=cache, window_days=window_days)
+    counts = {location: risk_counts.get(location_key(location), 0) for location in column.categories}
+    return table.with_column("riskArticleCount", column.map(counts, dtype=np.int32))
@@ -0,0 +1,136 @@
+import time
+from contextlib import contextmanager
+
+from azure.ai.agents.models import AgentStreamEvent, ListSortOrder, MessageRole, ThreadRun
+
+import telemetry
+
+# Run states after which the agent will not produce anything else
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+
+
+class RunFailedError(RuntimeError):
+    """Raised when an agent run ends in any state other than `completed`"""
+
+
+class RunTimeoutError(TimeoutError):
+    """Raised when an agent run does not finish before its deadline"""
+
+
+class AgentReply:
+    """Text of an agent answer together with the run that produced it"""
+
+    def __init__(self, text, run, elapsed):
+        self.text = text
+        self.run = run
+        self.elapsed = elapsed
+
+
+def _status(run):
+    return str(getattr(run.status, "value", run.status)).lower()
+
+
+def check_completed(run):
+    """Raise RunFailedError unless `run` (None when its stream ended without one) completed"""
+    if run is None:
+        raise RunFailedError("The run's event stream ended without reporting the run")
+    status = _status(run)
+    if status != "completed":
+        raise RunFailedError(f"Run {run.id} ended with status {status}: {run.last_error}")
+
+
+def wait_for_run(agents, thread_id, run_id, timeout=120.0, initial_delay=0.25, max_delay=4.0, backoff=2.0):
+    """Poll a run with exponential backoff until it reaches a terminal state
+
+    The first checks happen quickly so short runs return almost immediately;
+    the delay then doubles up to `max_delay`. Raises RunTimeoutError (after
+    cancelling the run) when `timeout` seconds pass without completion.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        run = agents.runs.get(thread_id=thread_id, run_id=run_id)
+        status = _status(run)
+        if status in TERMINAL_STATUSES:
+            return run
+        if status == "requires_action":
+            agents.runs.cancel(thread_id=thread_id, run_id=run_id)
+            raise RunFailedError(f"Run {run_id} requires tool outputs, which this pipeline does not provide")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            agents.runs.cancel(thread_id=thread_id, run_id=run_id)
+            raise RunTimeoutError(f"Run {run_id} did not finish within {timeout} seconds")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * backoff, max_delay)
+
+
+def stream_run(agents, thread_id, agent_id, timeout=120.0, **run_options):
+    """Start a run (with `run_options` such as response_format) and follow its event stream until it ends"""
+    deadline = time.monotonic() + timeout
+    run = None
+    with agents.runs.stream(thread_id=thread_id, agent_id=agent_id, **run_options) as stream:
+        for event_type, event_data, _ in stream:
+            if isinstance(event_data, ThreadRun):
+                run = event_data
+                if _status(run) in TERMINAL_STATUSES:
+                    return run
+            if event_type in (AgentStreamEvent.ERROR, AgentStreamEvent.DONE):
+                break
+            if time.monotonic() > deadline:
+                if run is not None:
+                    agents.runs.cancel(thread_id=thread_id, run_id=run.id)
+                raise RunTimeoutError(f"Run on thread {thread_id} did not finish within {timeout} seconds")
+    if run is None:
+        raise RunFailedError(f"Stream for thread {thread_id} ended before a run was created")
+    # The stream closed without a final run event, fall back to polling
+    return wait_for_run(agents, thread_id, run.id, timeout=max(deadline - time.monotonic(), 0.0))
+
+
+def last_reply_text(agents, thread_id, run_id):
+    """Return the newest agent message text written by the given run"""
+    messages = agents.messages.list(thread_id=thread_id, run_id=run_id, order=ListSortOrder.DESCENDING)
+    for message in messages:
+        if message.role == MessageRole.AGENT and message.text_messages:
+            return message.text_messages[-1].text.value
+    raise RunFailedError(f"Run {run_id} completed without an agent message")
+
+
+def ask_agent(agents, agent_id, content, thread_id=None, use_stream=False, timeout=120.0, thread_pool=None,
+              response_format=None):
+    """Send `content` to an agent and return its AgentReply as soon as the run completes
+
+    Without a `thread_id` the message goes to a fresh thread, taken from
+    `thread_pool` (a SyncThreadPool) when given and released afterwards.
+    `response_format` overrides the agent's for this run.
+    """
+    run_options = {"response_format": response_format} if response_format is not None else {}
+    started = time.perf_counter()
+    pooled = thread_id is None and thread_pool is not None
+    if thread_id is None:
+        thread_id = thread_pool.acquire() if pooled else agents.threads.create().id
+    try:
+        agents.messages.create(thread_id=thread_id, role="user", content=content)
+
+        if use_stream:
+            run = stream_run(agents, thread_id, agent_id, timeout=timeout, **run_options)
+        else:
+            run = agents.runs.create(thread_id=thread_id, agent_id=agent_id, **run_options)
+            run = wait_for_run(agents, thread_id, run.id, timeout=timeout)
+
+        check_completed(run)
+        return AgentReply(last_reply_text(agents, thread_id, run.id), run, time.perf_counter() - started)
+    finally:
+        if pooled:
+            thread_pool.release(thread_id)
+
+
+@contextmanager
+def timed_stage(name, timings):
+    """Record the wall-clock duration of a pipeline stage in `timings[name]` and trace it as a `stage` span"""
+    started = time.perf_counter()
+    try:
+        with telemetry.span("stage", name):
+            yield
+    finally:
+        timings[name] = time.perf_counter() - started
@@ -1,25 +1,22 @@
 import os
-from openai import AzureOpenAI
 from datetime import datetime
 
+from agents.chat_context import ChatContext
+from clients import MODEL_DEPLOYMENT
+from llm_backend import get_backend
+from semantic_cache import open_cache, scope_id
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+
 def initialize_client():
-    """Initialize the Azure OpenAI client"""
-    endpoint = os.getenv("PROJECT_ENDPOINT", "https://hackathon-group6-123.services.ai.azure.com")
-    deployment = os.getenv("MODEL_DEPLOYMENT_NAME", "gpt-4.1")
-    subscription_key = os.getenv("SUBSCRIPTION_KEY", "ApkSH2yYEJr03QypDtkp7K6ub2Zd4FCEntVvUCPs68uzmDvyYpYdJQQJ99BGACYeBjFXJ3w3AAAAACOGauXV")
-    api_version = os.getenv("API_VERSION", "2024-12-01-preview")
-
-    return AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=endpoint,
-        api_key=subscription_key,
-    ), deployment
+    """Return the configured LLM backend and the model deployment"""
+    return get_backend(), MODEL_DEPLOYMENT
 
 def save_conversation(messages, filename="conversation_history.txt"):
     """Save the conversation history to a file"""
     try:
-        os.makedirs("backend/agents/output", exist_ok=True)
-        filepath = f"backend/agents/output/{filename}"
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        filepath = os.path.join(OUTPUT_DIR, filename)
         with open(filepath, "w", encoding="utf-8") as f:
             f.write(f"Conversation History - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("=" * 50 + "\n\n")
@@ -41,13 +38,15 @@ def main():
     # Initialize client and conversation
     client, deployment = initialize_client()
     
-    # Initialize conversation with system message
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a helpful assistant. Be conversational and engaging while providing accurate and useful information."
-        }
-    ]
+    # Initialize conversation with system message; only a token-bounded window of it is sent per turn
+    context = ChatContext(
+        "You are a helpful assistant. Be conversational and engaging while providing accurate and useful information.",
+        backend=client,
+        model=deployment,
+    )
+    # Near-identical questions are answered from earlier replies (SEMANTIC_CACHE=0 to disable)
+    reply_cache = open_cache("chat")
+    cache_scope = scope_id(deployment, context.system["content"])
 
     while True:
         # Get user input
@@ -64,25 +63,31 @@ def main():
         
         # Check for save command
         if user_input.lower() == 'save':
-            save_conversation(messages)
+            save_conversation(context.history)
             continue
 
         # Skip empty inputs
         if not user_input:
             continue
 
+        # The previous reply is the context a follow-up question refers to
+        previous = context.history[-1]["content"] if context.history[-1]["role"] == "assistant" else None
+
         # Add user message to conversation
-        messages.append({
-            "role": "user",
-            "content": user_input
-        })
+        context.add("user", user_input)
 
         try:
-            # Get response from Azure OpenAI
+            # Get response from the LLM backend
             print("Assistant: ", end="", flush=True)
-            
-            response = client.chat.completions.create(
-                messages=messages,
+
+            cached = reply_cache.get(cache_scope, user_input, context=previous) if reply_cache is not None else None
+            if cached is not None:
+                print(cached)
+                context.add("assistant", cached)
+                continue
+
+            response = client.chat(
+                messages=context.messages(),
                 max_completion_tokens=4000,
                 temperature=0.7,
                 top_p=1.0,
@@ -94,28 +99,25 @@ def main():
 
             # Collect and display the streaming response
             assistant_response = ""
-            for chunk in response:
-                if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    print(content, end="", flush=True)
-                    assistant_response += content
+            for content in response:
+                print(content, end="", flush=True)
+                assistant_response += content
             
             print()  # New line after response
 
             # Add assistant response to conversation
             if assistant_response:
-                messages.append({
-                    "role": "assistant",
-                    "content": assistant_response
-                })
+                context.add("assistant", assistant_response)
+                if reply_cache is not None:
+                    reply_cache.set(cache_scope, user_input, assistant_response, context=previous)
 
         except Exception as e:
             print(f"Error getting response: {e}")
             print("Please try again.")
 
     # Auto-save conversation on exit
-    if len(messages) > 1:  # Only save if there was actual conversation
-        save_conversation(messages, f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    if len(context.history) > 1:  # Only save if there was actual conversation
+        save_conversation(context.history, f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
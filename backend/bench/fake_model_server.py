@@ -0,0 +1,148 @@
+"""Local OpenAI-compatible chat completions server for benchmarks and offline runs
+
+Run from the backend directory:
+
+    python -m bench.fake_model_server --port 8089 --latency 0.2
+
+and point the app at it with LLM_BACKEND=chat, AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8089
+and any SUBSCRIPTION_KEY. Replies come from StubBackend, so they are
+deterministic and schema-valid for the pipeline.
+"""
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backend import StubBackend, estimate_tokens
+
+
+class FakeModelServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, completion_tokens=200):
+        super().__init__(address, _Handler)
+        self.stub = StubBackend(latency=latency, jitter=jitter, completion_tokens=completion_tokens)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stub.usage_snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unsupported path {path}"}})
+            return
+
+        stub = self.server.stub
+        messages = request.get("messages", [])
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        reply = stub.reply_for(messages[-1].get("content", "") if messages else "", "assistant")
+        usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(reply)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        stub.record_usage(usage["prompt_tokens"], usage["completion_tokens"])
+        delay = stub._delay(stub._seed(prompt))
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "fake-model")
+        if request.get("stream"):
+            self._stream(completion_id, model, reply, usage, delay)
+            return
+
+        time.sleep(delay)
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, model, reply, usage, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices, usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunks = list(self.server.stub._stream(reply, delay))
+        for chunk in chunks:
+            event([{"index": 0, "delta": {"role": "assistant", "content": chunk}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        event([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, completion_tokens=200):
+    """Start a FakeModelServer on a background thread and return it (port 0 picks a free port)"""
+    server = FakeModelServer((host, port), latency=latency, jitter=jitter, completion_tokens=completion_tokens)
+    thread = threading.Thread(target=server.serve_forever, name="fake-model-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per completion")
+    parser.add_argument("--tokens", type=int, default=200, help="completion tokens per reply")
+    args = parser.parse_args()
+
+    server = FakeModelServer((args.host, args.port), latency=args.latency, jitter=args.jitter, completion_tokens=args.tokens)
+    print(f"Fake model server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""End-to-end benchmarks for the analysis pipeline
+
+Run from the backend directory:
+
+    python -m bench.run_benchmarks                        # 100, 10k and 1M rows
+    python -m bench.run_benchmarks --sizes 100 10000 --latency 0.2 --output bench/results/new.json
+    python -m bench.run_benchmarks --compare bench/results/old.json
+
+Every model call goes to the bundled fake model server (LLM_BACKEND=chat), so
+the numbers cover the real HTTP clients, prompts and endpoints without an Azure
+endpoint. Per stage the report has throughput (rows/s), p50/p95/p99 latency,
+peak RSS and tokens; results are written as JSON and can be compared against a
+previous run to spot regressions.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import contextlib
+import platform
+import resource
+import subprocess
+import threading
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+STAGES = ("ingest", "news", "risk", "narrative", "endpoints")
+# Metrics where a higher value is a regression
+LOWER_IS_BETTER = ("p50", "p95", "p99", "peakRssMb", "tokens")
+
+
+def percentile(samples, q):
+    """Linear-interpolated percentile of `samples` (q in 0..100)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageRecorder:
+    """Collects wall time, per-operation latencies, tokens and peak RSS of one stage"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def timed(self, func):
+        """Wrap `func` so every call adds one latency sample"""
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.latencies.append(time.perf_counter() - started)
+        return wrapper
+
+    def run(self, rows, repeat, func):
+        walls = []
+        usage_before = self.backend.usage_snapshot()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            walls.append(time.perf_counter() - started)
+        usage_after = self.backend.usage_snapshot()
+
+        # Stages made of several operations (model calls, requests) report per-operation latency
+        samples = self.latencies or walls
+        calls = usage_after["calls"] - usage_before["calls"]
+        tokens = sum(usage_after[key] - usage_before[key] for key in ("prompt_tokens", "completion_tokens"))
+        wall = sum(walls) / len(walls)
+        return {
+            "rows": rows,
+            "repeat": repeat,
+            "wallSeconds": round(wall, 6),
+            "throughput": round(rows / wall, 2) if wall else None,
+            "operations": len(samples),
+            "p50": round(percentile(samples, 50), 6),
+            "p95": round(percentile(samples, 95), 6),
+            "p99": round(percentile(samples, 99), 6),
+            "peakRssMb": round(peak_rss_mb(), 1),
+            "modelCalls": calls // repeat,
+            "tokens": tokens // repeat,
+        }
+
+
+class AppServer:
+    """The FastAPI app from main.py served by uvicorn on a background thread"""
+
+    def __init__(self, port):
+        import uvicorn
+        from main import app
+
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, name="bench-app", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("App server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def bench_endpoints(http, recorder, poll_interval):
+    """One /run-analysis job from submission until it finishes, plus a GET /supplychains"""
+    get_supplychains = recorder.timed(lambda: http.get("/supplychains").raise_for_status())
+
+    @recorder.timed
+    def run_analysis():
+        response = http.post("/run-analysis")
+        response.raise_for_status()
+        job_id = response.json()["jobId"]
+        while True:
+            job = http.get(f"/jobs/{job_id}").json()
+            if job["status"] in ("succeeded", "failed", "cancelled"):
+                break
+            time.sleep(poll_interval)
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"Analysis job {job_id} {job['status']}: {job['error']}")
+
+    def run():
+        get_supplychains()
+        run_analysis()
+    return run
+
+
+def run_size(rows, args, backend):
+    import httpx
+
+    import orchestrator
+    from agents import agent_test
+    from agents.news_enrichment import enrich_shipments
+    from bench.synthetic import dataset_path
+    from risk_scoring import score_shipments
+
+    path = dataset_path(rows, seed=args.seed)
+    results = {}
+    state = {}
+
+    def stage(name, func):
+        if name not in args.stages:
+            return
+        recorder = StageRecorder(backend)
+        print(f"  {name:<10}", end=" ", flush=True)
+        result = results[name] = recorder.run(rows, args.repeat, func(recorder))
+        print(f"{result['wallSeconds']:8.3f}s  {result['throughput'] or 0:12.1f} rows/s  "
+              f"p95 {result['p95']:.4f}s  {result['tokens']} tokens  {result['peakRssMb']} MB")
+
+    def ingest(recorder):
+        def run():
+            state["shipments"] = agent_test.ingest_shipments(path)
+        return run
+
+    def news(recorder):
+        # Uncached, so every run pays for one model call per unique location
+        ask = recorder.timed(lambda content: backend.ask_agent(agent_test.NEWS_AGENT, content))
+
+        def run():
+            state["enriched"] = enrich_shipments(
+                state["shipments"], ask, max_concurrency=agent_test.NEWS_MAX_CONCURRENCY, cache=None,
+                window_days=agent_test.NEWS_WINDOW_DAYS,
+            )
+        return run
+
+    def risk(recorder):
+        def run():
+            state["risk"] = score_shipments(state.get("enriched", state["shipments"]), n_boot=args.bootstrap)
+        return run
+
+    def narrative(recorder):
+        explain = recorder.timed(agent_test.explain_risk)
+
+        def run():
+            explain(backend, state.get("enriched", state["shipments"]), state["risk"])
+        return run
+
+    # Stages that are not benchmarked still run once when a later stage needs their output
+    if {"news", "risk", "narrative"} & set(args.stages) and "ingest" not in args.stages:
+        ingest(None)()
+    stage("ingest", ingest)
+    stage("news", news)
+    if "narrative" in args.stages and "risk" not in args.stages:
+        risk(None)()
+    stage("risk", risk)
+    stage("narrative", narrative)
+    state.clear()
+
+    if "endpoints" in args.stages:
+        if rows > args.max_endpoint_rows:
+            print(f"  {'endpoints':<10} skipped (more than --max-endpoint-rows {args.max_endpoint_rows})")
+        else:
+            orchestrator.DATASET_PATH = path
+            with httpx.Client(base_url=args.app_url, timeout=None) as http:
+                stage("endpoints", lambda recorder: bench_endpoints(http, recorder, args.poll_interval))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Metrics that got worse than the baseline by more than `threshold` (a fraction)"""
+    regressions = []
+    for size, stages in results["sizes"].items():
+        for stage, metrics in stages.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(stage)
+            if not before:
+                continue
+            checks = [(key, metrics.get(key), before.get(key)) for key in LOWER_IS_BETTER]
+            # Throughput regresses when it drops
+            checks.append(("throughput", before.get("throughput"), metrics.get("throughput")))
+            for key, new, old in checks:
+                if new is None or old is None or old <= 0:
+                    continue
+                change = (new - old) / old
+                if change > threshold:
+                    regressions.append({"size": size, "stage": stage, "metric": key,
+                                        "baseline": before.get(key), "current": metrics.get(key),
+                                        "change": round(change, 4)})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 1000000], help="dataset sizes in rows")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage and size")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic datasets")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.02, help="fake model extra random seconds per completion")
+    parser.add_argument("--tokens", type=int, default=200, help="fake model completion tokens per reply")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="bootstrap samples of the risk stage")
+    parser.add_argument("--max-endpoint-rows", type=int, default=10000,
+                        help="largest dataset sent through /run-analysis")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="seconds between /jobs polls")
+    parser.add_argument("--output", help="results file (default bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="baseline results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown before flagging")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Configure the pipeline before any of its modules reads the environment
+    model_port = free_port()
+    os.environ["LLM_BACKEND"] = "chat"
+    os.environ["AZURE_OPENAI_ENDPOINT"] = f"http://127.0.0.1:{model_port}"
+    os.environ.setdefault("SUBSCRIPTION_KEY", "bench")
+    os.environ["HTTP_MAX_RETRIES"] = "0"
+    # Keep benchmark runs out of the development store
+    os.environ["SCRM_DB_PATH"] = os.path.join(BENCH_DIR, ".data", "bench.db")
+
+    from bench.fake_model_server import start_server
+    from llm_backend import get_backend
+
+    model_server = start_server(port=model_port, latency=args.latency, jitter=args.jitter, completion_tokens=args.tokens)
+
+    backend = get_backend()
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "gitRevision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "sizes": {},
+    }
+
+    port = free_port()
+    args.app_url = f"http://127.0.0.1:{port}"
+    try:
+        with AppServer(port) if "endpoints" in args.stages else contextlib.nullcontext():
+            for rows in args.sizes:
+                print(f"{rows} rows")
+                results["sizes"][str(rows)] = run_size(rows, args, backend)
+    finally:
+        model_server.shutdown()
+        model_server.server_close()
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['size']} rows {regression['stage']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
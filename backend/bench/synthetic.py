@@ -0,0 +1,72 @@
+import os
+import csv
+
+import numpy as np
+
+from ingestion import DEFAULT_DATASET_PATH
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, ".data")
+
+# Columns that identify a row and are numbered instead of sampled
+ID_COLUMNS = {"ProductID": "PROD", "PartNumber": "CH"}
+
+
+def _column_profiles(template_path):
+    """Per column: ('numeric', values, is_integer) or ('categorical', values)"""
+    with open(template_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = list(zip(*reader))
+
+    profiles = {}
+    for name, values in zip(header, columns):
+        try:
+            numbers = np.array([float(value) for value in values])
+        except ValueError:
+            profiles[name] = ("categorical", np.array(sorted(set(values))))
+            continue
+        is_integer = all("." not in value for value in values)
+        profiles[name] = ("numeric", numbers, is_integer)
+    return header, profiles
+
+
+def generate_dataset(rows, path, template_path=DEFAULT_DATASET_PATH, seed=0, chunk_size=100000):
+    """Write a synthetic SCRM CSV with `rows` rows shaped like the bundled 100-row dataset
+
+    Categorical columns are sampled from the values seen in the template and
+    numeric columns from its values with +/-10% noise; ProductID and PartNumber
+    stay unique.
+    """
+    header, profiles = _column_profiles(template_path)
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for start in range(0, rows, chunk_size):
+            count = min(chunk_size, rows - start)
+            columns = []
+            for name in header:
+                if name in ID_COLUMNS:
+                    columns.append([f"{ID_COLUMNS[name]}{i}" for i in range(start, start + count)])
+                    continue
+                profile = profiles[name]
+                if profile[0] == "categorical":
+                    columns.append(rng.choice(profile[1], size=count))
+                    continue
+                values = rng.choice(profile[1], size=count) * rng.uniform(0.9, 1.1, size=count)
+                columns.append(np.rint(values).astype(np.int64) if profile[2] else np.round(values, 2))
+            writer.writerows(zip(*columns))
+    return path
+
+
+def dataset_path(rows, seed=0):
+    """Path of the cached synthetic dataset with `rows` rows, generating it on first use"""
+    path = os.path.join(DATA_DIR, f"scrm_{rows}_rows_seed{seed}.csv")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp"
+        generate_dataset(rows, tmp_path, seed=seed)
+        os.replace(tmp_path, path)
+    return path
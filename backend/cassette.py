@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import hashlib
+
+import telemetry
+from clients import MODEL_DEPLOYMENT
+from llm_backend import LLMBackend
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# record: answer recorded requests from the cassette and record the others (a persistent reply cache)
+# replay: answer only from the cassette; an unrecorded request raises CassetteMiss
+# passthrough: always ask the model and record nothing
+CASSETTE_MODES = ("record", "replay", "passthrough")
+CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", os.path.join(BACKEND_DIR, ".cassettes"))
+
+cassette_lookups = telemetry.registry.counter(
+    "scrm_cassette_total", "Model requests per cassette mode and result (hit, miss)", ("mode", "result"),
+)
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded"""
+
+    def __init__(self, key, request):
+        super().__init__(f"No recorded reply for {request['kind']} request {key} (record it with LLM_CASSETTE=record)")
+        self.key = key
+        self.request = request
+
+
+def request_key(request):
+    """Content address of a request: SHA-256 of its canonical JSON"""
+    payload = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CassetteStore:
+    """Request/reply pairs on disk, one JSON file per request named by its content address
+
+    Files are spread over 256 subdirectories by the first two hex digits of
+    the key and written through a temporary file and a rename, so processes
+    can record into the same directory and a crash never leaves half a file.
+    """
+
+    def __init__(self, root=CASSETTE_DIR):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """The recorded entry ({"request", "reply", "chunks", "recordedAt"}) or None"""
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cassette entry {key}: {e}")
+            return None
+
+    def put(self, key, request, reply, chunks=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"request": request, "reply": reply, "recordedAt": time.time()}
+        if chunks is not None:
+            entry["chunks"] = chunks
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=1)
+        os.replace(temporary, path)
+
+    def __len__(self):
+        return sum(
+            len([name for name in names if name.endswith(".json")]) for _, _, names in os.walk(self.root)
+        )
+
+
+class CassetteBackend(LLMBackend):
+    """Records the replies of another backend and plays them back for identical requests
+
+    A request is keyed by the backend, model, agent name and instructions
+    (or the chat parameters) and the exact messages, so any change to a
+    prompt or the dataset it embeds is a new request. Streamed replies are
+    recorded with their chunks and replayed chunk by chunk. Calls answered
+    from the cassette cost no tokens and do not show up in usage.
+    """
+
+    def __init__(self, inner, mode="record", cassette=None):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {', '.join(CASSETTE_MODES)}")
+        super().__init__()
+        self.inner = inner
+        self.mode = mode
+        self.cassette = cassette or CassetteStore()
+        # Spans and metrics keep the name of the backend that produced the replies
+        self.name = inner.name
+
+    def usage_snapshot(self):
+        return self.inner.usage_snapshot()
+
+    def _chat_request(self, messages, params):
+        return {
+            "kind": "chat",
+            "backend": self.inner.name,
+            "model": params.get("model", MODEL_DEPLOYMENT),
+            "params": {key: value for key, value in params.items() if key != "model"},
+            "messages": messages,
+        }
+
+    def _agent_request(self, agent, content):
+        return {
+            "kind": "agent",
+            "backend": self.inner.name,
+            "model": MODEL_DEPLOYMENT,
+            "agent": agent.name,
+            "instructions": agent.instructions,
+            "agentId": agent.agent_id,
+            "responseFormat": agent.response_format,
+            "content": content,
+        }
+
+    def _lookup(self, request):
+        """(key, recorded entry or None); raises CassetteMiss in replay mode"""
+        key = request_key(request)
+        entry = self.cassette.get(key) if self.mode != "passthrough" else None
+        result = "hit" if entry is not None else "miss"
+        cassette_lookups.inc(mode=self.mode, result=result)
+        telemetry.add_to_span(f"cassette_{result}")
+        if entry is None and self.mode == "replay":
+            raise CassetteMiss(key, request)
+        return key, entry
+
+    def _record(self, key, request, reply, chunks=None):
+        if self.mode == "record":
+            self.cassette.put(key, request, reply, chunks)
+
+    def _recording(self, key, request, chunks):
+        """Pass `chunks` through and record the reply once they are exhausted"""
+        seen = []
+        for chunk in chunks:
+            seen.append(chunk)
+            yield chunk
+        self._record(key, request, "".join(seen), seen)
+
+    def _chat(self, messages, stream=False, **params):
+        request = self._chat_request(messages, params)
+        key, entry = self._lookup(request)
+        if entry is not None:
+            return iter(entry.get("chunks") or [entry["reply"]]) if stream else entry["reply"]
+        if stream:
+            return self._recording(key, request, self.inner._chat(messages, stream=True, **params))
+        reply = self.inner._chat(messages, **params)
+        self._record(key, request, reply)
+        return reply
+
+    def _ask_agent(self, agent, content):
+        request = self._agent_request(agent, content)
+        key, entry = self._lookup(request)
+        if entry is not None:
+            return entry["reply"]
+        reply = self.inner._ask_agent(agent, content)
+        self._record(key, request, reply)
+        return reply
+
+    async def _aask_agent(self, agent, content):
+        request = self._agent_request(agent, content)
+        key, entry = self._lookup(request)
+        if entry is not None:
+            return entry["reply"]
+        reply = await self.inner._aask_agent(agent, content)
+        self._record(key, request, reply)
+        return reply
+
+    async def _astream_agent(self, agent, content):
+        request = self._agent_request(agent, content)
+        key, entry = self._lookup(request)
+        if entry is not None:
+            for chunk in entry.get("chunks") or [entry["reply"]]:
+                yield chunk
+            return
+        seen = []
+        async for chunk in self.inner._astream_agent(agent, content):
+            seen.append(chunk)
+            yield chunk
+        self._record(key, request, "".join(seen), seen)
+
+    async def warm_up(self, agents):
+        # Replayed runs never reach the model, so there is nothing to prepare
+        if self.mode != "replay":
+            await self.inner.warm_up(agents)
@@ -0,0 +1,172 @@
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+
+import telemetry
+
+load_dotenv()
+
+PROJECT_ENDPOINT = os.getenv("PROJECT_ENDPOINT")
+MODEL_DEPLOYMENT = os.getenv("MODEL_DEPLOYMENT_NAME", "gpt-4.1")
+OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", PROJECT_ENDPOINT)
+API_VERSION = os.getenv("API_VERSION", "2024-12-01-preview")
+
+# Connection pool and retry settings shared by every client below
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+RETRY_BACKOFF_FACTOR = float(os.getenv("HTTP_RETRY_BACKOFF_FACTOR", "0.8"))
+RETRY_BACKOFF_MAX = float(os.getenv("HTTP_RETRY_BACKOFF_MAX", "30"))
+REQUEST_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_SECONDS", "120"))
+
+_lock = threading.RLock()
+_clients = {}
+
+
+def _azure_retry_kwargs():
+    # azure-core's RetryPolicy retries 429/5xx with exponential backoff and honours Retry-After;
+    # the response hook runs once per attempt, so retries show up in the metrics
+    return {
+        "retry_total": MAX_RETRIES,
+        "retry_backoff_factor": RETRY_BACKOFF_FACTOR,
+        "retry_backoff_max": RETRY_BACKOFF_MAX,
+        "raw_response_hook": lambda response: telemetry.record_http_response(response.http_response.status_code),
+    }
+
+
+def _count_response(response):
+    telemetry.record_http_response(response.status_code)
+
+
+async def _acount_response(response):
+    telemetry.record_http_response(response.status_code)
+
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def get_credential():
+    """Shared sync DefaultAzureCredential, so its token cache is reused"""
+    def create():
+        from azure.identity import DefaultAzureCredential
+        return DefaultAzureCredential()
+    return _get_or_create("credential", create)
+
+
+def get_async_credential():
+    def create():
+        from azure.identity.aio import DefaultAzureCredential
+        return DefaultAzureCredential()
+    return _get_or_create("async_credential", create)
+
+
+def get_openai_client():
+    """Shared AzureOpenAI client on a keep-alive connection pool; 429s are retried with backoff"""
+    def create():
+        from openai import AzureOpenAI, DefaultHttpxClient
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=POOL_SIZE,
+                keepalive_expiry=KEEPALIVE_SECONDS,
+            ),
+            timeout=REQUEST_TIMEOUT,
+            event_hooks={"response": [_count_response]},
+        )
+        return AzureOpenAI(
+            api_version=API_VERSION,
+            azure_endpoint=OPENAI_ENDPOINT,
+            api_key=os.getenv("SUBSCRIPTION_KEY"),
+            max_retries=MAX_RETRIES,
+            http_client=http_client,
+        )
+    return _get_or_create("openai", create)
+
+
+def get_async_openai_client():
+    """Async counterpart of get_openai_client(); must be first called inside a running event loop"""
+    def create():
+        from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=POOL_SIZE,
+                keepalive_expiry=KEEPALIVE_SECONDS,
+            ),
+            timeout=REQUEST_TIMEOUT,
+            event_hooks={"response": [_acount_response]},
+        )
+        return AsyncAzureOpenAI(
+            api_version=API_VERSION,
+            azure_endpoint=OPENAI_ENDPOINT,
+            api_key=os.getenv("SUBSCRIPTION_KEY"),
+            max_retries=MAX_RETRIES,
+            http_client=http_client,
+        )
+    return _get_or_create("async_openai", create)
+
+
+def get_project_client():
+    """Shared sync AIProjectClient (its `.agents` is used by agents/agent_test.py)"""
+    def create():
+        import requests
+        from azure.ai.projects import AIProjectClient
+        from azure.core.pipeline.transport import RequestsTransport
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return AIProjectClient(
+            endpoint=PROJECT_ENDPOINT,
+            credential=get_credential(),
+            transport=RequestsTransport(session=session, session_owner=False),
+            **_azure_retry_kwargs(),
+        )
+    return _get_or_create("project", create)
+
+
+def get_async_agents_client():
+    """Shared async AgentsClient (used by the orchestrator); must be first called inside a running event loop"""
+    def create():
+        import aiohttp
+        from azure.ai.agents.aio import AgentsClient
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=KEEPALIVE_SECONDS)
+        session = aiohttp.ClientSession(connector=connector)
+        _clients["aiohttp_session"] = session
+        return AgentsClient(
+            endpoint=PROJECT_ENDPOINT,
+            credential=get_async_credential(),
+            transport=AioHttpTransport(session=session, session_owner=False),
+            **_azure_retry_kwargs(),
+        )
+    return _get_or_create("async_agents", create)
+
+
+def close_sync_clients():
+    with _lock:
+        for name in ("openai", "project", "credential"):
+            client = _clients.pop(name, None)
+            if client is not None:
+                client.close()
+
+
+async def close_clients():
+    """Close every shared client (called on app shutdown)"""
+    with _lock:
+        async_clients = [_clients.pop(name, None) for name in ("async_openai", "async_agents", "aiohttp_session", "async_credential")]
+    for client in async_clients:
+        if client is not None:
+            await client.close()
+    close_sync_clients()
@@ -0,0 +1,76 @@
+from shipment_table import dumps
+
+# Dataset columns each domain agent needs, following the fields named in its instructions
+DOMAIN_FIELDS = {
+    "raw_material": (
+        "ProductID", "RawMaterialName", "RawMaterialCountryOfOrigin", "RawMaterialCostPerUnit",
+        "SupplierName", "SourceType", "SingleSourceFlag", "LinkLeadTimeDays",
+    ),
+    "logistic": (
+        "ProductID", "OriginCountry", "DestinationCountry", "ShippingMode", "Carrier",
+        "AverageTransitTime", "ShippingCost", "SLAOnTimeDelivery",
+    ),
+    "foundry_production": (
+        "ProductID", "WaferStarts", "WaferLeadTimeDays", "FabCycleTimeDays", "WaferCost", "WaferYield",
+    ),
+    "assembly_test": (
+        "ProductID", "AssemblyLeadTimeDays", "PackagingCostPerUnit", "AssemblyYield", "TestPassRate",
+        "InspectionResult", "DefectRate",
+    ),
+}
+
+# Rough token estimate for JSON payloads; good enough to keep batches under a budget
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def dumps_compact(value):
+    return dumps(value)
+
+
+def project_record(record, fields):
+    """Keep only the given columns of a dataset row (missing columns are left out)"""
+    return {field: record[field] for field in fields if field in record}
+
+
+def chunk_by_tokens(records, max_tokens):
+    """Split records into lists whose compact JSON array stays under `max_tokens`
+
+    A single record larger than the budget still gets a batch of its own.
+    """
+    batches = []
+    batch = []
+    used = 1  # the surrounding []
+    for record in records:
+        cost = estimate_tokens(dumps_compact(record))
+        if batch and used + cost > max_tokens:
+            batches.append(batch)
+            batch = []
+            used = 1
+        batch.append(record)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def split_domains(records, max_tokens=6000, domains=None):
+    """Project every record onto each domain's fields and chunk the result into token-budgeted batches
+
+    Returns a dict of domain name -> list of batches (lists of projected records).
+    """
+    domains = domains or list(DOMAIN_FIELDS)
+    return {
+        domain: chunk_by_tokens([project_record(record, DOMAIN_FIELDS[domain]) for record in records], max_tokens)
+        for domain in domains
+    }
+
+
+def merge_batch_reports(reports):
+    """Combine the partial reports of one domain into a single report"""
+    if len(reports) == 1:
+        return reports[0]
+    return "\n\n".join(f"### Batch {i}/{len(reports)}\n{report}" for i, report in enumerate(reports, start=1))
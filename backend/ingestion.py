@@ -0,0 +1,224 @@
+import os
+import csv
+import json
+from typing import Iterator, List, TypedDict
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATASET_PATH = os.path.join(BACKEND_DIR, "data", "realistic_chip_scrm_dataset_100rows.csv")
+
+RISK_LEVELS = ("Low", "Medium", "High")
+
+
+class Shipment(TypedDict):
+    productId: str
+    chipType: str
+    node: str
+    partNumber: str
+    unitPrice: float
+    supplierLocation: str
+    wipInventory: int
+    safetyStockLevel: int
+    supplierRiskScore: str
+    countryRiskLevel: str
+    leadTimeRisk: str
+
+
+class SchemaError(ValueError):
+    """Raised when an input row does not match the Shipment schema"""
+
+    def __init__(self, row_number, message):
+        super().__init__(f"row {row_number}: {message}")
+        self.row_number = row_number
+
+
+def _string(value):
+    value = str(value).strip()
+    if not value:
+        raise ValueError("empty value")
+    return value
+
+
+def _number(value):
+    return float(value)
+
+
+def _integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        if not number.is_integer():
+            raise
+        return int(number)
+
+
+_LEVEL_LOOKUP = {level.lower(): level for level in RISK_LEVELS}
+
+
+def _level(value):
+    level = _LEVEL_LOOKUP.get(str(value).strip().lower())
+    if level is None:
+        raise ValueError(f"expected one of {', '.join(RISK_LEVELS)}, got {value!r}")
+    return level
+
+
+# Shipment field -> (column name in the SCRM dataset, converter)
+SHIPMENT_SCHEMA = {
+    "productId": ("ProductID", _string),
+    "chipType": ("ChipType", _string),
+    "node": ("Node", _string),
+    "partNumber": ("PartNumber", _string),
+    "unitPrice": ("UnitPrice", _number),
+    "supplierLocation": ("SupplierLocation", _string),
+    "wipInventory": ("WIPInventory", _integer),
+    "safetyStockLevel": ("SafetyStockLevel", _integer),
+    "supplierRiskScore": ("SupplierRiskScore", _level),
+    "countryRiskLevel": ("CountryRiskLevel", _level),
+    "leadTimeRisk": ("LeadTimeRisk", _level),
+}
+SHIPMENT_FIELDS = tuple(SHIPMENT_SCHEMA)
+
+
+def _csv_string(value):
+    return value if value and value == value.strip() else _string(value)
+
+
+def _csv_level(value):
+    return value if value in RISK_LEVELS else _level(value)
+
+
+# CSV cells are always str, so the common case can skip the generic normalization
+_CSV_CONVERTERS = {_string: _csv_string, _level: _csv_level, _integer: int}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension == ".json":
+        return "json"
+    return "csv"
+
+
+def read_rows(path, format=None) -> Iterator[dict]:
+    """Yield the raw rows of a CSV, JSON (array) or JSONL file one at a time
+
+    CSV and JSONL are streamed; a JSON array has to be parsed in one go.
+    """
+    format = format or detect_format(path)
+    if format == "csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif format == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif format == "json":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise SchemaError(0, "expected a JSON array of objects")
+        yield from data
+    else:
+        raise ValueError(f"Unsupported input format: {format}")
+
+
+def _column_lookup(row):
+    """Resolve which key holds each field: the shipment name (productId) or the dataset column (ProductID)"""
+    lookup = {}
+    for field, (column, converter) in SHIPMENT_SCHEMA.items():
+        if field in row:
+            lookup[field] = (field, converter)
+        elif column in row:
+            lookup[field] = (column, converter)
+        else:
+            lookup[field] = (None, converter)
+    return lookup
+
+
+def to_shipment(row, row_number, lookup=None) -> Shipment:
+    """Validate one raw row and convert it to a typed Shipment record"""
+    lookup = lookup or _column_lookup(row)
+    record = {}
+    for field, (key, converter) in lookup.items():
+        if key is None or row.get(key) is None:
+            raise SchemaError(row_number, f"missing field {field}")
+        try:
+            record[field] = converter(row[key])
+        except (TypeError, ValueError) as e:
+            raise SchemaError(row_number, f"invalid {field}: {e}") from None
+    return record
+
+
+def _iter_csv_shipments(path, skip_invalid):
+    """Fast path for CSV: read only the schema columns by position"""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = {name: index for index, name in enumerate(header)}
+        columns = []
+        for field, (column, converter) in SHIPMENT_SCHEMA.items():
+            index = positions.get(field, positions.get(column))
+            if index is None:
+                raise SchemaError(1, f"missing column {column}")
+            columns.append((field, index, _CSV_CONVERTERS.get(converter, converter)))
+
+        width = max(index for _, index, _ in columns) + 1
+        for row_number, row in enumerate(reader, start=1):
+            try:
+                if len(row) < width:
+                    raise SchemaError(row_number, f"expected at least {width} columns, got {len(row)}")
+                try:
+                    yield {field: converter(row[index]) for field, index, converter in columns}
+                except (TypeError, ValueError):
+                    # Re-validate field by field with the generic converters (e.g. "12.0" for an
+                    # integer) and report which field is broken
+                    yield to_shipment(dict(zip(header, row)), row_number)
+            except SchemaError:
+                if not skip_invalid:
+                    raise
+
+
+def _iter_shipments(path, format, skip_invalid):
+    lookup = None
+    for row_number, row in enumerate(read_rows(path, format), start=1):
+        if lookup is None:
+            lookup = _column_lookup(row)
+        try:
+            yield to_shipment(row, row_number, lookup)
+        except SchemaError:
+            if not skip_invalid:
+                raise
+
+
+def iter_shipment_chunks(path=DEFAULT_DATASET_PATH, chunk_size=10000, format=None, skip_invalid=False) -> Iterator[List[Shipment]]:
+    """Stream validated Shipment records from a dataset file in lists of `chunk_size`
+
+    Invalid rows raise SchemaError, unless `skip_invalid` is set, in which case
+    they are dropped.
+    """
+    format = format or detect_format(path)
+    if format == "csv":
+        records = _iter_csv_shipments(path, skip_invalid)
+    else:
+        records = _iter_shipments(path, format, skip_invalid)
+
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_shipments(path=DEFAULT_DATASET_PATH, format=None, skip_invalid=False) -> List[Shipment]:
+    """Load every Shipment record of a dataset file"""
+    shipments = []
+    for chunk in iter_shipment_chunks(path, format=format, skip_invalid=skip_invalid):
+        shipments.extend(chunk)
+    return shipments
@@ -0,0 +1,347 @@
+import os
+import uuid
+import socket
+import asyncio
+import contextvars
+from collections import OrderedDict
+from datetime import datetime
+
+from store import store
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# The Job whose coroutine is running, for publish()
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobLimitReached(RuntimeError):
+    """Raised by submit_once() when `max_active` distinct keyed jobs are already queued or running"""
+
+    def __init__(self, max_active, retry_after):
+        super().__init__(f"{max_active} jobs are already queued or running")
+        self.retry_after = retry_after
+
+
+class Job:
+    """A single unit of work submitted to the JobManager"""
+
+    def __init__(self, func, args, kwargs, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._task = None
+        self._done = asyncio.Event()
+        # (event, data) progress published by the job's coroutine, in order; dropped once
+        # the job finished and no stream follows it any more
+        self.events = []
+        self._published = asyncio.Event()
+        self._followers = 0
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    async def wait(self):
+        """Wait until the job reached a final state and return it"""
+        await self._done.wait()
+        return self
+
+    def publish(self, event, data):
+        self.events.append((event, data))
+        self._published.set()
+        self._published = asyncio.Event()
+
+    def follow(self):
+        """Keep the events for a stream until it calls unfollow()"""
+        self._followers += 1
+
+    def unfollow(self):
+        self._followers -= 1
+        self._drop_drained_events()
+
+    def _drop_drained_events(self):
+        if self.finished and not self._followers:
+            self.events = []
+
+    async def next_events(self, start, timeout=None):
+        """The events after the first `start`, waiting up to `timeout` seconds for one if there are none yet
+
+        Returns an empty list on timeout or when the job finished without publishing more.
+        """
+        if len(self.events) <= start and not self.finished:
+            try:
+                await asyncio.wait_for(self._published.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.events[start:]
+
+    def _finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = datetime.now()
+        self._done.set()
+        self._published.set()
+        self._drop_drained_events()
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "createdAt": self.created_at.isoformat(),
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class SharedJob:
+    """Read-only view of a job owned by another worker process, as recorded in the shared store"""
+
+    def __init__(self, record):
+        self.id = record["jobId"]
+        self.status = record["status"]
+        self._record = record
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        return {key: value for key, value in self._record.items() if key != "owner"}
+
+
+class JobManager:
+    """In-process job queue that runs coroutines on a bounded pool of workers
+
+    Jobs are picked up in submission order by `max_workers` worker tasks, so at
+    most that many coroutines run at the same time. Finished jobs are kept for
+    lookup until `max_history` newer jobs have finished.
+
+    With a shared `state` (a SupplyChainStore), every job is also recorded
+    there, so any worker process can look it up, wait for it or cancel it.
+    submit_once() coalesces jobs by key across processes: while a job with
+    the key is queued or running anywhere, submitting it again returns that
+    job instead of starting another. Owners renew their jobs' lease every few
+    seconds; jobs of a process that stopped renewing for `lease_seconds` are
+    marked failed so the key can run again. At most `max_active` distinct
+    keys are queued or running at a time (across processes with `state`);
+    beyond that submit_once() raises JobLimitReached. Calls into `state`
+    run in a thread, so a busy or locked database never blocks the event loop.
+    """
+
+    def __init__(self, max_workers=2, timeout=300, max_history=1000, state=None, lease_seconds=30, max_active=None,
+                 retry_after=30):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_history = max_history
+        self.state = state
+        self.lease_seconds = lease_seconds
+        self.max_active = max_active
+        self.retry_after = retry_after
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+        self._heartbeat = None
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        if self.state is not None:
+            self._heartbeat = asyncio.create_task(self._renew_leases())
+
+    async def stop(self):
+        for job in list(self._jobs.values()):
+            if not job.finished:
+                await self.cancel(job.id)
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+
+    async def submit(self, func, *args, **kwargs):
+        """Queue `func(*args, **kwargs)` (a coroutine function) and return its Job"""
+        return await self._submit(Job(func, args, kwargs))
+
+    async def submit_once(self, key, func, *args, **kwargs):
+        """Like submit(), but return the queued or running job with the same `key` if there is one
+
+        The returned job may belong to another worker process (a SharedJob).
+        Raises JobLimitReached when a new job would exceed `max_active`.
+        """
+        active = [job for job in self._jobs.values() if job.key is not None and not job.finished]
+        for job in active:
+            if job.key == key:
+                return job
+        if self.state is None and self.max_active is not None and len(active) >= self.max_active:
+            raise JobLimitReached(self.max_active, self.retry_after)
+        return await self._submit(Job(func, args, kwargs, key=key))
+
+    async def _submit(self, job):
+        if not self._workers:
+            raise RuntimeError("JobManager is not running")
+        # Known before the claim, so a submit_once() of the same key in this process joins it meanwhile
+        self._jobs[job.id] = job
+        if self.state is not None:
+            record = {**job.to_dict(), "key": job.key, "owner": self.owner}
+            try:
+                active_id = await asyncio.to_thread(
+                    self.state.claim_job, record, self.lease_seconds, self.max_active if job.key is not None else None,
+                )
+            except BaseException:
+                del self._jobs[job.id]
+                raise
+            if active_id != job.id:
+                del self._jobs[job.id]
+                if active_id is None:
+                    raise JobLimitReached(self.max_active, self.retry_after)
+                return await self.get(active_id)
+        self._queue.put_nowait(job)
+        return job
+
+    async def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None and self.state is not None:
+            record = await asyncio.to_thread(self.state.get_job, job_id)
+            if record is not None:
+                job = SharedJob(record)
+        return job
+
+    async def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it already finished"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            # Owned by another process, which picks the request up with its next heartbeat
+            return self.state is not None and await asyncio.to_thread(self.state.request_job_cancel, job_id)
+        if job.finished:
+            return False
+        if job._task is not None:
+            job._task.cancel()
+        else:
+            await self._finish(job, CANCELLED)
+        return True
+
+    async def wait(self, job_id, timeout=None, poll_interval=0.5):
+        """Wait up to `timeout` seconds for a job to finish and return it (finished or not), or None"""
+        job = await self.get(job_id)
+        if job is None or job.finished:
+            return job
+        try:
+            if isinstance(job, Job):
+                return await asyncio.wait_for(job.wait(), timeout)
+            loop = asyncio.get_running_loop()
+            deadline = None if timeout is None else loop.time() + timeout
+            while not job.finished and (deadline is None or loop.time() < deadline):
+                await asyncio.sleep(poll_interval)
+                job = await self.get(job_id)
+            return job
+        except asyncio.TimeoutError:
+            return job
+
+    async def _persist(self, job):
+        if self.state is not None:
+            await asyncio.to_thread(self.state.update_job, job.to_dict())
+
+    async def _finish(self, job, status, result=None, error=None):
+        job._finish(status, result=result, error=error)
+        await self._persist(job)
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                cancel_requested = await asyncio.to_thread(self.state.heartbeat_jobs, self.owner)
+            except Exception as e:
+                print(f"Error renewing job leases: {e}")
+                continue
+            for job_id in cancel_requested:
+                await self.cancel(job_id)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.finished:
+                    continue
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+                await self._prune()
+
+    async def _run(self, job):
+        job.status = RUNNING
+        job.started_at = datetime.now()
+        await self._persist(job)
+        # The task copies the context, so publish() in the job's coroutine finds the job
+        token = _current_job.set(job)
+        try:
+            job._task = asyncio.create_task(job._func(*job._args, **job._kwargs))
+        finally:
+            _current_job.reset(token)
+        try:
+            # asyncio.wait does not cancel the job task when the worker itself is cancelled
+            await asyncio.wait([job._task], timeout=self.timeout)
+        except asyncio.CancelledError:
+            job._task.cancel()
+            await asyncio.wait([job._task])
+            # Shielded: the worker is being cancelled, but the store must still learn the job's end
+            await asyncio.shield(self._finish(job, CANCELLED))
+            raise
+
+        if not job._task.done():
+            job._task.cancel()
+            await asyncio.wait([job._task])
+            await self._finish(job, FAILED, error=f"Job timed out after {self.timeout} seconds")
+        elif job._task.cancelled():
+            await self._finish(job, CANCELLED)
+        elif job._task.exception() is not None:
+            exc = job._task.exception()
+            await self._finish(job, FAILED, error=f"{type(exc).__name__}: {exc}")
+        else:
+            await self._finish(job, SUCCEEDED, result=job._task.result())
+
+    async def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+        if self.state is not None:
+            await asyncio.to_thread(self.state.prune_jobs, self.max_history)
+
+
+def publish(event, data):
+    """Publish a progress event on the job running the calling coroutine, if any (see Job.next_events)"""
+    job = _current_job.get()
+    if job is not None:
+        job.publish(event, data)
+
+
+job_manager = JobManager(
+    max_workers=int(os.getenv("ANALYSIS_MAX_WORKERS", "2")),
+    timeout=float(os.getenv("ANALYSIS_TIMEOUT_SECONDS", "300")),
+    # Shared with the other uvicorn workers through the SQLite store
+    state=store,
+    lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "30")),
+    # Distinct analyses (dataset version and parameters) queued or running at once; more get a 429
+    max_active=int(os.getenv("ANALYSIS_MAX_ACTIVE", "4")),
+    retry_after=int(os.getenv("ANALYSIS_RETRY_AFTER_SECONDS", "30")),
+)
@@ -0,0 +1,460 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import namedtuple
+
+import telemetry
+from clients import MODEL_DEPLOYMENT, PROJECT_ENDPOINT
+
+# An agent is addressed by name + instructions (created on demand through the agent registry)
+# or by the id of an agent that already exists in the project; `response_format` constrains
+# its replies, e.g. to a JSON schema (see structured_output.json_schema_format)
+AgentSpec = namedtuple("AgentSpec", ["name", "instructions", "agent_id", "response_format"], defaults=(None, None, None))
+
+
+def _response_format(agent):
+    return {"response_format": agent.response_format} if agent.response_format is not None else {}
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for backends that do not report usage"""
+    return len(text) // 4 + 1
+
+
+def payload_bytes(text):
+    return len(text.encode("utf-8")) if text else 0
+
+
+def _messages_bytes(messages):
+    return sum(payload_bytes(str(message.get("content", ""))) for message in messages)
+
+
+class LLMBackend:
+    """Every chat completion and agent round-trip of the pipeline goes through one of these
+
+    chat() returns the reply text, or an iterator of text chunks with
+    `stream=True`. ask_agent() / aask_agent() send one message to an agent and
+    return its reply text; astream_agent() yields that reply in text chunks as
+    the model produces it. Each call is traced as an `llm` span with its
+    duration, token usage, retries and payload sizes (see telemetry.py);
+    backends implement the underscored counterparts.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._usage_lock = threading.Lock()
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def record_usage(self, prompt_tokens=0, completion_tokens=0):
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens or 0
+            self.usage["completion_tokens"] += completion_tokens or 0
+        telemetry.add_to_span("prompt_tokens", prompt_tokens)
+        telemetry.add_to_span("completion_tokens", completion_tokens)
+
+    def usage_snapshot(self):
+        with self._usage_lock:
+            return dict(self.usage)
+
+    def chat(self, messages, stream=False, **params):
+        if stream:
+            current = telemetry.start_span("llm", "chat", backend=self.name, request_bytes=_messages_bytes(messages))
+            try:
+                with current.activate():
+                    chunks = self._chat(messages, stream=True, **params)
+            except BaseException as exc:
+                current.fail(exc)
+                current.end()
+                raise
+            return telemetry.traced_iterator(current, iter(chunks), size=payload_bytes)
+
+        with telemetry.span("llm", "chat", backend=self.name, request_bytes=_messages_bytes(messages)) as current:
+            reply = self._chat(messages, **params)
+            current.add("response_bytes", payload_bytes(reply))
+            return reply
+
+    def ask_agent(self, agent, content):
+        with telemetry.span("llm", agent.name, backend=self.name, request_bytes=payload_bytes(content)) as current:
+            reply = self._ask_agent(agent, content)
+            current.add("response_bytes", payload_bytes(reply))
+            return reply
+
+    async def aask_agent(self, agent, content):
+        with telemetry.span("llm", agent.name, backend=self.name, request_bytes=payload_bytes(content)) as current:
+            reply = await self._aask_agent(agent, content)
+            current.add("response_bytes", payload_bytes(reply))
+            return reply
+
+    def astream_agent(self, agent, content):
+        """Async iterator over the text chunks of an agent reply"""
+        current = telemetry.start_span("llm", agent.name, backend=self.name, request_bytes=payload_bytes(content), stream=True)
+        return telemetry.atraced_iterator(current, self._astream_agent(agent, content), size=payload_bytes)
+
+    def _chat(self, messages, stream=False, **params):
+        raise NotImplementedError
+
+    def _ask_agent(self, agent, content):
+        raise NotImplementedError
+
+    async def _aask_agent(self, agent, content):
+        raise NotImplementedError
+
+    async def _astream_agent(self, agent, content):
+        # Backends without token streaming hand out the whole reply as one chunk
+        yield await self._aask_agent(agent, content)
+
+    async def warm_up(self, agents):
+        """Prepare the given AgentSpecs ahead of the first request (no-op by default)"""
+
+
+class AzureBackend(LLMBackend):
+    """Azure OpenAI chat completions and Azure AI Foundry agents, using the shared clients"""
+
+    name = "azure"
+
+    def __init__(self, registry_path=None, thread_pool_size=None, run_timeout=None, use_stream=None):
+        from agent_registry import AgentRegistry, DEFAULT_REGISTRY_PATH
+
+        super().__init__()
+        self.registry = AgentRegistry(
+            registry_path or os.getenv("AGENT_REGISTRY_PATH", DEFAULT_REGISTRY_PATH),
+            scope=PROJECT_ENDPOINT or "default",
+        )
+        self.thread_pool_size = thread_pool_size or int(os.getenv("AGENT_THREAD_POOL_SIZE", "8"))
+        self.run_timeout = run_timeout or float(os.getenv("AGENT_RUN_TIMEOUT_SECONDS", "120"))
+        self.use_stream = use_stream if use_stream is not None else os.getenv("AGENT_RUN_STREAM", "false").lower() == "true"
+        self._async_pool = None
+        self._sync_pool = None
+        self._setup_lock = None
+
+    # Chat completions
+
+    def _chat(self, messages, stream=False, **params):
+        from clients import get_openai_client
+
+        params.setdefault("model", MODEL_DEPLOYMENT)
+        if stream:
+            params.setdefault("stream_options", {"include_usage": True})
+        response = get_openai_client().chat.completions.create(messages=messages, stream=stream, **params)
+        if not stream:
+            self._record_response_usage(response.usage)
+            return response.choices[0].message.content
+        return self._stream_chunks(response)
+
+    def _record_response_usage(self, usage):
+        if usage is not None:
+            self.record_usage(usage.prompt_tokens, usage.completion_tokens)
+        else:
+            self.record_usage()
+
+    def _stream_chunks(self, response):
+        usage = None
+        for chunk in response:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        self._record_response_usage(usage)
+
+    # Synchronous agents (agents/agent_test.py)
+
+    def _sync_thread_pool(self):
+        from agent_registry import SyncThreadPool
+        from clients import get_project_client
+
+        agents = get_project_client().agents
+        if self._sync_pool is None or self._sync_pool.agents is not agents:
+            self._sync_pool = SyncThreadPool(agents, self.registry, size=self.thread_pool_size)
+        return self._sync_pool
+
+    def _ask_agent(self, agent, content):
+        from agents.run_completion import ask_agent
+        from clients import get_project_client
+
+        if agent.agent_id is None:
+            raise ValueError(f"Agent {agent.name} needs an agent_id for synchronous calls")
+        reply = ask_agent(
+            get_project_client().agents, agent.agent_id, content,
+            use_stream=self.use_stream, timeout=self.run_timeout, thread_pool=self._sync_thread_pool(),
+            **_response_format(agent),
+        )
+        self._record_response_usage(getattr(reply.run, "usage", None))
+        return reply.text
+
+    # Asynchronous agents (orchestrator)
+
+    def _async_thread_pool(self):
+        from agent_registry import AsyncThreadPool
+        from clients import get_async_agents_client
+
+        agents_client = get_async_agents_client()
+        if self._async_pool is None or self._async_pool.agents_client is not agents_client:
+            self._async_pool = AsyncThreadPool(agents_client, self.registry, size=self.thread_pool_size)
+        return self._async_pool
+
+    async def _agent_id(self, agent):
+        """Id of a long-lived agent; only new or changed agents cost a service call"""
+        from agent_registry import ensure_agent
+        from clients import get_async_agents_client
+
+        if agent.agent_id is not None:
+            return agent.agent_id
+        if self._setup_lock is None:
+            self._setup_lock = asyncio.Lock()
+        async with self._setup_lock:
+            return await ensure_agent(get_async_agents_client(), self.registry, agent.name, MODEL_DEPLOYMENT, agent.instructions)
+
+    async def _aask_agent(self, agent, content):
+        """Post `content` on a pooled thread, process a run of the agent and return its reply text"""
+        from azure.ai.agents.models import ListSortOrder, MessageRole
+        from azure.core.exceptions import ResourceNotFoundError
+        from agents.run_completion import RunFailedError, check_completed
+        from clients import get_async_agents_client
+
+        agents_client = get_async_agents_client()
+        thread_pool = self._async_thread_pool()
+        agent_id = await self._agent_id(agent)
+        thread_id = await thread_pool.acquire()
+        try:
+            await agents_client.messages.create(thread_id=thread_id, role=MessageRole.USER, content=content)
+            run = await agents_client.runs.create_and_process(thread_id=thread_id, agent_id=agent_id, **_response_format(agent))
+            self._record_response_usage(getattr(run, "usage", None))
+            check_completed(run)
+
+            async for message in agents_client.messages.list(thread_id=thread_id, run_id=run.id, order=ListSortOrder.DESCENDING):
+                if message.role == MessageRole.AGENT and message.text_messages:
+                    return message.text_messages[-1].text.value
+            raise RunFailedError(f"Run {run.id} completed without an agent message")
+        except ResourceNotFoundError:
+            # A registered agent or pooled thread was deleted outside this app; the next call recreates them
+            self.registry.reset()
+            raise
+        finally:
+            thread_pool.release(thread_id)
+
+    async def _astream_agent(self, agent, content):
+        """Like _aask_agent(), but follow the run's event stream and yield the message deltas"""
+        from azure.ai.agents.models import AgentStreamEvent, MessageDeltaChunk, MessageRole, ThreadRun
+        from azure.core.exceptions import ResourceNotFoundError
+        from agents.run_completion import check_completed
+        from clients import get_async_agents_client
+
+        agents_client = get_async_agents_client()
+        thread_pool = self._async_thread_pool()
+        agent_id = await self._agent_id(agent)
+        thread_id = await thread_pool.acquire()
+        try:
+            await agents_client.messages.create(thread_id=thread_id, role=MessageRole.USER, content=content)
+            run = None
+            async with await agents_client.runs.stream(thread_id=thread_id, agent_id=agent_id, **_response_format(agent)) as stream:
+                async for event_type, event_data, _ in stream:
+                    if isinstance(event_data, MessageDeltaChunk) and event_data.text:
+                        yield event_data.text
+                    elif isinstance(event_data, ThreadRun):
+                        run = event_data
+                    if event_type in (AgentStreamEvent.ERROR, AgentStreamEvent.DONE):
+                        break
+            self._record_response_usage(getattr(run, "usage", None))
+            check_completed(run)
+        except ResourceNotFoundError:
+            self.registry.reset()
+            raise
+        finally:
+            thread_pool.release(thread_id)
+
+    async def warm_up(self, agents):
+        for agent in agents:
+            await self._agent_id(agent)
+        await self._async_thread_pool().fill()
+
+
+class StubBackend(LLMBackend):
+    """Offline backend that answers instantly-ish with deterministic, schema-valid canned replies
+
+    Replies depend only on the request content, so runs are reproducible.
+    `latency` (plus up to `jitter` seconds) is slept per call and replies are
+    padded to roughly `completion_tokens` tokens, which makes the stub usable
+    for load tests and capacity planning without an Azure endpoint.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.0, jitter=0.0, completion_tokens=200, chunk_tokens=8):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.completion_tokens = completion_tokens
+        self.chunk_tokens = chunk_tokens
+
+    @staticmethod
+    def _seed(text):
+        return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+    def _delay(self, seed):
+        return self.latency + (random.Random(seed).random() * self.jitter if self.jitter else 0.0)
+
+    def _count(self, prompt, reply):
+        self.record_usage(estimate_tokens(prompt), estimate_tokens(reply))
+
+    def reply_for(self, content, agent_name="assistant"):
+        """The canned reply for a request: JSON where the pipeline parses JSON, filler text otherwise"""
+        try:
+            payload = json.loads(content)
+        except (TypeError, ValueError):
+            payload = None
+
+        if isinstance(payload, dict) and "queries" in payload:
+            # News agent: an insight object for one query (its response_format), a list of them for several
+            insights = [{"query": query, "riskCount": self._seed(query) % 10} for query in payload["queries"]]
+            return json.dumps(insights[0] if len(insights) == 1 else insights)
+
+        rng = random.Random(self._seed(content))
+        words = ["supply", "risk", "shipment", "supplier", "lead", "time", "mitigation", "inventory",
+                 "logistics", "exposure", "geopolitical", "capacity", "yield", "delay", "diversify"]
+        filler = " ".join(rng.choice(words) for _ in range(max(self.completion_tokens - 8, 0)))
+        return f"## {agent_name} (stub)\n{filler}"
+
+    def _chat(self, messages, stream=False, **params):
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        seed = self._seed(prompt)
+        reply = self.reply_for(messages[-1].get("content", "") if messages else "", "assistant")
+        self._count(prompt, reply)
+        if not stream:
+            time.sleep(self._delay(seed))
+            return reply
+        return self._stream(reply, self._delay(seed))
+
+    def _chunks(self, reply):
+        """Split a reply into chunks of `chunk_tokens` words that join back to the reply"""
+        words = reply.split(" ")
+        chunks = [" ".join(words[i:i + self.chunk_tokens]) for i in range(0, len(words), self.chunk_tokens)]
+        return [chunk + " " for chunk in chunks[:-1]] + chunks[-1:]
+
+    def _stream(self, reply, delay):
+        chunks = self._chunks(reply)
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield chunk
+
+    def _ask_agent(self, agent, content):
+        reply = self.reply_for(content, agent.name)
+        self._count(content, reply)
+        time.sleep(self._delay(self._seed(content)))
+        return reply
+
+    async def _aask_agent(self, agent, content):
+        reply = self.reply_for(content, agent.name)
+        self._count(content, reply)
+        await asyncio.sleep(self._delay(self._seed(content)))
+        return reply
+
+    async def _astream_agent(self, agent, content):
+        reply = self.reply_for(content, agent.name)
+        self._count(content, reply)
+        chunks = self._chunks(reply)
+        delay = self._delay(self._seed(content)) / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+
+class ChatBackend(AzureBackend):
+    """Runs agents as plain chat completions (instructions as system prompt) on the shared OpenAI clients
+
+    Useful against any OpenAI-compatible endpoint without the Agents service,
+    e.g. the fake model server in bench/fake_model_server.py.
+    """
+
+    name = "chat"
+
+    def _agent_messages(self, agent, content):
+        return [
+            {"role": "system", "content": agent.instructions or f"You are the {agent.name}."},
+            {"role": "user", "content": content},
+        ]
+
+    def _ask_agent(self, agent, content):
+        return self._chat(self._agent_messages(agent, content), **_response_format(agent))
+
+    async def _aask_agent(self, agent, content):
+        from clients import get_async_openai_client
+
+        response = await get_async_openai_client().chat.completions.create(
+            messages=self._agent_messages(agent, content), model=MODEL_DEPLOYMENT, **_response_format(agent),
+        )
+        self._record_response_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def _astream_agent(self, agent, content):
+        from clients import get_async_openai_client
+
+        response = await get_async_openai_client().chat.completions.create(
+            messages=self._agent_messages(agent, content), model=MODEL_DEPLOYMENT,
+            stream=True, stream_options={"include_usage": True}, **_response_format(agent),
+        )
+        usage = None
+        async for chunk in response:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        self._record_response_usage(usage)
+
+    async def warm_up(self, agents):
+        pass
+
+
+def create_backend(name=None, cassette=None):
+    """Build the backend selected by LLM_BACKEND: `azure` (default), `chat` or `stub`
+
+    With LLM_CASSETTE (or `cassette`) set to `record` or `replay` it is
+    wrapped in a CassetteBackend that records and replays its replies (see
+    cassette.py); `passthrough`, the default, leaves it as is.
+    """
+    name = (name or os.getenv("LLM_BACKEND", "azure")).lower()
+    if name == "azure":
+        backend = AzureBackend()
+    elif name == "chat":
+        backend = ChatBackend()
+    elif name == "stub":
+        backend = StubBackend(
+            latency=float(os.getenv("STUB_LATENCY_SECONDS", "0")),
+            jitter=float(os.getenv("STUB_JITTER_SECONDS", "0")),
+            completion_tokens=int(os.getenv("STUB_COMPLETION_TOKENS", "200")),
+        )
+    else:
+        raise ValueError(f"Unknown LLM backend: {name}")
+
+    mode = (cassette or os.getenv("LLM_CASSETTE", "passthrough")).lower()
+    if mode == "passthrough":
+        return backend
+    from cassette import CassetteBackend
+
+    return CassetteBackend(backend, mode)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend (e.g. with a StubBackend for benchmarks)"""
+    global _backend
+    _backend = backend
+    return backend
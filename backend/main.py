@@ -1,11 +1,32 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
-import subprocess
 import os
+import time
+import asyncio
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.routing import Match
+from datetime import datetime, timezone
+
+import telemetry
+from jobs import JobLimitReached, job_manager
+from clients import close_clients
+from response_cache import response_cache
+from orchestrator import domain_agents
+from risk_graph import graph_for
+from scheduler import SCHEDULER_ENABLED, scheduler
+from supplychains import analysis_key, analyze_and_store, seed_store, update_step_risk
+from store import MAX_PAGE_SIZE, store
+from streaming import format_ndjson, format_sse, stream_job
 
 app = FastAPI()
 
+RiskLevel = Literal["Low", "Medium", "High"]
+
+# Longest a GET /jobs/{id}?wait= request is held open
+MAX_JOB_WAIT_SECONDS = 60
+
 # Allow CORS (for frontend use, optional)
 app.add_middleware(
     CORSMiddleware,
@@ -13,110 +34,266 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After", "X-Total-Count"],
 )
 
-# Dummy data
-supplychains = [
-    {
-        "id": "raw-materials",
-        "title": "Raw Material related data for the supply chain"
-    },
-    {
-        "id": "logistics",
-        "title": "Logistics related data for the supply chain"
-    }
-]
-
-supplychain_details = {
-    "raw-materials": {
-        "id": "chip-supply-1",
-        "title": "Chip Procurement – Asia to Europe",
-        "totalRisk": 0.73,
-        "riskLevel": "High",
-        "lastUpdated": datetime(2025, 7, 15, 10, 32, 0).isoformat() + "Z",
-        "steps": [
-            {
-                "id": "step-1",
-                "order": 1,
-                "category": "Raw Materials",
-                "title": "Copper Mining – Peru",
-                "description": "Raw copper extracted by Company X.",
-                "location": "Peru",
-                "company": "MiningCorp SA",
-                "riskScore": 0.4,
-                "riskLevel": "Medium",
-                "riskDescription": "Political instability reported near the mining region."
-            },
-            {
-                "id": "step-2",
-                "order": 2,
-                "category": "Transport",
-                "title": "Shipment to Taiwan",
-                "description": "Transported via Pacific route to TSMC",
-                "location": "Pacific Ocean Route",
-                "company": "GlobalShipping Ltd.",
-                "riskScore": 0.9,
-                "riskLevel": "High",
-                "riskDescription": "Major strike at Port of Kaohsiung ongoing."
-            }
-        ]
-    }
-}
+@app.middleware("http")
+async def time_handlers(request: Request, call_next):
+    """Trace every handler as an `http` span and record its duration per route template"""
+    # Label by route template, not raw path, so /jobs/{job_id} stays one series
+    route = "unmatched"
+    for candidate in app.router.routes:
+        match, _ = candidate.matches(request.scope)
+        if match == Match.FULL:
+            route = candidate.path
+            break
+    labels = {"method": request.method, "route": route}
+    telemetry.http_requests_in_progress.inc(**labels)
+    started = time.perf_counter()
+    status = 500
+    try:
+        with telemetry.span("http", f"{request.method} {route}") as current:
+            response = await call_next(request)
+            current.set(status_code=response.status_code)
+        status = response.status_code
+        return response
+    finally:
+        telemetry.http_requests_in_progress.dec(**labels)
+        telemetry.http_requests.observe(time.perf_counter() - started, status=status, **labels)
+
+@app.on_event("startup")
+async def start_job_manager():
+    store.open()
+    seed_store(store)
+    await job_manager.start()
+    if telemetry.METRICS_DIR:
+        telemetry.registry.share(telemetry.METRICS_DIR)
+    if SCHEDULER_ENABLED:
+        await scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_job_manager():
+    await scheduler.stop()
+    await job_manager.stop()
+    await close_clients()
+    store.close()
+    if telemetry.METRICS_DIR:
+        # The counts of this worker stay in /metrics after it exits
+        telemetry.registry.write_snapshot(telemetry.METRICS_DIR)
 
 # GET /supplychains
 @app.get("/supplychains")
-def get_supplychains():
-    return supplychains
+def get_supplychains(
+    request: Request,
+    risk_level: Optional[RiskLevel] = Query(None, alias="riskLevel"),
+    updated_since: Optional[str] = Query(None, alias="updatedSince"),
+    updated_before: Optional[str] = Query(None, alias="updatedBefore"),
+    q: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    """One page of supply chains, most recently updated first; the total count is in X-Total-Count
+
+    Served from the response cache with an ETag; If-None-Match gets a 304
+    until the next analysis run changes the data.
+    """
+    def build():
+        chains, total = store.list_chains(
+            risk_level=risk_level, updated_since=updated_since, updated_before=updated_before, search=q,
+            limit=limit, offset=offset,
+        )
+        return chains, {"X-Total-Count": str(total)}
+
+    return response_cache.respond(request, store.data_version(), build, route="/supplychains")
 
 # GET /supplychains/{id}
 @app.get("/supplychains/{supplychain_id}")
-def get_supplychain_detail(supplychain_id: str):
-    if supplychain_id in supplychain_details:
-        return supplychain_details[supplychain_id]
-    raise HTTPException(status_code=404, detail="Supply chain not found")
+def get_supplychain_detail(request: Request, supplychain_id: str):
+    """A chain with its steps and the stored risk result of its shipment (from the last analysis or scheduled
+    refresh); riskUpdatedAt is when that result last changed"""
+    def build():
+        chain = store.get_chain(supplychain_id)
+        if chain is None:
+            raise HTTPException(status_code=404, detail="Supply chain not found")
+        state = store.shipment_states([supplychain_id]).get(supplychain_id)
+        chain["riskResult"] = state["riskResult"] if state else None
+        chain["riskUpdatedAt"] = (
+            datetime.fromtimestamp(state["scoredAt"], timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+            if state and state["scoredAt"] else None
+        )
+        return chain, {}
 
-# POST /run-analysis
-@app.post("/run-analysis")
-def run_supply_chain_analysis():
-    """Run the supply chain risk analysis using code.py"""
+    return response_cache.respond(request, store.data_version(), build, route="/supplychains/{supplychain_id}")
+
+
+class StepRiskUpdate(BaseModel):
+    riskScore: float = Field(..., ge=0.0, le=1.0)
+    riskDescription: Optional[str] = None
+
+# PATCH /supplychains/{id}/steps/{step_id}
+@app.patch("/supplychains/{supplychain_id}/steps/{step_id}")
+def patch_supplychain_step(supplychain_id: str, step_id: str, update: StepRiskUpdate):
+    """Set one step's riskScore; the chain's propagated and total risk are re-derived from its steps"""
+    chain = update_step_risk(supplychain_id, step_id, update.riskScore, update.riskDescription)
+    if chain is None:
+        raise HTTPException(status_code=404, detail="Supply chain step not found")
+    return chain
+
+# GET /locations/{location}/supplychains
+@app.get("/locations/{location}/supplychains")
+def get_location_supplychains(request: Request, location: str):
+    """Chains (without steps) with a step at `location`, riskiest first, looked up in the risk graph's location index"""
+    def build():
+        graph = graph_for(store)
+        chains = graph.summaries(graph.chains_at_location(location))
+        return chains, {"X-Total-Count": str(len(chains))}
+
+    return response_cache.respond(request, store.data_version(), build, route="/locations/{location}/supplychains")
+
+# GET /companies/{company}/supplychains
+@app.get("/companies/{company}/supplychains")
+def get_company_supplychains(request: Request, company: str):
+    """Chains (without steps) with a step run by `company`, riskiest first, looked up in the risk graph's company index"""
+    def build():
+        graph = graph_for(store)
+        chains = graph.summaries(graph.chains_of_company(company))
+        return chains, {"X-Total-Count": str(len(chains))}
+
+    return response_cache.respond(request, store.data_version(), build, route="/companies/{company}/supplychains")
+
+# GET /analysis-runs/{id}
+@app.get("/analysis-runs/{run_id}")
+def get_analysis_run(run_id: str):
+    """A stored analysis run with its reports; `latest` for the most recent one"""
+    run = store.get_run(None if run_id == "latest" else run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Analysis run not found")
+    return run
+
+# GET /risk-results
+@app.get("/risk-results")
+def get_risk_results(
+    response: Response,
+    run_id: Optional[str] = Query(None, alias="runId"),
+    risk_level: Optional[RiskLevel] = Query(None, alias="riskLevel"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    """One page of per-shipment risk results of a run (the latest by default), riskiest first"""
+    run = store.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Analysis run not found")
+    results, total = store.list_risk_results(run["runId"], risk_level=risk_level, limit=limit, offset=offset)
+    response.headers["X-Total-Count"] = str(total)
+    return results
+
+async def submit_analysis(domains):
+    """Queue an analysis of `domains` or join the one already queued or running; 400 and 429 as HTTPException"""
+    unknown = sorted(set(domains or ()) - set(domain_agents))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown domains: {', '.join(unknown)}")
+    key = await asyncio.to_thread(analysis_key, domains)
     try:
-        # Change to the backend directory to run code.py
-        backend_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Run code.py as a subprocess
-        result = subprocess.run(
-            ["python", "code.py"], 
-            cwd=backend_dir,
-            capture_output=True, 
-            text=True, 
-            timeout=300  # 5 minute timeout
-        )
-        
-        if result.returncode == 0:
-            return {
-                "status": "success",
-                "message": "Supply chain analysis completed successfully",
-                "output": result.stdout,
-                "timestamp": datetime.now().isoformat()
-            }
-        else:
-            return {
-                "status": "error",
-                "message": "Analysis failed",
-                "error": result.stderr,
-                "output": result.stdout,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-    except subprocess.TimeoutExpired:
-        return {
-            "status": "error",
-            "message": "Analysis timed out after 5 minutes",
-            "timestamp": datetime.now().isoformat()
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to run analysis: {str(e)}",
-            "timestamp": datetime.now().isoformat()
-        }
+        return await job_manager.submit_once(key, analyze_and_store, domains=domains)
+    except JobLimitReached as exc:
+        raise HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+
+# POST /run-analysis
+@app.post("/run-analysis", status_code=202)
+async def run_supply_chain_analysis(domains: Optional[List[str]] = Query(None)):
+    """Queue a supply chain risk analysis and return its job id right away; results land in the store
+
+    While an analysis of the same dataset version and domains is queued or
+    running in any worker process, the request joins it and gets its job id
+    instead of starting another run. Once too many distinct analyses are
+    active the request is refused with 429 and a Retry-After header.
+    """
+    job = await submit_analysis(domains)
+    return {
+        "status": job.status,
+        "message": "Supply chain analysis queued" if job.status == "queued" else f"Supply chain analysis already {job.status}",
+        "jobId": job.id,
+        "timestamp": datetime.now().isoformat()
+    }
+
+# GET /run-analysis/stream
+@app.get("/run-analysis/stream")
+async def stream_supply_chain_analysis(request: Request, format: str = None, domains: Optional[List[str]] = Query(None)):
+    """Queue an analysis like POST /run-analysis and stream its stage output, shipment risk results and report tokens
+
+    The run is the same single-flight job POST /run-analysis queues or joins
+    and is stored when it finishes, whether or not the client is still
+    connected. Server-Sent Events by default; NDJSON with ?format=ndjson or
+    an `Accept: application/x-ndjson` header.
+    """
+    if format is None:
+        format = "ndjson" if "application/x-ndjson" in request.headers.get("accept", "") else "sse"
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be sse or ndjson")
+    job = await submit_analysis(domains)
+
+    async def body():
+        event_id = 0
+        async for event, data in stream_job(job, job_manager):
+            event_id += 1
+            yield format_sse(event, data, event_id) if format == "sse" else format_ndjson(event, data)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        # Keep reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# GET /jobs/{id}
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=MAX_JOB_WAIT_SECONDS)):
+    """A job's status and result; with ?wait=<seconds> the response is held until the job finishes or the time is up"""
+    job = await job_manager.wait(job_id, timeout=wait) if wait else await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+# DELETE /jobs/{id}
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not await job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job.to_dict()
+
+# GET /metrics
+@app.get("/metrics")
+def get_metrics():
+    """Stage, agent and handler metrics in the Prometheus text format
+
+    With several workers and METRICS_DIR set, the sum over all of them;
+    otherwise only the worker that answers.
+    """
+    return Response(telemetry.registry.render(telemetry.METRICS_DIR), media_type=telemetry.registry.content_type)
+
+
+if __name__ == "__main__":
+    import glob
+    import tempfile
+
+    import uvicorn
+
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and not telemetry.METRICS_DIR:
+        # The workers inherit the environment, so /metrics of any of them covers all
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="scrm-metrics-")
+    elif telemetry.METRICS_DIR:
+        # Snapshots left by an earlier server would be added to this one's counts
+        for path in glob.glob(os.path.join(telemetry.METRICS_DIR, "*.json")):
+            os.remove(path)
+
+    # Every worker is a separate process; they share the store, the analysis results and the job table
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+    )
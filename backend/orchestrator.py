@@ -0,0 +1,253 @@
+import os
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+
+import telemetry
+from domain_split import dumps_compact, merge_batch_reports, split_domains
+from ingestion import DEFAULT_DATASET_PATH, read_rows
+from clients import MODEL_DEPLOYMENT
+from llm_backend import AgentSpec, get_backend
+
+# Load environment variables from .env file
+load_dotenv()
+
+DATASET_PATH = os.getenv("SCRM_DATASET_PATH", DEFAULT_DATASET_PATH)
+# Token budget of a single domain batch and how many domain batches run at the same time
+DOMAIN_BATCH_TOKENS = int(os.getenv("DOMAIN_BATCH_TOKENS", "6000"))
+DOMAIN_MAX_CONCURRENCY = int(os.getenv("DOMAIN_MAX_CONCURRENCY", "4"))
+# How long a stored agent reply is reused for an identical request
+REPLY_CACHE_TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Agent instructions
+orchestration_agent_name = "orchestrierungs_agent"
+orchestration_instructions = """
+You are the Orchestrator Agent in a multi-agent system for Supply Chain Risk Management.
+
+## Goal
+Combine the domain-specific risk assessments of the specialist agents into one final risk report.
+
+## Behavior
+- Receive the risk assessments of the domain agents. The supply chain data has already been split by domain:
+  - Raw Material Information
+  - Logistics / Transportation Information
+  - Foundry Production Information
+  - Assembly & Test Information
+- A domain assessment may consist of several batches; treat them as one assessment.
+- Return a consolidated, well-structured final risk report.
+
+## Important
+- Do not invent data that is not part of the domain assessments.
+- Combine all results clearly and concisely.
+"""
+
+raw_material_agent_name = "raw_material_agent"
+raw_material_agent_instructions = """
+You are the Raw Material Risk Agent. Your task is to analyze Raw Material Information from the supply chain JSON data and identify potential supply chain risks.
+
+## Consider:
+- RawMaterialCountryOfOrigin: geopolitical or natural disaster risk
+- RawMaterialCostPerUnit: cost volatility
+- SupplierDependency: single-source or multi-source risks
+- LeadTimeDays: potential for long lead times or variability
+
+## Output
+- Provide a clear risk analysis of raw materials sourcing.
+- Highlight specific countries or suppliers with elevated risk.
+- Suggest mitigation strategies such as diversification or stockpiling.
+- Make your answer structured and easy to read.
+"""
+
+logistic_agent_name = "logistic_agent"
+logistic_agent_instructions = """
+You are the Logistics Risk Agent. Your task is to analyze the Logistics domain data for potential risks.
+## Consider:
+- AverageTransitTime
+- ShippingMode
+- OriginCountry risk
+- ShippingCost variability
+- Reliability
+
+## Output
+- Provide a clear risk assessment and recommendations to mitigate logistics risks.
+"""
+
+foundry_production_agent_name = 'foundry_production_agent'
+foundry_production_agent_instructions = """
+You are the Foundry Production Risk Agent. Your task is to analyze Foundry Production Data in the supply chain JSON and identify manufacturing risks.
+
+## Consider:
+- WaferLeadTimeDays: impact on production timelines
+- WaferYield: production efficiency and risk of rework
+- WaferCost: cost escalation risk
+- FabCycleTimeDays: bottleneck potential
+
+## Output
+- Provide a clear risk assessment of production operations.
+- Highlight lead time vulnerabilities, yield issues, or cost risks.
+- Offer mitigation suggestions such as alternative foundries or improved forecasting.
+- Make your analysis structured and easy to read.
+"""
+
+assembly_test_agent_name = 'assembly_test_agent'
+assembly_test_agent_instructions = """
+You are the Assembly & Test Risk Agent. Your task is to analyze Assembly & Test Data from the supply chain JSON and identify operational risks.
+
+## Consider:
+- AssemblyLeadTimeDays: delays in packaging and testing
+- PackagingCostPerUnit: cost control risk
+- AssemblyYield: yield losses
+- TestPassRate: quality and reliability concerns
+
+## Output
+- Provide a clear risk assessment for the assembly and testing stages.
+- Highlight any issues that could impact delivery or quality.
+- Suggest mitigation strategies such as second-source OSATs or yield improvement programs.
+- Make your analysis structured and easy to read.
+"""
+
+# Domain (see domain_split.DOMAIN_FIELDS) -> agent that analyzes it
+domain_agents = {
+    "raw_material": AgentSpec(raw_material_agent_name, raw_material_agent_instructions),
+    "logistic": AgentSpec(logistic_agent_name, logistic_agent_instructions),
+    "foundry_production": AgentSpec(foundry_production_agent_name, foundry_production_agent_instructions),
+    "assembly_test": AgentSpec(assembly_test_agent_name, assembly_test_agent_instructions),
+}
+orchestration_agent = AgentSpec(orchestration_agent_name, orchestration_instructions)
+
+domain_prompt = 'Analyze the following {domain} supply chain records (batch {batch} of {batches}):\n{records}'
+consolidation_prompt = 'Consolidate the following domain risk assessments into the final risk report:\n\n{reports}'
+
+
+async def warm_up():
+    """Create or update all agents ahead of the first analysis (see llm_backend / agent_registry)"""
+    await get_backend().warm_up([*domain_agents.values(), orchestration_agent])
+
+
+def load_dataset(path=None):
+    """Load the supply chain dataset (CSV, JSON or JSONL) that is sent to the orchestrator"""
+    return list(read_rows(path or DATASET_PATH))
+
+
+def dataset_version(path=None):
+    """Identifies the current content of the dataset file without reading it (path, mtime and size)"""
+    path = os.path.abspath(path or DATASET_PATH)
+    stat = os.stat(path)
+    return f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+async def gather_or_cancel(tasks):
+    """Gather `tasks`, cancelling the ones still running as soon as one of them fails"""
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def reply_key(agent, content):
+    """Hash of everything that determines an agent's reply to `content`"""
+    payload = "\n".join((MODEL_DEPLOYMENT, agent.name, agent.instructions or "", content))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def ask_agent(backend, agent, content, reply_cache=None, on_token=None):
+    """Ask an agent, reusing the reply `reply_cache` (a SupplyChainStore) stored for an identical request
+
+    Domain and consolidation prompts carry data, so only exact matches are
+    reused: a batch that differs in one row must get its own report. The
+    similarity-based SemanticCache is for free-form chat questions only.
+    With `on_token`, a coroutine function, the reply is streamed to it as it
+    is produced (a stored reply in one piece).
+    """
+    key = reply_key(agent, content)
+    if reply_cache is not None:
+        reply = await asyncio.to_thread(reply_cache.get_reply, key, REPLY_CACHE_TTL_SECONDS)
+        if reply is not None:
+            if on_token is not None:
+                await on_token(reply)
+            return reply
+
+    if on_token is None:
+        reply = await backend.aask_agent(agent, content)
+    else:
+        parts = []
+        async for text in backend.astream_agent(agent, content):
+            parts.append(text)
+            await on_token(text)
+        reply = "".join(parts)
+    # An empty reply is a failure of the service, not an answer worth keeping
+    if reply_cache is not None and reply:
+        await asyncio.to_thread(reply_cache.set_reply, key, reply)
+    return reply
+
+
+async def analyze_domains(backend, batches, max_concurrency=DOMAIN_MAX_CONCURRENCY, on_report=None, reply_cache=None):
+    """Send every domain batch to its domain agent concurrently and merge the partial reports per domain
+
+    `on_report(domain, report)`, a coroutine function, is awaited as soon as
+    all batches of a domain are done, before the other domains finish. With a
+    `reply_cache`, batches whose content did not change since an earlier run
+    reuse that run's report instead of calling the agent.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def analyze(domain, number, batch):
+        content = domain_prompt.format(
+            domain=domain.replace("_", " "), batch=number, batches=len(batches[domain]), records=dumps_compact(batch)
+        )
+        async with semaphore:
+            return await ask_agent(backend, domain_agents[domain], content, reply_cache)
+
+    async def analyze_domain(domain, domain_batches):
+        reports = await gather_or_cancel([
+            asyncio.ensure_future(analyze(domain, number, batch)) for number, batch in enumerate(domain_batches, start=1)
+        ])
+        report = merge_batch_reports(reports)
+        if on_report is not None:
+            await on_report(domain, report)
+        return report
+
+    tasks = {domain: asyncio.ensure_future(analyze_domain(domain, domain_batches)) for domain, domain_batches in batches.items()}
+    reports = await gather_or_cancel(list(tasks.values()))
+    return dict(zip(tasks, reports))
+
+
+def consolidation_content(domain_reports):
+    """The message asking the orchestration agent to consolidate the domain reports"""
+    reports = "\n\n".join(f"## {domain}\n{report}" for domain, report in domain_reports.items())
+    return consolidation_prompt.format(reports=reports)
+
+
+async def run_analysis(data=None, domains=None, reply_cache=None, on_report=None, on_token=None):
+    """Run one supply chain risk analysis and return the domain reports and the final report
+
+    The dataset is split into domain batches locally, the batches are analyzed
+    by the domain agents concurrently and the orchestrator consolidates the
+    domain reports. All agent calls go through the configured LLM backend;
+    with a `reply_cache` identical requests reuse the stored replies.
+    `on_report(domain, report)` is awaited as each domain report is done and
+    `on_token(text)` with the consolidated report as it streams in.
+    """
+    backend = get_backend()
+    with telemetry.span("analysis", "run_analysis") as analysis:
+        if data is None:
+            with telemetry.span("stage", "load"):
+                data = load_dataset()
+        analysis.set(records=len(data))
+        with telemetry.span("stage", "split") as split:
+            batches = split_domains(data, max_tokens=DOMAIN_BATCH_TOKENS, domains=domains)
+            split.set(batches=sum(len(domain_batches) for domain_batches in batches.values()))
+
+        with telemetry.span("stage", "domains"):
+            domain_reports = await analyze_domains(backend, batches, on_report=on_report, reply_cache=reply_cache)
+        with telemetry.span("stage", "consolidate"):
+            report = await ask_agent(
+                backend, orchestration_agent, consolidation_content(domain_reports), reply_cache, on_token,
+            )
+
+    return {
+        "domainReports": domain_reports,
+        "report": report,
+    }
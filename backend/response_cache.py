@@ -0,0 +1,165 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi.responses import Response
+
+import telemetry
+
+try:
+    import brotli
+except ImportError:  # Optional; without it responses are gzip-compressed only
+    brotli = None
+
+# Serialized responses kept in memory (one per path and query string)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# Smaller bodies are sent uncompressed; compressing them costs more than it saves
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+cache_results = telemetry.registry.counter(
+    "scrm_response_cache_total", "Cached GET responses served per result (hit, miss, not_modified)", ("route", "result"),
+)
+
+
+def serialize(content):
+    """JSON body bytes, encoded the way FastAPI's JSONResponse encodes them"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts (q > 0), from an Accept-Encoding header"""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CachedResponse:
+    """A serialized response of one data version, with its ETag and lazily compressed variants"""
+
+    def __init__(self, version, body, headers):
+        self.version = version
+        self.body = body
+        self.headers = headers
+        self.etag = f'"{version}-{hashlib.sha256(body).hexdigest()[:16]}"'
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, coding):
+        with self._lock:
+            if coding not in self._encoded:
+                if coding == "br":
+                    self._encoded[coding] = brotli.compress(self.body)
+                else:
+                    self._encoded[coding] = gzip.compress(self.body, compresslevel=6, mtime=0)
+            return self._encoded[coding]
+
+    def etag_for(self, coding):
+        # Strong ETags differ per content coding; all of them match If-None-Match
+        return self.etag if coding is None else f"{self.etag[:-1]}-{coding}\""
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return any(self.etag_for(coding) in tags for coding in (None, "gzip", "br"))
+
+
+class ResponseCache:
+    """Serialized GET responses keyed by path and query, valid as long as the store's data version
+
+    Every response carries a strong ETag derived from the data version and
+    body, so a poll with a matching If-None-Match gets an empty 304 without
+    loading or serializing anything. Bodies are built once per version and
+    compressed (brotli when available, else gzip) at most once per coding.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def respond(self, request, version, build, route=None):
+        """A response for `request`, from the cache when `version` did not change since it was built
+
+        `build()` returns the JSON content and extra headers (e.g.
+        X-Total-Count); exceptions it raises (HTTPException) are not cached.
+        """
+        route = route or request.url.path
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+        entry = self._get(key, version)
+        result = "hit"
+        if entry is None:
+            result = "miss"
+            content, headers = build()
+            entry = CachedResponse(version, serialize(content), headers)
+            self._put(key, entry)
+        if entry.matches(request.headers.get("if-none-match")):
+            result = "not_modified"
+        cache_results.inc(route=route, result=result)
+
+        coding = self._coding(request, entry)
+        headers = self._headers(entry, coding)
+        if result == "not_modified":
+            return Response(status_code=304, headers=headers)
+        if coding is not None:
+            headers["Content-Encoding"] = coding
+        return Response(entry.body if coding is None else entry.encoded(coding), media_type="application/json",
+                        headers=headers)
+
+    @staticmethod
+    def _coding(request, entry):
+        if len(entry.body) < COMPRESS_MIN_BYTES:
+            return None
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    @staticmethod
+    def _headers(entry, coding):
+        return {
+            **entry.headers,
+            "ETag": entry.etag_for(coding),
+            # Clients may keep the body but must revalidate it with If-None-Match
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,237 @@
+import copy
+import threading
+from collections import defaultdict
+
+from agents.news_enrichment import location_key
+from risk_scoring import HIGH_THRESHOLD, MEDIUM_THRESHOLD
+
+# Chance that a step with this risk level fails, the riskScore of dataset and seed steps.
+# Well below 1 for High, or the noisy-OR of a chain with one High step would
+# already be certain. With these, two High steps make a High chain
+# (1 - 0.58² >= HIGH_THRESHOLD); one High step and up to two Medium ones do not.
+STEP_RISK_PROBABILITIES = {"Low": 0.02, "Medium": 0.2, "High": 0.42}
+
+
+def risk_level(score):
+    if score is None:
+        return None
+    return "High" if score >= HIGH_THRESHOLD else "Medium" if score >= MEDIUM_THRESHOLD else "Low"
+
+
+def step_risk_level(score):
+    """Level of a step riskScore: the highest level whose STEP_RISK_PROBABILITIES it reaches"""
+    if score is None:
+        return None
+    return max((level for level, probability in STEP_RISK_PROBABILITIES.items() if score >= probability),
+               key=STEP_RISK_PROBABILITIES.get, default="Low")
+
+
+def noisy_or(scores):
+    """Probability that at least one of independent risks with these probabilities materializes"""
+    survive = 1.0
+    for score in scores:
+        survive *= 1.0 - min(max(score or 0.0, 0.0), 1.0)
+    return 1.0 - survive
+
+
+def step_parents(steps):
+    """Step id -> ids of the steps it depends on: `dependsOn` when given, else the previous step by order"""
+    ordered = sorted(steps, key=lambda step: step.get("order") or 0)
+    parents = {}
+    previous = None
+    for step in ordered:
+        depends_on = step.get("dependsOn")
+        parents[step["id"]] = list(depends_on) if depends_on is not None else ([previous] if previous else [])
+        previous = step["id"]
+    return parents
+
+
+def annotate(chain, parents=None):
+    """Derive a chain's risk from its steps' riskScore, in place, and return the chain
+
+    Every step gets the riskLevel of its riskScore (see step_risk_level()) and `propagatedRisk`: the noisy-OR of its own risk and that
+    of everything upstream of it. The chain gets `totalRisk` (the noisy-OR of
+    all its steps: the chance that any step fails), `criticalRisk` and
+    `criticalPath` (the upstream path with the highest noisy-OR risk) and the
+    matching `riskLevel`. Chains without steps keep totalRisk None.
+    """
+    steps = chain.get("steps") or []
+    if not steps:
+        chain.update(totalRisk=None, riskLevel=None, criticalRisk=None, criticalPath=[])
+        return chain
+    parents = parents or step_parents(steps)
+    by_id = {step["id"]: step for step in steps}
+    ancestors = {}
+    survive = {}
+    best_parent = {}
+    # Steps sorted by order, so every parent is handled before its children
+    for step in sorted(steps, key=lambda step: step.get("order") or 0):
+        step_id = step["id"]
+        step["riskLevel"] = step_risk_level(step.get("riskScore"))
+        own = 1.0 - min(max(step.get("riskScore") or 0.0, 0.0), 1.0)
+        upstream = set()
+        for parent in parents.get(step_id, ()):
+            if parent in by_id:
+                upstream |= ancestors[parent] | {parent}
+        ancestors[step_id] = upstream
+        step["propagatedRisk"] = round(noisy_or([by_id[ancestor].get("riskScore") for ancestor in upstream]
+                                                + [step.get("riskScore")]), 4)
+        candidates = [parent for parent in parents.get(step_id, ()) if parent in survive]
+        best_parent[step_id] = min(candidates, key=survive.get) if candidates else None
+        survive[step_id] = own * (survive[best_parent[step_id]] if candidates else 1.0)
+
+    sinks = [step_id for step_id in by_id if not any(step_id in parents.get(other, ()) for other in by_id)]
+    end = min(sinks or by_id, key=survive.get)
+    path = []
+    while end is not None:
+        path.append(end)
+        end = best_parent[end]
+    total = round(noisy_or([step.get("riskScore") for step in steps]), 4)
+    chain.update(
+        totalRisk=total,
+        riskLevel=risk_level(total),
+        criticalRisk=round(1.0 - survive[path[0]], 4),
+        criticalPath=path[::-1],
+    )
+    return chain
+
+
+class RiskGraph:
+    """In-memory graph of chains, steps, companies and locations with propagated risk
+
+    Chain and step nodes are linked by `contains` and step `dependsOn` edges;
+    steps point at their company and location, which are kept as inverted
+    indexes so "which chains run through Taiwan" touches only those chains.
+    Changing a step's riskScore re-derives that one chain (see annotate()).
+    `version` is the store data version the graph was built from.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._chains = {}
+        self._parents = {}
+        self._by_location = defaultdict(set)
+        self._by_company = defaultdict(set)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._chains)
+
+    @classmethod
+    def from_chains(cls, chains, version=None):
+        graph = cls()
+        for chain in chains:
+            graph.add_chain(chain)
+        graph.version = version
+        return graph
+
+    def add_chain(self, chain):
+        """Add or replace a chain (API shape with steps) and derive its risk"""
+        chain = copy.deepcopy(chain)
+        with self.lock:
+            self.remove_chain(chain["id"])
+            parents = step_parents(chain.get("steps") or [])
+            annotate(chain, parents)
+            self._chains[chain["id"]] = chain
+            self._parents[chain["id"]] = parents
+            for step in chain.get("steps") or []:
+                if step.get("location"):
+                    self._by_location[location_key(step["location"])].add((chain["id"], step["id"]))
+                if step.get("company"):
+                    self._by_company[location_key(step["company"])].add((chain["id"], step["id"]))
+        return copy.deepcopy(chain)
+
+    def apply(self, chains, chain_ids, version):
+        """Replace `chains` and drop the other `chain_ids` (deleted from the store); the graph is then at `version`"""
+        with self.lock:
+            for chain in chains:
+                self.add_chain(chain)
+            for chain_id in set(chain_ids) - {chain["id"] for chain in chains}:
+                self.remove_chain(chain_id)
+            self.version = version
+
+    def remove_chain(self, chain_id):
+        with self.lock:
+            chain = self._chains.pop(chain_id, None)
+            self._parents.pop(chain_id, None)
+            if chain is None:
+                return
+            for step in chain.get("steps") or []:
+                for index, key in ((self._by_location, location_key(step.get("location") or "")),
+                                   (self._by_company, location_key(step.get("company") or ""))):
+                    members = index.get(key)
+                    if members is not None:
+                        members.discard((chain_id, step["id"]))
+                        if not members:
+                            del index[key]
+
+    def get_chain(self, chain_id):
+        with self.lock:
+            chain = self._chains.get(chain_id)
+            return copy.deepcopy(chain) if chain is not None else None
+
+    def set_step_risk(self, chain_id, step_id, score, description=None, updated_at=None):
+        """Set one step's riskScore and re-derive its chain; returns the updated chain, or None if unknown"""
+        with self.lock:
+            chain = self._chains.get(chain_id)
+            step = next((step for step in (chain or {}).get("steps") or [] if step["id"] == step_id), None)
+            if step is None:
+                return None
+            self._set_step(step, score, description)
+            if updated_at is not None:
+                chain["lastUpdated"] = updated_at
+            annotate(chain, self._parents[chain_id])
+            return copy.deepcopy(chain)
+
+    @staticmethod
+    def _set_step(step, score, description):
+        step["riskScore"] = score
+        step["riskLevel"] = step_risk_level(score)
+        if description is not None:
+            step["riskDescription"] = description
+
+    def chains_at_location(self, location):
+        """Ids of the chains with a step at `location` (case and whitespace insensitive)"""
+        with self.lock:
+            return sorted({chain_id for chain_id, _ in self._by_location.get(location_key(location), ())})
+
+    def chains_of_company(self, company):
+        """Ids of the chains with a step run by `company` (case and whitespace insensitive)"""
+        with self.lock:
+            return sorted({chain_id for chain_id, _ in self._by_company.get(location_key(company), ())})
+
+    def summaries(self, chain_ids):
+        """Chains without their steps, riskiest first"""
+        with self.lock:
+            chains = [
+                {key: value for key, value in self._chains[chain_id].items() if key != "steps"}
+                for chain_id in chain_ids if chain_id in self._chains
+            ]
+        return sorted(chains, key=lambda chain: (-(chain["totalRisk"] or 0.0), chain["id"]))
+
+
+_graph = RiskGraph()
+_graph_lock = threading.Lock()
+
+
+def graph_for(store):
+    """The process-wide graph, brought up to date with `store` when its data changed (e.g. in another worker)
+
+    Only the chains written since the graph's version are loaded again (see
+    SupplyChainStore.chain_changes()); the whole graph is rebuilt only when
+    it is new or fell behind the store's change log.
+    """
+    global _graph
+    version = store.data_version()
+    if _graph.version != version:
+        with _graph_lock:
+            if _graph.version is None:
+                _graph = RiskGraph.from_chains(store.iter_chains(), version)
+            elif _graph.version != version:
+                with _graph.lock:
+                    version, changed = store.chain_changes(_graph.version)
+                    if changed is None:
+                        _graph = RiskGraph.from_chains(store.iter_chains(), version)
+                    else:
+                        _graph.apply(store.get_chains(changed), changed, version)
+    return _graph
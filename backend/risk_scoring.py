@@ -0,0 +1,121 @@
+import numpy as np
+
+from shipment_table import ShipmentTable
+
+# Weight of each risk factor in the overall score; normalized to sum to 1
+DEFAULT_WEIGHTS = {
+    "supplierRisk": 0.30,
+    "countryRisk": 0.25,
+    "leadTimeRisk": 0.20,
+    "inventoryRisk": 0.15,
+    "newsRisk": 0.10,
+}
+FACTORS = tuple(DEFAULT_WEIGHTS)
+
+LEVEL_VALUES = {"Low": 0.0, "Medium": 0.5, "High": 1.0}
+
+# riskArticleCount at which the news factor reaches ~63% of its maximum
+NEWS_SCALE = 5.0
+# Inventory is considered fully covered at twice the safety stock
+INVENTORY_TARGET_COVERAGE = 2.0
+
+HIGH_THRESHOLD = 0.66
+MEDIUM_THRESHOLD = 0.33
+
+
+def _levels(shipments, field):
+    if isinstance(shipments, ShipmentTable):
+        # One lookup per dictionary entry instead of one per shipment
+        return shipments.columns[field].map(LEVEL_VALUES)
+    return np.fromiter((LEVEL_VALUES[pkg[field]] for pkg in shipments), dtype=np.float64, count=len(shipments))
+
+
+def _numbers(shipments, field, default=0.0):
+    if isinstance(shipments, ShipmentTable):
+        if field not in shipments.columns:
+            return np.full(len(shipments), default, dtype=np.float64)
+        return shipments.columns[field].astype(np.float64)
+    return np.fromiter((pkg.get(field, default) for pkg in shipments), dtype=np.float64, count=len(shipments))
+
+
+def feature_matrix(shipments):
+    """Build the (n_shipments, n_factors) matrix of risk factors in [0, 1], columns ordered as FACTORS
+
+    `shipments` is a list of shipment dicts or a ShipmentTable.
+    """
+    wip = _numbers(shipments, "wipInventory")
+    safety = _numbers(shipments, "safetyStockLevel")
+    coverage = np.divide(wip, safety, out=np.full_like(wip, INVENTORY_TARGET_COVERAGE), where=safety > 0)
+    inventory_risk = np.clip(1.0 - coverage / INVENTORY_TARGET_COVERAGE, 0.0, 1.0)
+    news_risk = 1.0 - np.exp(-_numbers(shipments, "riskArticleCount") / NEWS_SCALE)
+
+    return np.column_stack([
+        _levels(shipments, "supplierRiskScore"),
+        _levels(shipments, "countryRiskLevel"),
+        _levels(shipments, "leadTimeRisk"),
+        inventory_risk,
+        news_risk,
+    ])
+
+
+def weight_vector(weights=None):
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    unknown = set(weights) - set(FACTORS)
+    if unknown:
+        raise ValueError(f"Unknown risk factors: {', '.join(sorted(unknown))}")
+    vector = np.array([weights[factor] for factor in FACTORS], dtype=np.float64)
+    if (vector < 0).any() or vector.sum() <= 0:
+        raise ValueError("Risk weights must be non-negative and not all zero")
+    return vector / vector.sum()
+
+
+def score_features(features, weights):
+    return features @ weights
+
+
+def bootstrap_ci(features, weights, n_boot=1000, confidence=0.95, seed=0, chunk_size=10000):
+    """Bootstrap confidence intervals of the weighted score for every row at once
+
+    Each bootstrap replicate resamples the risk factors with replacement; the
+    replicate is represented by how often each factor was drawn, so all rows are
+    scored against all replicates with a single matrix product per chunk.
+    Returns (low, high) arrays with one bound per row.
+    """
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(features.shape[1], np.full(features.shape[1], 1.0 / features.shape[1]), size=n_boot)
+    replicate_weights = counts * weights
+    replicate_weights /= replicate_weights.sum(axis=1, keepdims=True)
+
+    alpha = (1.0 - confidence) / 2.0
+    low = np.empty(features.shape[0])
+    high = np.empty(features.shape[0])
+    for start in range(0, features.shape[0], chunk_size):
+        scores = features[start:start + chunk_size] @ replicate_weights.T
+        low[start:start + chunk_size], high[start:start + chunk_size] = np.quantile(scores, [alpha, 1.0 - alpha], axis=1)
+    return low, high
+
+
+def risk_levels(scores):
+    return np.where(scores >= HIGH_THRESHOLD, "High", np.where(scores >= MEDIUM_THRESHOLD, "Medium", "Low"))
+
+
+def score_shipments(shipments, weights=None, n_boot=1000, confidence=0.95, seed=0):
+    """Compute the overall risk score, risk level and confidence interval for each shipment"""
+    if not shipments:
+        return []
+    features = feature_matrix(shipments)
+    weights = weight_vector(weights)
+    scores = score_features(features, weights)
+    low, high = bootstrap_ci(features, weights, n_boot=n_boot, confidence=confidence, seed=seed)
+    levels = risk_levels(scores)
+    product_ids = shipments.column("productId") if isinstance(shipments, ShipmentTable) else [pkg["productId"] for pkg in shipments]
+
+    return [
+        {
+            "productId": product_id,
+            "riskScore": round(float(score), 4),
+            "riskLevel": str(level),
+            "confidenceInterval": [round(float(lo), 4), round(float(hi), 4)],
+        }
+        for product_id, score, level, lo, hi in zip(product_ids, scores, levels, low, high)
+    ]
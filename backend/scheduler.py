@@ -0,0 +1,130 @@
+import os
+import time
+import random
+import asyncio
+from datetime import datetime
+
+import telemetry
+from jobs import JobLimitReached, job_manager
+from store import store
+from supplychains import analysis_key, analyze_and_store, refresh_chains
+
+# Opt in with ANALYSIS_SCHEDULER=1: the scheduler spends model calls (news lookups, full analyses) on its own
+SCHEDULER_ENABLED = os.getenv("ANALYSIS_SCHEDULER", "0") == "1"
+# How often a chain's risk is recomputed; High risk chains more often
+REFRESH_INTERVAL_SECONDS = float(os.getenv("REFRESH_INTERVAL_SECONDS", "3600"))
+HIGH_RISK_REFRESH_INTERVAL_SECONDS = float(os.getenv("HIGH_RISK_REFRESH_INTERVAL_SECONDS", "900"))
+# Full analysis run (domain reports and the risk results of all shipments)
+ANALYSIS_INTERVAL_SECONDS = float(os.getenv("ANALYSIS_INTERVAL_SECONDS", "21600"))
+# Every interval is spread by up to this share either way, so chains (and workers) do not all come due together
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0.2"))
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "30"))
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", "50"))
+# A claimed chain that was not rescheduled by then (its worker died) is due again
+REFRESH_LEASE_SECONDS = 600
+
+scheduled_refreshes = telemetry.registry.counter(
+    "scrm_scheduled_refreshes_total", "Chains refreshed by the scheduler per risk level", ("risk_level",),
+)
+
+
+class AnalysisScheduler:
+    """Background loop that keeps the stored risk results warm
+
+    Every tick it claims the chains that are due (High risk first) from the
+    store and scores their shipments again, then schedules each one after
+    its interval: `high_interval` for High risk chains, `interval` for the
+    others, spread by `jitter`. Claims go through the store, so the loops
+    of several worker processes share the work instead of repeating it.
+    Every `analysis_interval` it also queues a full analysis run through
+    the job manager, which joins one that is already running anywhere.
+    """
+
+    def __init__(self, target=store, jobs=job_manager, interval=REFRESH_INTERVAL_SECONDS,
+                 high_interval=HIGH_RISK_REFRESH_INTERVAL_SECONDS, analysis_interval=ANALYSIS_INTERVAL_SECONDS,
+                 jitter=SCHEDULE_JITTER, tick=SCHEDULER_TICK_SECONDS, batch_size=REFRESH_BATCH_SIZE,
+                 lease=REFRESH_LEASE_SECONDS, clock=time.time, rng=None):
+        self.target = target
+        self.jobs = jobs
+        self.interval = interval
+        self.high_interval = high_interval
+        self.analysis_interval = analysis_interval
+        self.jitter = jitter
+        self.tick = tick
+        self.batch_size = batch_size
+        self.lease = lease
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._next_analysis = None
+        self._task = None
+
+    def jittered(self, seconds):
+        return seconds * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def interval_for(self, risk_level):
+        return self.high_interval if risk_level == "High" else self.interval
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        # Workers started together should not tick in lockstep
+        await asyncio.sleep(self._rng.uniform(0, self.tick))
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Scheduled analysis failed: {e}")
+            await asyncio.sleep(self.jittered(self.tick))
+
+    async def run_once(self):
+        """Refresh the chains due now and queue the full analysis when it is due; returns the refreshed ids"""
+        now = self._clock()
+        if self._next_analysis is None:
+            self._next_analysis = await asyncio.to_thread(self._first_analysis_due)
+        if now >= self._next_analysis:
+            await self._queue_analysis()
+            self._next_analysis = now + self.jittered(self.analysis_interval)
+
+        due = await asyncio.to_thread(self.target.claim_due_chains, now, self.batch_size, self.lease)
+        if not due:
+            return []
+        refreshed = await refresh_chains([chain_id for chain_id, _ in due], target=self.target)
+        for chain_id, level in due:
+            if chain_id in refreshed:
+                scheduled_refreshes.inc(risk_level=level or "None")
+        finished = self._clock()
+        # A chain whose level changed with the refresh gets the interval of its new level
+        await asyncio.to_thread(self.target.reschedule_chains, {
+            chain_id: finished + self.jittered(self.interval_for(refreshed.get(chain_id) or level))
+            for chain_id, level in due
+        })
+        return list(refreshed)
+
+    def _first_analysis_due(self):
+        """One analysis interval after the latest stored run; right away when there is none"""
+        run = self.target.get_run()
+        if run is None:
+            return self._clock()
+        finished = datetime.fromisoformat(run["createdAt"].replace("Z", "+00:00")).timestamp()
+        return finished + self.jittered(self.analysis_interval)
+
+    async def _queue_analysis(self):
+        try:
+            key = await asyncio.to_thread(analysis_key)
+            await self.jobs.submit_once(key, analyze_and_store)
+        except JobLimitReached:
+            # Retried at the next interval; on-demand analyses keep the slots they asked for
+            pass
+        except OSError as e:
+            print(f"Scheduled analysis not queued: {e}")
+
+
+scheduler = AnalysisScheduler()
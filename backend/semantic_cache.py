@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import threading
+
+import numpy as np
+
+import telemetry
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Set SEMANTIC_CACHE=0 to send every question to the model
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1") != "0"
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", os.path.join(BACKEND_DIR, ".semantic_cache"))
+# Cosine similarity (0..1) from which a cached reply is reused for a new question
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Hashed n-gram features per vector; on disk a vector takes 2 bytes (float16) per dimension
+EMBEDDING_DIM = 512
+# Share of the vector that comes from the conversation context rather than the question itself
+CONTEXT_WEIGHT = 0.25
+
+_WORD = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or the to what which who with about does do "
+    "there this that these those me my our we you your".split()
+)
+
+cache_results = telemetry.registry.counter(
+    "scrm_semantic_cache_total", "Semantic cache lookups per cache and result (hit, miss)", ("cache", "result"),
+)
+
+
+def _features(text):
+    """Word unigrams and character trigrams of the words (order-insensitive, tolerant to small rewordings)"""
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        yield f"w:{word}", 1.0
+        padded = f" {word} "
+        for start in range(len(padded) - 2):
+            yield padded[start:start + 3], 0.5
+
+
+def embed(text, context=None, dim=EMBEDDING_DIM):
+    """Unit-length hashed n-gram vector of `text`, blended with `context` at CONTEXT_WEIGHT"""
+    vector = _hashed(text, dim)
+    if context:
+        vector = (1 - CONTEXT_WEIGHT) * vector + CONTEXT_WEIGHT * _hashed(context, dim)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _hashed(text, dim):
+    indexes, weights = [], []
+    for feature, weight in _features(text):
+        digest = zlib.crc32(feature.encode("utf-8"))
+        indexes.append(digest % dim)
+        # The sign bit keeps colliding features from only ever adding up
+        weights.append(weight if digest & 0x80000000 else -weight)
+    vector = np.zeros(dim, dtype=np.float32)
+    np.add.at(vector, np.asarray(indexes, dtype=np.intp), np.asarray(weights, dtype=np.float32))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def scope_id(*parts):
+    """64-bit id of everything a reply must match exactly (model, agent, system prompt)"""
+    digest = hashlib.sha256("\n".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") & 0x7FFFFFFFFFFFFFFF
+
+
+class SemanticCache:
+    """Replies to earlier questions, found again for a sufficiently similar question in the same scope
+
+    Questions (optionally blended with their conversation context) are
+    embedded as hashed word and character-trigram vectors; a lookup is one
+    matrix-vector product over the entries of the scope. At most
+    `max_entries` replies are kept (least recently used evicted first), each
+    for `ttl` seconds. With a `path` the index is kept in a compact .npz file
+    (float16 vectors plus the replies) and reloaded by the next process.
+    """
+
+    def __init__(self, path=None, name="semantic", threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE,
+                 ttl=SEMANTIC_CACHE_TTL_SECONDS, dim=EMBEDDING_DIM, clock=time.time):
+        self.path = path
+        self.name = name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._scopes = np.zeros(max_entries, dtype=np.int64)
+        self._created = np.zeros(max_entries, dtype=np.float64)
+        self._used = np.zeros(max_entries, dtype=np.float64)
+        self._occupied = np.zeros(max_entries, dtype=bool)
+        self._replies = [None] * max_entries
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        with self._lock:
+            return int(self._occupied.sum())
+
+    def _live(self, scope, now):
+        return np.flatnonzero(self._occupied & (self._scopes == scope) & (self._created > now - self.ttl))
+
+    def _best(self, scope, vector, now):
+        candidates = self._live(scope, now)
+        if not len(candidates):
+            return None, 0.0
+        similarities = self._vectors[candidates] @ vector
+        best = int(np.argmax(similarities))
+        return int(candidates[best]), float(similarities[best])
+
+    def get(self, scope, text, context=None):
+        """The cached reply to the most similar question in `scope`, or None below the threshold"""
+        vector = embed(text, context, self.dim)
+        now = self._clock()
+        with self._lock:
+            slot, similarity = self._best(scope, vector, now)
+            if slot is None or similarity < self.threshold:
+                self.misses += 1
+                cache_results.inc(cache=self.name, result="miss")
+                return None
+            self.hits += 1
+            self._used[slot] = now
+            reply = self._replies[slot]
+        cache_results.inc(cache=self.name, result="hit")
+        telemetry.add_to_span("semantic_similarity", round(similarity, 4))
+        return reply
+
+    def set(self, scope, text, reply, context=None):
+        vector = embed(text, context, self.dim)
+        now = self._clock()
+        with self._lock:
+            slot, similarity = self._best(scope, vector, now)
+            # A (nearly) identical question replaces its entry instead of taking another slot
+            if slot is None or similarity < 0.999:
+                slot = self._free_slot(now)
+            self._vectors[slot] = vector
+            self._scopes[slot] = scope
+            self._created[slot] = now
+            self._used[slot] = now
+            self._occupied[slot] = True
+            self._replies[slot] = reply
+            if self.path:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._occupied[:] = False
+            self._replies = [None] * self.max_entries
+            if self.path:
+                self._save()
+
+    def _free_slot(self, now):
+        free = np.flatnonzero(~self._occupied | (self._created <= now - self.ttl))
+        if len(free):
+            return int(free[0])
+        return int(np.argmin(self._used))
+
+    def _save(self):
+        slots = np.flatnonzero(self._occupied)
+        replies = json.dumps([self._replies[slot] for slot in slots]).encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Written next to the index and renamed, so a crash never leaves half an index behind;
+        # named per process, as worker processes share the index (saves within one hold the lock)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(
+                f,
+                vectors=self._vectors[slots].astype(np.float16),
+                scopes=self._scopes[slots],
+                created=self._created[slots],
+                used=self._used[slots],
+                replies=np.frombuffer(replies, dtype=np.uint8),
+            )
+        os.replace(temporary, self.path)
+
+    def _load(self):
+        try:
+            with np.load(self.path) as index:
+                vectors, scopes = index["vectors"], index["scopes"]
+                created, used = index["created"], index["used"]
+                replies = json.loads(index["replies"].tobytes().decode("utf-8"))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable semantic cache {self.path}: {e}")
+            return
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            return
+        now = self._clock()
+        # Keep the most recently used entries that have not expired
+        order = [index for index in np.argsort(-used) if created[index] > now - self.ttl][:self.max_entries]
+        for slot, index in enumerate(order):
+            self._vectors[slot] = vectors[index]
+            self._scopes[slot] = scopes[index]
+            self._created[slot] = created[index]
+            self._used[slot] = used[index]
+            self._occupied[slot] = True
+            self._replies[slot] = replies[index]
+
+
+def open_cache(name):
+    """The on-disk semantic cache called `name`, or None when SEMANTIC_CACHE=0"""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    return SemanticCache(path=os.path.join(SEMANTIC_CACHE_DIR, f"{name}.npz"), name=name)
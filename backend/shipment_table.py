@@ -0,0 +1,321 @@
+import json
+
+import numpy as np
+
+from ingestion import DEFAULT_DATASET_PATH, RISK_LEVELS, iter_shipment_chunks
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library encoder produces the same compact JSON, only slower
+    orjson = None
+
+# Shipment fields kept as dictionary-encoded codes; levels always use RISK_LEVELS as their dictionary
+CATEGORICAL_FIELDS = ("chipType", "node", "supplierLocation")
+LEVEL_FIELDS = ("supplierRiskScore", "countryRiskLevel", "leadTimeRisk", "riskLevel")
+NUMERIC_FIELDS = {
+    "unitPrice": np.float64,
+    "wipInventory": np.int64,
+    "safetyStockLevel": np.int64,
+    "riskArticleCount": np.int32,
+}
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (StringColumn, CategoricalColumn)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_bytes(value):
+    """Compact UTF-8 JSON (no indentation or spaces); NumPy arrays and table columns become lists"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+def dumps(value):
+    return dumps_bytes(value).decode("utf-8")
+
+
+def _smallest_code_dtype(size):
+    return np.uint8 if size <= 0xFF else np.uint16 if size <= 0xFFFF else np.uint32
+
+
+class StringColumn:
+    """Variable-length strings as one UTF-8 buffer plus offsets (the Arrow string layout)"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets.astype(np.int32) if offsets[-1] < 2 ** 31 else offsets)
+
+    @classmethod
+    def concat(cls, columns):
+        data = np.concatenate([column.data for column in columns]) if columns else np.zeros(0, dtype=np.uint8)
+        offsets, base = [np.zeros(1, dtype=np.int64)], 0
+        for column in columns:
+            offsets.append(column.offsets[1:].astype(np.int64) + base)
+            base += int(column.offsets[-1])
+        offsets = np.concatenate(offsets)
+        return cls(data, offsets.astype(np.int32) if offsets[-1] < 2 ** 31 else offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def take(self, indexes):
+        return StringColumn.from_strings([self[int(index)] for index in indexes])
+
+    def slice(self, start, stop):
+        offsets = self.offsets[start:stop + 1]
+        return StringColumn(self.data[offsets[0]:offsets[-1]], offsets - offsets[0])
+
+    def tolist(self):
+        count = len(self)
+        if count == 0:
+            return []
+        if self.data.any() and not (self.data == 0).any():
+            # Copy the bytes into one buffer with a NUL after each string and split it: one decode for all rows
+            joined = np.zeros(len(self.data) + count - 1, dtype=np.uint8)
+            keep = np.ones(len(joined), dtype=bool)
+            keep[self.offsets[1:-1] + np.arange(count - 1)] = False
+            joined[keep] = self.data
+            return joined.tobytes().decode("utf-8").split("\0")
+        raw = self.data.tobytes()
+        bounds = self.offsets.tolist()
+        return [raw[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])]
+
+
+class CategoricalColumn:
+    """Dictionary-encoded strings: the distinct values once plus one small integer code per row"""
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = list(categories)
+
+    @classmethod
+    def from_strings(cls, values, categories=None):
+        lookup = {category: code for code, category in enumerate(categories or ())}
+        fixed = categories is not None
+        codes = []
+        for value in values:
+            code = lookup.get(value)
+            if code is None:
+                if fixed:
+                    raise ValueError(f"expected one of {', '.join(categories)}, got {value!r}")
+                code = lookup[value] = len(lookup)
+            codes.append(code)
+        categories = list(lookup)
+        return cls(np.array(codes, dtype=_smallest_code_dtype(len(categories))), categories)
+
+    @classmethod
+    def concat(cls, columns):
+        categories, lookup, parts = [], {}, []
+        for column in columns:
+            remap = np.array([lookup.setdefault(category, len(lookup)) for category in column.categories], dtype=np.int64)
+            parts.append(remap[column.codes] if len(remap) else column.codes.astype(np.int64))
+        categories = list(lookup)
+        codes = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        return cls(codes.astype(_smallest_code_dtype(len(categories))), categories)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.categories[self.codes[index]]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + sum(len(category.encode("utf-8")) for category in self.categories)
+
+    def take(self, indexes):
+        return CategoricalColumn(self.codes[indexes], self.categories)
+
+    def slice(self, start, stop):
+        return CategoricalColumn(self.codes[start:stop], self.categories)
+
+    def map(self, values, dtype=np.float64):
+        """Per-row array of `values[category]` (a dict), computed once per category"""
+        return np.array([values[category] for category in self.categories], dtype=dtype)[self.codes]
+
+    def tolist(self):
+        return np.array(self.categories, dtype=object)[self.codes].tolist()
+
+
+def _column_from_values(field, values):
+    if field in LEVEL_FIELDS:
+        return CategoricalColumn.from_strings(values, RISK_LEVELS)
+    if field in CATEGORICAL_FIELDS:
+        return CategoricalColumn.from_strings(values)
+    if field in NUMERIC_FIELDS:
+        column = np.fromiter(values, dtype=NUMERIC_FIELDS[field], count=len(values))
+        # Counts and stock levels fit in 32 bits in practice; only keep 64 when they do not
+        if column.dtype == np.int64 and len(column) and np.iinfo(np.int32).min <= column.min() <= column.max() <= np.iinfo(np.int32).max:
+            column = column.astype(np.int32)
+        return column
+    return StringColumn.from_strings([str(value) for value in values])
+
+
+def _concat(parts):
+    if isinstance(parts[0], StringColumn):
+        return StringColumn.concat(parts)
+    if isinstance(parts[0], CategoricalColumn):
+        return CategoricalColumn.concat(parts)
+    return np.concatenate(parts)
+
+
+class ShipmentTable:
+    """Shipments stored by column instead of as one dict per shipment
+
+    Numeric fields are NumPy arrays, low-cardinality strings (chip type,
+    node, supplier location, risk levels) are dictionary-encoded and ids are
+    packed into one UTF-8 buffer with offsets; a million shipments take a few
+    tens of MB instead of several hundred. records() gives dicts back for
+    code that wants the row shape, to_json(orient="columns") serializes
+    without building them, and to_arrow()/write_parquet() hand the columns
+    to Arrow without copying (pyarrow is optional).
+    """
+
+    def __init__(self, columns):
+        self.columns = dict(columns)
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"columns have different lengths: {sorted(lengths)}")
+        self._length = lengths.pop() if lengths else 0
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        fields = list(records[0]) if records else []
+        return cls({field: _column_from_values(field, [record[field] for record in records]) for field in fields})
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Build a table from lists of records, converting each chunk to columns before reading the next"""
+        parts = [cls.from_records(chunk) for chunk in chunks if chunk]
+        if not parts:
+            return cls({})
+        return cls({field: _concat([part.columns[field] for part in parts]) for field in parts[0].columns})
+
+    @classmethod
+    def load(cls, path=DEFAULT_DATASET_PATH, format=None, skip_invalid=False, chunk_size=100000):
+        """Load and validate a dataset file (see ingestion.iter_shipment_chunks) into a table"""
+        return cls.from_chunks(iter_shipment_chunks(path, chunk_size=chunk_size, format=format, skip_invalid=skip_invalid))
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def fields(self):
+        return list(self.columns)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def column(self, field):
+        """The values of one field: a NumPy array for numbers, a list of str otherwise"""
+        column = self.columns[field]
+        return column if isinstance(column, np.ndarray) else column.tolist()
+
+    def with_column(self, field, values):
+        """A table sharing this one's columns plus `field` (an array, column or list of values)"""
+        if not isinstance(values, (np.ndarray, StringColumn, CategoricalColumn)):
+            values = _column_from_values(field, list(values))
+        return ShipmentTable({**self.columns, field: values})
+
+    def take(self, indexes):
+        """A table with the rows at `indexes`, in that order"""
+        indexes = np.asarray(indexes, dtype=np.int64)
+        return ShipmentTable({
+            field: column[indexes] if isinstance(column, np.ndarray) else column.take(indexes)
+            for field, column in self.columns.items()
+        })
+
+    def slice(self, start, stop=None):
+        """Rows `start` to `stop` as a table that shares this one's buffers"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        return ShipmentTable({field: column[start:stop] if isinstance(column, np.ndarray) else column.slice(start, stop)
+                              for field, column in self.columns.items()})
+
+    def records(self, start=0, stop=None):
+        """Rows `start` to `stop` as shipment dicts"""
+        table = self if start == 0 and stop is None else self.slice(start, stop)
+        columns = [table.column(field) for field in table.fields]
+        columns = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns]
+        return [dict(zip(table.fields, row)) for row in zip(*columns)]
+
+    def to_json(self, orient="records"):
+        """Compact JSON: a list of shipment objects, or with orient="columns" one list per field"""
+        if orient == "columns":
+            return dumps_bytes({field: self.columns[field] for field in self.fields})
+        if orient != "records":
+            raise ValueError(f"orient must be records or columns, got {orient!r}")
+        return dumps_bytes(self.records())
+
+    def to_arrow(self):
+        """A pyarrow.Table; numeric columns and string buffers are shared, categoricals become dictionary arrays"""
+        import pyarrow as pa
+
+        arrays = []
+        for field, column in self.columns.items():
+            if isinstance(column, StringColumn):
+                string_type = pa.string() if column.offsets.dtype == np.int32 else pa.large_string()
+                arrays.append(pa.Array.from_buffers(
+                    string_type, len(column), [None, pa.py_buffer(column.offsets), pa.py_buffer(column.data)],
+                ))
+            elif isinstance(column, CategoricalColumn):
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(column.codes), pa.array(column.categories, pa.string())))
+            else:
+                arrays.append(pa.array(column))
+        return pa.Table.from_arrays(arrays, names=self.fields)
+
+    @classmethod
+    def from_arrow(cls, table):
+        """A table from a pyarrow.Table, encoded like load(): plain string columns written by other tools
+        become categoricals for the categorical fields, and risk levels always use the RISK_LEVELS codes"""
+        import pyarrow as pa
+
+        columns = {}
+        for field, chunked in zip(table.column_names, table.columns):
+            array = chunked.combine_chunks()
+            if field in LEVEL_FIELDS or (field in CATEGORICAL_FIELDS and not pa.types.is_dictionary(array.type)):
+                columns[field] = _column_from_values(field, array.to_pylist())
+            elif pa.types.is_dictionary(array.type):
+                columns[field] = CategoricalColumn(
+                    array.indices.to_numpy(zero_copy_only=False), array.dictionary.to_pylist(),
+                )
+            elif pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+                columns[field] = StringColumn.from_strings(array.to_pylist())
+            else:
+                columns[field] = array.to_numpy(zero_copy_only=False)
+        return cls(columns)
+
+    def write_parquet(self, path, **options):
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), path, **options)
+
+    @classmethod
+    def read_parquet(cls, path):
+        import pyarrow.parquet as pq
+
+        return cls.from_arrow(pq.read_table(path))
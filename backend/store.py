@@ -0,0 +1,632 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BACKEND_DIR, "scrm.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chains (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    total_risk REAL,
+    risk_level TEXT,
+    last_updated TEXT NOT NULL,
+    critical_risk REAL,
+    critical_path TEXT
+);
+CREATE INDEX IF NOT EXISTS chains_risk_level ON chains (risk_level, last_updated);
+CREATE INDEX IF NOT EXISTS chains_last_updated ON chains (last_updated);
+
+CREATE TABLE IF NOT EXISTS steps (
+    chain_id TEXT NOT NULL REFERENCES chains (id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    step_order INTEGER NOT NULL,
+    category TEXT,
+    title TEXT,
+    description TEXT,
+    location TEXT,
+    company TEXT,
+    risk_score REAL,
+    risk_level TEXT,
+    risk_description TEXT,
+    propagated_risk REAL,
+    PRIMARY KEY (chain_id, id)
+);
+CREATE INDEX IF NOT EXISTS steps_chain_order ON steps (chain_id, step_order);
+
+CREATE TABLE IF NOT EXISTS analysis_runs (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    report TEXT,
+    domain_reports TEXT,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS analysis_runs_created_at ON analysis_runs (created_at);
+
+CREATE TABLE IF NOT EXISTS risk_results (
+    run_id TEXT NOT NULL REFERENCES analysis_runs (id) ON DELETE CASCADE,
+    product_id TEXT NOT NULL,
+    risk_score REAL NOT NULL,
+    risk_level TEXT NOT NULL,
+    ci_low REAL,
+    ci_high REAL,
+    PRIMARY KEY (run_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS risk_results_level ON risk_results (run_id, risk_level, risk_score);
+
+CREATE TABLE IF NOT EXISTS shipment_state (
+    product_id TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    risk_article_count INTEGER,
+    news_expires_at REAL,
+    risk_result TEXT NOT NULL,
+    scored_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS chain_schedule (
+    chain_id TEXT PRIMARY KEY,
+    due_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0);
+-- chain_changes holds the chain writes of the data versions after this one
+INSERT OR IGNORE INTO meta (key, value) VALUES ('chain_changes_floor', 0);
+
+CREATE TABLE IF NOT EXISTS chain_changes (
+    version INTEGER NOT NULL,
+    chain_id TEXT NOT NULL,
+    PRIMARY KEY (version, chain_id)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    heartbeat_at REAL NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_key_status ON jobs (key, status);
+CREATE INDEX IF NOT EXISTS jobs_owner_status ON jobs (owner, status);
+
+CREATE TABLE IF NOT EXISTS agent_replies (
+    key TEXT PRIMARY KEY,
+    reply TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+STEP_COLUMNS = ("id", "step_order", "category", "title", "description", "location", "company",
+                "risk_score", "risk_level", "risk_description", "propagated_risk")
+# API field of each steps column
+STEP_FIELDS = ("id", "order", "category", "title", "description", "location", "company",
+               "riskScore", "riskLevel", "riskDescription", "propagatedRisk")
+CHAIN_COLUMNS = "id, title, total_risk, risk_level, last_updated, critical_risk, critical_path"
+
+# Columns added after the first release; open() adds them to databases created before
+MIGRATIONS = {
+    "chains": (("critical_risk", "REAL"), ("critical_path", "TEXT")),
+    "steps": (("propagated_risk", "REAL"),),
+    "shipment_state": (("scored_at", "REAL"),),
+    "analysis_runs": (("digest", "TEXT"),),
+}
+
+# Job statuses of queued and running jobs (see jobs.py)
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+MAX_PAGE_SIZE = 1000
+# Data versions whose chain writes are kept for readers catching up (see chain_changes())
+CHAIN_CHANGE_HISTORY = 1000
+# Stay below SQLite's limit on bound parameters per statement
+MAX_QUERY_PARAMS = 500
+
+
+class SupplyChainStore:
+    """SQLite store for supply chains, their steps and the results of analysis runs
+
+    Chains and steps use the same JSON shape as the API (totalRisk, riskLevel,
+    lastUpdated, steps[...]). One connection is shared by all threads behind a
+    lock; WAL mode keeps readers in other processes from blocking on writes.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._db = None
+        self._lock = threading.RLock()
+
+    def open(self):
+        with self._lock:
+            if self._db is not None:
+                return self
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.execute("PRAGMA foreign_keys = ON")
+            self._db.executescript(SCHEMA)
+            self._migrate()
+        return self
+
+    def _migrate(self):
+        for table, columns in MIGRATIONS.items():
+            existing = {row["name"] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            for name, column_type in columns:
+                if name not in existing:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            raise RuntimeError("SupplyChainStore is not open")
+        return self._db
+
+    def data_version(self):
+        """Counter bumped by every write to chains and analysis runs; cached API responses are keyed by it"""
+        with self._lock:
+            return self._conn().execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+
+    @staticmethod
+    def _bump_version(db):
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version'")
+
+    # Supply chains
+
+    def upsert_chains(self, chains):
+        """Insert or replace chains (API shape, with their steps) in one transaction"""
+        with self._lock, self._conn() as db:
+            chains = list(chains)
+            db.executemany(
+                f"INSERT INTO chains ({CHAIN_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET title = excluded.title, total_risk = excluded.total_risk, "
+                "risk_level = excluded.risk_level, last_updated = excluded.last_updated, "
+                "critical_risk = excluded.critical_risk, critical_path = excluded.critical_path",
+                [(chain["id"], chain["title"], chain.get("totalRisk"), chain.get("riskLevel"), chain["lastUpdated"],
+                  chain.get("criticalRisk"), json.dumps(chain.get("criticalPath") or []))
+                 for chain in chains],
+            )
+            db.executemany("DELETE FROM steps WHERE chain_id = ?", [(chain["id"],) for chain in chains])
+            db.executemany(
+                f"INSERT INTO steps (chain_id, {', '.join(STEP_COLUMNS)}) VALUES (?{', ?' * len(STEP_COLUMNS)})",
+                [(chain["id"], *(step.get(field) for field in STEP_FIELDS))
+                 for chain in chains for step in chain.get("steps", ())],
+            )
+            if chains:
+                self._bump_version(db)
+                version = db.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+                db.executemany("INSERT OR IGNORE INTO chain_changes (version, chain_id) VALUES (?, ?)",
+                               [(version, chain["id"]) for chain in chains])
+                floor = version - CHAIN_CHANGE_HISTORY
+                db.execute("DELETE FROM chain_changes WHERE version <= ?", (floor,))
+                db.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'chain_changes_floor'", (floor,))
+        return len(chains)
+
+    def chain_changes(self, since):
+        """(data version, ids of the chains written after version `since`)
+
+        The ids are None when the change log no longer reaches back to
+        `since`; the reader has to load every chain again then.
+        """
+        with self._lock:
+            db = self._conn()
+            # The version first: a write landing in between shows up in the ids, never the other way round
+            version = db.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+            floor = db.execute("SELECT value FROM meta WHERE key = 'chain_changes_floor'").fetchone()[0]
+            if since < floor or since > version:
+                return version, None
+            rows = db.execute("SELECT DISTINCT chain_id FROM chain_changes WHERE version > ?", (since,)).fetchall()
+        return version, [row[0] for row in rows]
+
+    def count_chains(self):
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM chains").fetchone()[0]
+
+    @staticmethod
+    def _chain(row):
+        return {
+            "id": row["id"],
+            "title": row["title"],
+            "totalRisk": row["total_risk"],
+            "riskLevel": row["risk_level"],
+            "lastUpdated": row["last_updated"],
+            "criticalRisk": row["critical_risk"],
+            "criticalPath": json.loads(row["critical_path"] or "[]"),
+        }
+
+    def list_chains(self, risk_level=None, updated_since=None, updated_before=None, search=None, limit=50, offset=0):
+        """One page of chains (without steps), newest first, and the total number of matches"""
+        clauses, params = [], []
+        if risk_level is not None:
+            clauses.append("risk_level = ?")
+            params.append(risk_level)
+        if updated_since is not None:
+            clauses.append("last_updated >= ?")
+            params.append(updated_since)
+        if updated_before is not None:
+            clauses.append("last_updated < ?")
+            params.append(updated_before)
+        if search:
+            clauses.append("title LIKE ? ESCAPE '\\'")
+            params.append("%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+
+        with self._lock:
+            db = self._conn()
+            total = db.execute(f"SELECT COUNT(*) FROM chains {where}", params).fetchone()[0]
+            rows = db.execute(
+                f"SELECT {CHAIN_COLUMNS} FROM chains {where} "
+                "ORDER BY last_updated DESC, id LIMIT ? OFFSET ?",
+                [*params, limit, max(0, offset)],
+            ).fetchall()
+        return [self._chain(row) for row in rows], total
+
+    def get_chain(self, chain_id):
+        """A chain with its ordered steps, or None"""
+        with self._lock:
+            db = self._conn()
+            row = db.execute(f"SELECT {CHAIN_COLUMNS} FROM chains WHERE id = ?", (chain_id,)).fetchone()
+            if row is None:
+                return None
+            steps = db.execute(
+                f"SELECT {', '.join(STEP_COLUMNS)} FROM steps WHERE chain_id = ? ORDER BY step_order", (chain_id,)
+            ).fetchall()
+        chain = self._chain(row)
+        chain["steps"] = [dict(zip(STEP_FIELDS, step)) for step in steps]
+        return chain
+
+    def iter_chains(self):
+        """Every chain with its ordered steps, read in two queries"""
+        with self._lock:
+            db = self._conn()
+            rows = db.execute(f"SELECT {CHAIN_COLUMNS} FROM chains ORDER BY id").fetchall()
+            steps = db.execute(
+                f"SELECT chain_id, {', '.join(STEP_COLUMNS)} FROM steps ORDER BY chain_id, step_order"
+            ).fetchall()
+        return self._with_steps(rows, steps)
+
+    def get_chains(self, chain_ids):
+        """The chains of `chain_ids` that exist, with their ordered steps"""
+        chain_ids = list(chain_ids)
+        rows, steps = [], []
+        with self._lock:
+            db = self._conn()
+            for start in range(0, len(chain_ids), MAX_QUERY_PARAMS):
+                chunk = chain_ids[start:start + MAX_QUERY_PARAMS]
+                placeholders = ", ".join("?" * len(chunk))
+                rows += db.execute(f"SELECT {CHAIN_COLUMNS} FROM chains WHERE id IN ({placeholders})", chunk).fetchall()
+                steps += db.execute(
+                    f"SELECT chain_id, {', '.join(STEP_COLUMNS)} FROM steps WHERE chain_id IN ({placeholders}) "
+                    "ORDER BY chain_id, step_order",
+                    chunk,
+                ).fetchall()
+        return list(self._with_steps(rows, steps))
+
+    def _with_steps(self, rows, steps):
+        by_chain = {}
+        for step in steps:
+            by_chain.setdefault(step["chain_id"], []).append(dict(zip(STEP_FIELDS, tuple(step)[1:])))
+        for row in rows:
+            chain = self._chain(row)
+            chain["steps"] = by_chain.get(row["id"], [])
+            yield chain
+
+    # Analysis runs
+
+    def save_run(self, run_id, created_at, report, domain_reports, risk_results, digest=None):
+        """Store the reports of one analysis run and its per-shipment risk results
+
+        `digest` identifies the content of the run, so an identical later run
+        can reuse this one instead of being stored again (see find_run()).
+        """
+        with self._lock, self._conn() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO analysis_runs (id, created_at, report, domain_reports, digest) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, created_at, report, json.dumps(domain_reports), digest),
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO risk_results (run_id, product_id, risk_score, risk_level, ci_low, ci_high) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, result["productId"], result["riskScore"], result["riskLevel"], *result["confidenceInterval"])
+                 for result in risk_results],
+            )
+            self._bump_version(db)
+
+    def find_run(self, digest):
+        """Id of the latest run when it was saved with `digest`, else None"""
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT id, digest FROM analysis_runs ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+        return row["id"] if row is not None and row["digest"] == digest else None
+
+    def get_run(self, run_id=None):
+        """An analysis run (the latest one without `run_id`), or None"""
+        with self._lock:
+            db = self._conn()
+            if run_id is None:
+                row = db.execute("SELECT * FROM analysis_runs ORDER BY created_at DESC LIMIT 1").fetchone()
+            else:
+                row = db.execute("SELECT * FROM analysis_runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "runId": row["id"],
+            "createdAt": row["created_at"],
+            "report": row["report"],
+            "domainReports": json.loads(row["domain_reports"] or "{}"),
+        }
+
+    def list_risk_results(self, run_id, risk_level=None, limit=50, offset=0):
+        """One page of a run's risk results, riskiest first, and the total number of matches"""
+        clauses, params = ["run_id = ?"], [run_id]
+        if risk_level is not None:
+            clauses.append("risk_level = ?")
+            params.append(risk_level)
+        where = " AND ".join(clauses)
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+
+        with self._lock:
+            db = self._conn()
+            total = db.execute(f"SELECT COUNT(*) FROM risk_results WHERE {where}", params).fetchone()[0]
+            rows = db.execute(
+                f"SELECT product_id, risk_score, risk_level, ci_low, ci_high FROM risk_results WHERE {where} "
+                "ORDER BY risk_score DESC, product_id LIMIT ? OFFSET ?",
+                [*params, limit, max(0, offset)],
+            ).fetchall()
+        return [
+            {
+                "productId": row["product_id"],
+                "riskScore": row["risk_score"],
+                "riskLevel": row["risk_level"],
+                "confidenceInterval": [row["ci_low"], row["ci_high"]],
+            }
+            for row in rows
+        ], total
+
+    # Jobs shared by all worker processes
+
+    def claim_job(self, job, stale_after, max_active=None):
+        """Record `job` (Job.to_dict() plus "key" and "owner") unless a live job with the same key exists
+
+        Runs as one write transaction, so of several processes submitting the
+        same key at the same time exactly one inserts its job. Active jobs
+        whose owner missed heartbeats for `stale_after` seconds are marked
+        failed first. Returns the id of the job that is (now) active for the
+        key, or None when `max_active` keyed jobs are already active.
+        """
+        now = time.time()
+        active = ", ".join("?" * len(ACTIVE_JOB_STATUSES))
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    f"UPDATE jobs SET status = 'failed', error = 'Worker stopped responding', finished_at = ? "
+                    f"WHERE status IN ({active}) AND heartbeat_at < ?",
+                    (datetime.now().isoformat(), *ACTIVE_JOB_STATUSES, now - stale_after),
+                )
+                row = db.execute(
+                    f"SELECT id FROM jobs WHERE key = ? AND status IN ({active}) ORDER BY created_at LIMIT 1",
+                    (job["key"], *ACTIVE_JOB_STATUSES),
+                ).fetchone() if job["key"] is not None else None
+                if row is None and max_active is not None:
+                    running = db.execute(
+                        f"SELECT COUNT(*) FROM jobs WHERE key IS NOT NULL AND status IN ({active})", ACTIVE_JOB_STATUSES,
+                    ).fetchone()[0]
+                    if running >= max_active:
+                        db.execute("COMMIT")
+                        return None
+                if row is None:
+                    db.execute(
+                        "INSERT INTO jobs (id, key, owner, status, created_at, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (job["jobId"], job["key"], job["owner"], job["status"], job["createdAt"], now),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return job["jobId"] if row is None else row["id"]
+
+    def update_job(self, job):
+        """Store the status, timestamps and result of a job (Job.to_dict())"""
+        with self._lock, self._conn() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, started_at = ?, finished_at = ?, heartbeat_at = ? "
+                "WHERE id = ?",
+                (job["status"], json.dumps(job["result"], default=str), job["error"], job["startedAt"],
+                 job["finishedAt"], time.time(), job["jobId"]),
+            )
+
+    def get_job(self, job_id):
+        """A job in the Job.to_dict() shape (plus "owner"), or None"""
+        with self._lock:
+            row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "jobId": row["id"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": row["error"],
+            "createdAt": row["created_at"],
+            "startedAt": row["started_at"],
+            "finishedAt": row["finished_at"],
+            "owner": row["owner"],
+        }
+
+    def heartbeat_jobs(self, owner):
+        """Renew the lease of the owner's active jobs; returns the ids of those another process asked to cancel"""
+        active = ", ".join("?" * len(ACTIVE_JOB_STATUSES))
+        with self._lock, self._conn() as db:
+            db.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ({active})",
+                (time.time(), owner, *ACTIVE_JOB_STATUSES),
+            )
+            rows = db.execute(
+                f"SELECT id FROM jobs WHERE owner = ? AND status IN ({active}) AND cancel_requested = 1",
+                (owner, *ACTIVE_JOB_STATUSES),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def request_job_cancel(self, job_id):
+        """Ask the owner of an active job to cancel it; returns False when the job is not active"""
+        active = ", ".join("?" * len(ACTIVE_JOB_STATUSES))
+        with self._lock, self._conn() as db:
+            cursor = db.execute(
+                f"UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ({active})",
+                (job_id, *ACTIVE_JOB_STATUSES),
+            )
+        return cursor.rowcount > 0
+
+    def prune_jobs(self, keep):
+        """Delete all but the `keep` most recent finished jobs"""
+        active = ", ".join("?" * len(ACTIVE_JOB_STATUSES))
+        with self._lock, self._conn() as db:
+            db.execute(
+                f"DELETE FROM jobs WHERE status NOT IN ({active}) AND id NOT IN ("
+                f"SELECT id FROM jobs WHERE status NOT IN ({active}) ORDER BY finished_at DESC LIMIT ?)",
+                (*ACTIVE_JOB_STATUSES, *ACTIVE_JOB_STATUSES, keep),
+            )
+
+    # Incremental analysis
+
+    def shipment_states(self, product_ids):
+        """Last content hash, news enrichment and risk result per product id, for the ids that have one"""
+        product_ids = list(product_ids)
+        states = {}
+        with self._lock:
+            db = self._conn()
+            for start in range(0, len(product_ids), MAX_QUERY_PARAMS):
+                chunk = product_ids[start:start + MAX_QUERY_PARAMS]
+                rows = db.execute(
+                    "SELECT product_id, content_hash, risk_article_count, news_expires_at, risk_result, scored_at "
+                    f"FROM shipment_state WHERE product_id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for row in rows:
+                    states[row["product_id"]] = {
+                        "hash": row["content_hash"],
+                        "riskArticleCount": row["risk_article_count"],
+                        "newsExpiresAt": row["news_expires_at"],
+                        "riskResult": json.loads(row["risk_result"]),
+                        "scoredAt": row["scored_at"],
+                    }
+        return states
+
+    def save_shipment_states(self, states):
+        """Store {product_id: {"hash", "riskArticleCount", "newsExpiresAt", "riskResult", "scoredAt"}}
+
+        A state whose content hash and risk result are unchanged only gets its
+        news expiry extended; it keeps its scoredAt and does not change the
+        data version, so rescoring unchanged shipments leaves ETags (and the
+        risk graph) alone. Returns the ids whose state actually changed.
+        """
+        with self._lock, self._conn() as db:
+            existing = {}
+            product_ids = list(states)
+            for start in range(0, len(product_ids), MAX_QUERY_PARAMS):
+                chunk = product_ids[start:start + MAX_QUERY_PARAMS]
+                existing.update(
+                    (row["product_id"], (row["content_hash"], row["risk_result"]))
+                    for row in db.execute(
+                        "SELECT product_id, content_hash, risk_result "
+                        f"FROM shipment_state WHERE product_id IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+            changed, unchanged = [], []
+            for product_id, state in states.items():
+                row = (product_id, state["hash"], state["riskArticleCount"], state["newsExpiresAt"],
+                       json.dumps(state["riskResult"]), state.get("scoredAt"))
+                same = existing.get(product_id) == (row[1], row[4])
+                (unchanged if same else changed).append(row)
+            db.executemany(
+                "INSERT OR REPLACE INTO shipment_state "
+                "(product_id, content_hash, risk_article_count, news_expires_at, risk_result, scored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                changed,
+            )
+            db.executemany(
+                "UPDATE shipment_state SET news_expires_at = ? WHERE product_id = ?",
+                [(row[3], row[0]) for row in unchanged],
+            )
+            # Chain details include the latest risk result, so cached responses must change with it
+            if changed:
+                self._bump_version(db)
+        return [row[0] for row in changed]
+
+    # Refresh schedule
+
+    def claim_due_chains(self, now, limit, lease):
+        """Up to `limit` chains due for a refresh at `now`, High risk first, then the longest overdue
+
+        Chains never refreshed are due right away. The claimed chains are
+        pushed `lease` seconds into the future in the same write transaction,
+        so scheduler loops in other processes do not pick them as well (and
+        they come up again if the refresh never reschedules them). Returns
+        [(chain_id, risk_level)].
+        """
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT chains.id, chains.risk_level FROM chains "
+                    "LEFT JOIN chain_schedule ON chain_schedule.chain_id = chains.id "
+                    "WHERE COALESCE(chain_schedule.due_at, 0) <= ? "
+                    "ORDER BY chains.risk_level = 'High' DESC, COALESCE(chain_schedule.due_at, 0), chains.id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                db.executemany(
+                    "INSERT OR REPLACE INTO chain_schedule (chain_id, due_at) VALUES (?, ?)",
+                    [(row["id"], now + lease) for row in rows],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return [(row["id"], row["risk_level"]) for row in rows]
+
+    def reschedule_chains(self, due):
+        """Set the next refresh time of chains: {chain_id: due_at}"""
+        with self._lock, self._conn() as db:
+            db.executemany("INSERT OR REPLACE INTO chain_schedule (chain_id, due_at) VALUES (?, ?)", list(due.items()))
+
+    def get_reply(self, key, max_age=None):
+        """A stored agent reply, or None when there is none or it is older than `max_age` seconds"""
+        with self._lock:
+            row = self._conn().execute("SELECT reply, created_at FROM agent_replies WHERE key = ?", (key,)).fetchone()
+        if row is None or (max_age is not None and row["created_at"] < time.time() - max_age):
+            return None
+        return row["reply"]
+
+    def set_reply(self, key, reply):
+        with self._lock, self._conn() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO agent_replies (key, reply, created_at) VALUES (?, ?, ?)", (key, reply, time.time())
+            )
+
+
+store = SupplyChainStore(os.getenv("SCRM_DB_PATH", DEFAULT_DB_PATH))
@@ -0,0 +1,71 @@
+import os
+
+from jobs import SUCCEEDED, Job
+from shipment_table import dumps
+
+# A ping is sent after this many idle seconds so proxies keep the connection open
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+def _final_event(job):
+    record = job.to_dict()
+    if job.status == SUCCEEDED:
+        result = record["result"] or {}
+        return "done", {
+            "jobId": job.id,
+            "runId": result.get("runId"),
+            "shipments": result.get("shipments"),
+            "reanalyzed": result.get("reanalyzed"),
+        }
+    return "error", {"jobId": job.id, "status": job.status, "error": record["error"]}
+
+
+async def stream_job(job, manager, heartbeat=STREAM_HEARTBEAT_SECONDS):
+    """Yield the progress of a job as (event, data) pairs until it finishes
+
+    `job` first, then the events the job publishes (see jobs.publish), from
+    its start when the stream joins a job that is still running, and
+    `done` with the stored run or `error` at the end. A job owned by another
+    worker process publishes nothing here, so only its end is reported.
+    `ping` keeps an idle connection alive. Leaving the stream does not stop
+    the job; other requests may be following it.
+    """
+    yield "job", {"jobId": job.id, "status": job.status}
+    if isinstance(job, Job):
+        job.follow()
+        try:
+            seen = 0
+            while True:
+                events = await job.next_events(seen, heartbeat)
+                for event in events:
+                    yield event
+                seen += len(events)
+                if job.finished and seen == len(job.events):
+                    break
+                if not events:
+                    yield "ping", {}
+        finally:
+            job.unfollow()
+    else:
+        while not job.finished:
+            job = await manager.wait(job.id, timeout=heartbeat)
+            if job is None:
+                yield "error", {"error": "job not found"}
+                return
+            if not job.finished:
+                yield "ping", {}
+    yield _final_event(job)
+
+
+def format_sse(event, data, event_id=None):
+    """One Server-Sent Events message"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def format_ndjson(event, data):
+    """One newline-delimited JSON line"""
+    return dumps({"event": event, "data": data}) + "\n"
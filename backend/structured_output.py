@@ -0,0 +1,249 @@
+import os
+import re
+import json
+
+import telemetry
+
+# Repair requests per reply before a stage gives up with StructuredOutputError
+STRUCTURED_OUTPUT_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_RETRIES", "2"))
+# Longest part of a bad reply quoted back in a repair request
+REPAIR_REPLY_CHARS = 4000
+
+REPAIR_PROMPT = (
+    "Your reply to the request below could not be used: {errors}\n"
+    "Answer the request again with only a JSON value that matches this JSON schema, without any other text.\n\n"
+    "Schema:\n{schema}\n\nRequest:\n{request}\n\nYour previous reply:\n{reply}"
+)
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+structured_outputs = telemetry.registry.counter(
+    "scrm_structured_output_total", "Structured agent replies per stage and result (ok, repaired, failed)",
+    ("stage", "result"),
+)
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a reply still does not hold a JSON value matching the schema after the repair retries"""
+
+    def __init__(self, stage, errors, reply):
+        super().__init__(f"{stage} reply does not match its schema: {'; '.join(errors)}")
+        self.stage = stage
+        self.errors = errors
+        self.reply = reply
+
+
+def json_schema_format(name, schema):
+    """response_format that asks the model for output constrained to `schema`"""
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+
+
+def _loads(text):
+    try:
+        return json.loads(text), True
+    except ValueError:
+        pass
+    # Models like to leave a comma after the last item
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text)), True
+    except ValueError:
+        return None, False
+
+
+class JSONExtractor:
+    """Finds JSON objects and arrays in model output fed to it chunk by chunk
+
+    Prose, Markdown fences and anything else around the values is skipped.
+    feed() returns the values completed by a chunk, so a stream can be
+    parsed (and abandoned) as soon as the wanted value is complete, and
+    earlier chunks are not scanned again. A candidate that turns out not to be JSON
+    (a bracket in prose) is dropped and scanning resumes right after its
+    opening bracket. finish() closes a value cut off by the end of the
+    reply, e.g. at the completion token limit.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._position = 0
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        self._text += chunk
+        values = []
+        while self._position < len(self._text):
+            char = self._text[self._position]
+            self._position += 1
+            if self._start is None:
+                if char in _CLOSERS:
+                    self._start = self._position - 1
+                    self._stack = [_CLOSERS[char]]
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in _CLOSERS:
+                self._stack.append(_CLOSERS[char])
+            elif char in "}]":
+                if char != self._stack[-1]:
+                    self._restart()
+                    continue
+                self._stack.pop()
+                if not self._stack:
+                    value, ok = _loads(self._text[self._start:self._position])
+                    if ok:
+                        values.append(value)
+                        self._reset()
+                    else:
+                        self._restart()
+        return values
+
+    def finish(self):
+        """The value left open at the end of the reply, closed where it was cut off, or None"""
+        if self._start is None:
+            return None
+        text = self._text[self._start:]
+        if self._in_string:
+            text += '"'
+        text = text.rstrip().rstrip(",")
+        value, ok = _loads(text + "".join(reversed(self._stack)))
+        return value if ok else None
+
+    def _reset(self):
+        # Drop what was consumed; later chunks never look back before this point
+        self._text = self._text[self._position:]
+        self._position = 0
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+
+    def _restart(self):
+        self._position = self._start + 1
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _is_type(value, name):
+    if name == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if name == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _TYPES[name])
+
+
+def validate(value, schema, path="$"):
+    """Errors of `value` against the JSON schema subset used by the stages (type, properties, required,
+    additionalProperties, items, minItems, enum, minimum, maximum, anyOf); an empty list when it matches"""
+    if "anyOf" in schema:
+        branches = [validate(value, branch, path) for branch in schema["anyOf"]]
+        if all(branches):
+            return min(branches, key=len)
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        if not any(_is_type(value, name) for name in types):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: expected one of {schema['enum']}, got {value!r}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {value} is less than {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {value} is more than {schema['maximum']}")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        errors += [f"{path}: missing {name}" for name in schema.get("required", ()) if name not in value]
+        for name, item in value.items():
+            if name in properties:
+                errors += validate(item, properties[name], f"{path}.{name}")
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected {name}")
+    if isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            errors.append(f"{path}: expected at least {schema['minItems']} items, got {len(value)}")
+        if "items" in schema:
+            for index, item in enumerate(value):
+                errors += validate(item, schema["items"], f"{path}[{index}]")
+    return errors
+
+
+def parse_reply(reply, schema):
+    """(value, errors): the first JSON value in `reply` (text or an iterable of chunks) that matches `schema`
+
+    Chunks are only read until a matching value is complete. When none
+    matches, value is None and errors says why.
+    """
+    extractor = JSONExtractor()
+    errors = ["no JSON value found"]
+    for chunk in [reply] if isinstance(reply, str) else reply:
+        for value in extractor.feed(chunk):
+            errors = validate(value, schema)
+            if not errors:
+                return value, []
+    value = extractor.finish()
+    if value is not None:
+        errors = validate(value, schema)
+        if not errors:
+            return value, []
+    return None, errors
+
+
+def repair_request(request, reply, errors, schema):
+    """A request for a corrected reply: only the failing request, its reply and what was wrong with it"""
+    return REPAIR_PROMPT.format(
+        errors="; ".join(errors),
+        schema=json.dumps(schema, separators=(",", ":")),
+        request=request,
+        reply=reply[:REPAIR_REPLY_CHARS],
+    )
+
+
+def _tee(chunks, seen):
+    for chunk in chunks:
+        seen.append(chunk)
+        yield chunk
+
+
+def ask_structured(ask, request, schema, stage, retries=STRUCTURED_OUTPUT_RETRIES):
+    """Send `request` through `ask` and return the JSON value of the reply that matches `schema`
+
+    `ask(content)` returns the reply text or an iterator of its chunks. A
+    reply without a matching value is answered with a repair request for
+    just this one request (see repair_request()), up to `retries` times;
+    then StructuredOutputError is raised.
+    """
+    reply = ask(request)
+    for attempt in range(retries + 1):
+        seen = []
+        value, errors = parse_reply(reply if isinstance(reply, str) else _tee(reply, seen), schema)
+        if not errors:
+            structured_outputs.inc(stage=stage, result="repaired" if attempt else "ok")
+            return value
+        text = reply if isinstance(reply, str) else "".join(seen)
+        if attempt < retries:
+            telemetry.add_to_span("repair_requests")
+            reply = ask(repair_request(request, text, errors, schema))
+    structured_outputs.inc(stage=stage, result="failed")
+    raise StructuredOutputError(stage, errors, text)
@@ -0,0 +1,344 @@
+import os
+import copy
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+
+import orchestrator
+from ingestion import to_shipment
+from jobs import publish
+from llm_backend import get_backend
+from risk_graph import STEP_RISK_PROBABILITIES, annotate, graph_for
+from store import store
+
+# Shipments enriched and scored per step of an analysis; each step's results are published right away
+SCORE_CHUNK_SIZE = int(os.getenv("SCORE_CHUNK_SIZE", "500"))
+
+# Served until the first analysis run stores real chains
+SEED_CHAINS = [
+    {
+        "id": "raw-materials",
+        "title": "Raw Material related data for the supply chain",
+        "totalRisk": None,
+        "riskLevel": None,
+        "lastUpdated": "2025-07-15T10:32:00Z",
+        "steps": [
+            {
+                "id": "step-1",
+                "order": 1,
+                "category": "Raw Materials",
+                "title": "Copper Mining – Peru",
+                "description": "Raw copper extracted by Company X.",
+                "location": "Peru",
+                "company": "MiningCorp SA",
+                "riskScore": STEP_RISK_PROBABILITIES["Medium"],
+                "riskLevel": "Medium",
+                "riskDescription": "Political instability reported near the mining region."
+            },
+            {
+                "id": "step-2",
+                "order": 2,
+                "category": "Transport",
+                "title": "Shipment to Taiwan",
+                "description": "Transported via Pacific route to TSMC",
+                "location": "Pacific Ocean Route",
+                "company": "GlobalShipping Ltd.",
+                "riskScore": STEP_RISK_PROBABILITIES["High"],
+                "riskLevel": "High",
+                "riskDescription": "Major strike at Port of Kaohsiung ongoing."
+            }
+        ]
+    },
+    {
+        "id": "logistics",
+        "title": "Logistics related data for the supply chain",
+        "totalRisk": None,
+        "riskLevel": None,
+        "lastUpdated": "2025-07-15T10:32:00Z",
+        "steps": []
+    }
+]
+
+
+def timestamp():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def seed_store(target=store):
+    """Fill an empty store with the seed chains"""
+    if target.count_chains() == 0:
+        target.upsert_chains(annotate(copy.deepcopy(chain)) for chain in SEED_CHAINS)
+
+
+def update_step_risk(chain_id, step_id, score, description=None, target=store):
+    """Set one step's riskScore, re-derive its chain in the risk graph and store it; None if unknown"""
+    graph = graph_for(target)
+    with graph.lock:
+        version = graph.version
+        chain = graph.set_step_risk(chain_id, step_id, score, description, updated_at=timestamp())
+        if chain is None:
+            return None
+        target.upsert_chains([chain])
+        # Our own write is the only one since the graph was built: no need to rebuild it
+        if target.data_version() == version + 1:
+            graph.version = version + 1
+    return chain
+
+
+def _step(number, category, title, description, location, company, level=None, risk_description=None):
+    return {
+        "id": f"step-{number}",
+        "order": number,
+        "category": category,
+        "title": title,
+        "description": description,
+        "location": location,
+        "company": company,
+        "riskScore": STEP_RISK_PROBABILITIES[level] if level else None,
+        "riskLevel": level,
+        "riskDescription": risk_description,
+    }
+
+
+def chain_from_record(record, shipment, updated_at):
+    """The supply chain of one product: raw material, wafer fab, assembly & test and transport steps"""
+    def get(column):
+        return record.get(column, "")
+
+    supplier = get("SupplierName")
+    origin, destination = get("OriginCountry"), get("DestinationCountry")
+    # totalRisk and riskLevel are derived from the steps by annotate(); the
+    # shipment model's own score stays in the run's risk results
+    return annotate({
+        "id": shipment["productId"],
+        "title": f"{shipment['chipType']} {shipment['node']} – {shipment['partNumber']}",
+        "lastUpdated": updated_at,
+        "steps": [
+            _step(
+                1, "Raw Materials", f"{get('RawMaterialName')} – {get('RawMaterialCountryOfOrigin')}",
+                f"{get('SourceType')} source, {get('LinkLeadTimeDays')} days lead time",
+                get("RawMaterialCountryOfOrigin"), supplier,
+                shipment["countryRiskLevel"], f"Country risk level {shipment['countryRiskLevel']}",
+            ),
+            _step(
+                2, "Foundry Production", f"Wafer fabrication – {shipment['node']}",
+                f"{get('WaferStarts')} wafer starts, {get('WaferYield')}% yield, {get('FabCycleTimeDays')} days cycle time",
+                shipment["supplierLocation"], supplier,
+                shipment["supplierRiskScore"], f"Supplier risk score {shipment['supplierRiskScore']}",
+            ),
+            _step(
+                3, "Assembly & Test", "Assembly and final test",
+                f"{get('AssemblyYield')}% assembly yield, {get('TestPassRate')}% test pass rate, "
+                f"inspection {get('InspectionResult')}",
+                shipment["supplierLocation"], supplier,
+            ),
+            _step(
+                4, "Transport", f"Shipment {origin} to {destination}",
+                f"{get('ShippingMode')} transport, {get('AverageTransitTime')} days average transit",
+                f"{origin} – {destination}", get("Carrier"),
+                shipment["leadTimeRisk"], f"Lead time risk {shipment['leadTimeRisk']}",
+            ),
+        ],
+    })
+
+
+def scoring_fingerprint():
+    """Settings that change a shipment's news enrichment, score or chain; part of every record hash"""
+    from agents.agent_test import NEWS_WINDOW_DAYS, RISK_BOOTSTRAP_SAMPLES, RISK_WEIGHTS
+
+    return {"weights": RISK_WEIGHTS, "bootstrap": RISK_BOOTSTRAP_SAMPLES, "newsWindowDays": NEWS_WINDOW_DAYS,
+            "stepRisk": STEP_RISK_PROBABILITIES}
+
+
+def record_hash(record, fingerprint):
+    """Content hash of a dataset row (all its columns) and the scoring settings"""
+    payload = json.dumps([record, fingerprint], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def stale_indexes(shipments, hashes, states, now):
+    """Positions of the shipments that are new, changed or whose stored news enrichment expired"""
+    stale = []
+    for index, (shipment, content_hash) in enumerate(zip(shipments, hashes)):
+        state = states.get(shipment["productId"])
+        if state is None or state["hash"] != content_hash or (state["newsExpiresAt"] or 0) <= now:
+            stale.append(index)
+    return stale
+
+
+def analysis_key(domains=None):
+    """Job key of an analysis: the same dataset version, domains and scoring settings give the same key"""
+    payload = json.dumps(
+        [orchestrator.dataset_version(), sorted(domains or orchestrator.domain_agents), scoring_fingerprint()],
+        sort_keys=True,
+    )
+    return "run-analysis:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+async def score_shipments(shipments, on_chunk=None, chunk_size=SCORE_CHUNK_SIZE):
+    """Enrich `shipments` with news and score them; one risk result per shipment
+
+    They are handled `chunk_size` at a time and `on_chunk(results)` is called
+    with each chunk's risk results as soon as they are ready. News lookups
+    are cached per location, so mostly the first chunk waits for the News agent.
+    """
+    from agents.agent_test import compute_risk, enrich_with_news
+
+    backend = get_backend()
+    results = []
+    for start in range(0, len(shipments), chunk_size):
+        enriched = await asyncio.to_thread(enrich_with_news, backend, shipments[start:start + chunk_size])
+        chunk = await asyncio.to_thread(compute_risk, enriched)
+        if on_chunk is not None:
+            on_chunk(chunk)
+        results += chunk
+    return results
+
+
+def shipment_state(shipment, content_hash, risk_result, scored_at):
+    """What the store keeps about a scored shipment to reuse its result (see stale_indexes())"""
+    from agents.agent_test import NEWS_WINDOW_DAYS, news_cache
+
+    if shipment.get("newsLookupFailed"):
+        # Scored without news: already expired, so the next run looks the news up again
+        news_expires_at = scored_at
+    else:
+        # Reused rows must not outlive the news lookup they were enriched with
+        news_expires_at = news_cache.expires_at(shipment["supplierLocation"], NEWS_WINDOW_DAYS) or scored_at + news_cache.ttl
+    return {
+        "hash": content_hash,
+        "riskArticleCount": shipment["riskArticleCount"],
+        "newsExpiresAt": news_expires_at,
+        "riskResult": risk_result,
+        "scoredAt": scored_at,
+    }
+
+
+def run_digest(result, risk_results):
+    """Content hash of an analysis run's reports and risk results"""
+    payload = json.dumps([result["report"], result["domainReports"], risk_results], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _stage(name, coro):
+    started = time.perf_counter()
+    publish("stage", {"stage": name, "status": "started"})
+    result = await coro
+    publish("stage", {"stage": name, "status": "finished", "elapsed": round(time.perf_counter() - started, 3)})
+    return result
+
+
+async def analyze_and_store(target=store, domains=None):
+    """Run an analysis, score the shipments and save the reports, risk results and chains to the store
+
+    Only shipments that are new, changed (by content hash) or whose news
+    enrichment expired are enriched and scored again; the others reuse their
+    stored results. Domain batches and the consolidation reuse stored agent
+    replies when their content is unchanged. The domain agents and the
+    shipment scoring run concurrently. Only what changed is written: chains
+    of changed rows, and a new run only when its reports or risk results
+    differ from the latest one, so a run that finds nothing new leaves the
+    data version (and every cached response) alone. Returns the analysis
+    result together with the id of the stored run.
+
+    Run as a job it publishes its progress (see jobs.publish): `stage` at the
+    start and end of each part, the rescored `shipment` risk results, each
+    `domainReport` and the consolidated report as `token`s, then `report`.
+    """
+    records = await asyncio.to_thread(orchestrator.load_dataset)
+    shipments = [to_shipment(record, number) for number, record in enumerate(records, start=1)]
+    fingerprint = scoring_fingerprint()
+    hashes = [record_hash(record, fingerprint) for record in records]
+    states = await asyncio.to_thread(target.shipment_states, [shipment["productId"] for shipment in shipments])
+    stale = stale_indexes(shipments, hashes, states, time.time())
+
+    async def on_report(domain, report):
+        publish("domainReport", {"domain": domain, "report": report})
+
+    async def on_token(text):
+        publish("token", {"text": text})
+
+    def publish_shipments(risk_results):
+        for risk_result in risk_results:
+            publish("shipment", risk_result)
+
+    result, rescored = await orchestrator.gather_or_cancel([
+        asyncio.ensure_future(_stage("analysis", orchestrator.run_analysis(
+            data=records, domains=domains, reply_cache=target, on_report=on_report, on_token=on_token,
+        ))),
+        asyncio.ensure_future(_stage("shipments", score_shipments(
+            [shipments[index] for index in stale], on_chunk=publish_shipments,
+        ))),
+    ])
+    publish("report", {"report": result["report"]})
+
+    updated_at = timestamp()
+    scored_at = time.time()
+    risk_results = [states[shipment["productId"]]["riskResult"] if shipment["productId"] in states else None for shipment in shipments]
+    new_states = {}
+    for index, risk_result in zip(stale, rescored):
+        product_id = shipments[index]["productId"]
+        if shipments[index].get("newsLookupFailed") and product_id in states and states[product_id]["hash"] == hashes[index]:
+            # Keep the result of the last lookup that worked; the row stays stale, so the next run retries
+            continue
+        risk_results[index] = risk_result
+        new_states[product_id] = shipment_state(shipments[index], hashes[index], risk_result, scored_at)
+    # A chain depends on its dataset row only: rows stale just because their news expired keep theirs
+    chains = [
+        chain_from_record(records[index], shipments[index], updated_at) for index in stale
+        if states.get(shipments[index]["productId"], {}).get("hash") != hashes[index]
+    ]
+
+    # A run that found exactly what the latest one did is not stored again
+    digest = run_digest(result, risk_results)
+    run_id = await asyncio.to_thread(target.find_run, digest)
+    if run_id is None:
+        run_id = uuid.uuid4().hex
+        await asyncio.to_thread(
+            target.save_run, run_id, updated_at, result["report"], result["domainReports"], risk_results, digest,
+        )
+    if chains:
+        await asyncio.to_thread(target.upsert_chains, chains)
+    await asyncio.to_thread(target.save_shipment_states, new_states)
+    return {**result, "runId": run_id, "shipments": len(risk_results), "reanalyzed": len(stale)}
+
+
+async def refresh_chains(chain_ids, target=store):
+    """Score the shipments of `chain_ids` again, without the domain agents, and store their results
+
+    Chains without a dataset row (the seed chains) are skipped. A chain is
+    only rewritten when its dataset row changed. Returns {chain_id: riskLevel}
+    of the refreshed chains, the level being None for chains not rewritten.
+    """
+    wanted = set(chain_ids)
+    records = await asyncio.to_thread(orchestrator.load_dataset)
+    rows = [
+        (record, shipment)
+        for record, shipment in (
+            (record, to_shipment(record, number)) for number, record in enumerate(records, start=1)
+        )
+        if shipment["productId"] in wanted
+    ]
+    if not rows:
+        return {}
+    fingerprint = scoring_fingerprint()
+    hashes = [record_hash(record, fingerprint) for record, _ in rows]
+    states = await asyncio.to_thread(target.shipment_states, [shipment["productId"] for _, shipment in rows])
+    rescored = await score_shipments([shipment for _, shipment in rows])
+
+    updated_at = timestamp()
+    scored_at = time.time()
+    new_states, chains = {}, []
+    for (record, shipment), content_hash, risk_result in zip(rows, hashes, rescored):
+        new_states[shipment["productId"]] = shipment_state(shipment, content_hash, risk_result, scored_at)
+        state = states.get(shipment["productId"])
+        if state is None or state["hash"] != content_hash:
+            chains.append(chain_from_record(record, shipment, updated_at))
+    await asyncio.to_thread(target.upsert_chains, chains)
+    await asyncio.to_thread(target.save_shipment_states, new_states)
+    levels = dict.fromkeys(new_states)
+    levels.update((chain["id"], chain["riskLevel"]) for chain in chains)
+    return levels
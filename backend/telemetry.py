@@ -0,0 +1,403 @@
+import os
+import copy
+import glob
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Set TRACE_FILE to append every finished span to a local JSON lines file
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+# Directory shared by the worker processes of one server: each writes its metrics there and /metrics
+# adds them all up. Unset, /metrics reports the answering process only
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Seconds; agent round-trips range from milliseconds (stub, cache) to minutes (long agent runs)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# HTTP statuses the OpenAI and Azure clients retry with backoff
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """A labelled metric family; values are kept per tuple of label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def snapshot(self):
+        """Copy of the values per label values"""
+        with self._lock:
+            return {key: copy.deepcopy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def combine(value, other):
+        return value + other
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        items = sorted((self.snapshot() if values is None else values).items())
+        lines.extend(self._render_sample(key, value) for key, value in items)
+        return "\n".join(lines)
+
+    def _render_sample(self, key, value):
+        return f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @staticmethod
+    def combine(value, other):
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return "\n".join(lines)
+
+
+class Registry:
+    """Holds the process-wide metrics and renders them in the Prometheus text format"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._process_id = uuid.uuid4().hex[:8]
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self, directory=None):
+        """All metrics; with `directory` summed up with the snapshots of the other processes in it (see share())"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        if directory is None:
+            return "\n".join(metric.render() for metric in metrics) + "\n"
+        values = {metric.name: metric.snapshot() for metric in metrics}
+        stale_before = time.time() - 3 * METRICS_FLUSH_SECONDS
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            if path == self._snapshot_path(directory):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # a process is replacing it right now
+            for metric in metrics:
+                # Counts of exited processes still add up; their gauges (requests in progress) do not
+                if metric.type == "gauge" and snapshot["writtenAt"] < stale_before:
+                    continue
+                for key, value in snapshot["metrics"].get(metric.name, ()):
+                    key = tuple(key)
+                    own = values[metric.name]
+                    own[key] = metric.combine(own[key], value) if key in own else value
+        return "\n".join(metric.render(values[metric.name]) for metric in metrics) + "\n"
+
+    def _snapshot_path(self, directory):
+        return os.path.join(directory, f"{os.getpid()}-{self._process_id}.json")
+
+    def write_snapshot(self, directory):
+        """Write this process's metrics to `directory`, replacing its previous snapshot"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {
+            "writtenAt": time.time(),
+            "metrics": {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                        for metric in metrics},
+        }
+        path = self._snapshot_path(directory)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+
+    def share(self, directory, interval=METRICS_FLUSH_SECONDS):
+        """Write a snapshot to `directory` every `interval` seconds from a daemon thread
+
+        Every worker process of a server does this with the same directory,
+        so whichever one answers /metrics reports the sum of all of them,
+        at most `interval` seconds behind. The directory must be emptied
+        when the server starts.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        def flush():
+            while True:
+                try:
+                    self.write_snapshot(directory)
+                except OSError as e:
+                    print(f"Metrics snapshot not written: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=flush, name="metrics-snapshot", daemon=True).start()
+
+
+registry = Registry()
+
+span_duration = registry.histogram(
+    "scrm_span_duration_seconds", "Duration of pipeline stages and agent round-trips", ("kind", "name", "status"),
+)
+span_tokens = registry.counter(
+    "scrm_span_tokens_total", "Model tokens used by agent round-trips", ("kind", "name", "type"),
+)
+span_payload_bytes = registry.counter(
+    "scrm_span_payload_bytes_total", "Bytes sent to and received from the model", ("kind", "name", "direction"),
+)
+span_retries = registry.counter(
+    "scrm_span_retries_total", "Retryable responses (429/5xx) seen during agent round-trips", ("kind", "name"),
+)
+http_client_responses = registry.counter(
+    "scrm_http_client_responses_total", "Responses received by the shared model and agent clients", ("status",),
+)
+http_requests = registry.histogram(
+    "scrm_http_request_duration_seconds", "Duration of FastAPI handlers", ("method", "route", "status"),
+)
+http_requests_in_progress = registry.gauge(
+    "scrm_http_requests_in_progress", "FastAPI requests currently being handled", ("method", "route"),
+)
+
+# Span attributes that are summed up and exported as counters when the span ends
+_COUNTED_ATTRIBUTES = {
+    "prompt_tokens": (span_tokens, {"type": "prompt"}),
+    "completion_tokens": (span_tokens, {"type": "completion"}),
+    "request_bytes": (span_payload_bytes, {"direction": "request"}),
+    "response_bytes": (span_payload_bytes, {"direction": "response"}),
+    "retries": (span_retries, {}),
+}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_trace_lock = threading.Lock()
+_trace_file = None
+
+
+class Span:
+    """Timing and attributes of one unit of work (a stage, an agent round-trip, a request)"""
+
+    def __init__(self, kind, name, parent=None, **attributes):
+        self.kind = kind
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_time = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name, amount=1):
+        """Add `amount` to a numeric attribute (token counts, bytes, retries)"""
+        self.attributes[name] = self.attributes.get(name, 0) + (amount or 0)
+
+    @contextmanager
+    def activate(self):
+        """Make this the current span, so nested spans and add() calls attach to it"""
+        token = _current_span.set(self)
+        try:
+            yield self
+        finally:
+            _current_span.reset(token)
+
+    def fail(self, exc):
+        self.status = "error"
+        self.attributes["error"] = f"{type(exc).__name__}: {exc}"
+
+    def end(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        span_duration.observe(self.duration, kind=self.kind, name=self.name, status=self.status)
+        for attribute, (metric, labels) in _COUNTED_ATTRIBUTES.items():
+            if self.attributes.get(attribute):
+                metric.inc(self.attributes[attribute], kind=self.kind, name=self.name, **labels)
+        if TRACE_FILE:
+            _write_trace(self)
+
+    def to_dict(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentId": self.parent_id,
+            "kind": self.kind,
+            "name": self.name,
+            "status": self.status,
+            "start": self.start_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_span(kind, name, **attributes):
+    """Create a child of the current span without activating it; call end() when done"""
+    return Span(kind, name, parent=current_span(), **attributes)
+
+
+@contextmanager
+def span(kind, name, **attributes):
+    """Time the enclosed block as a span that nested spans and add_to_span() calls attach to"""
+    current = start_span(kind, name, **attributes)
+    try:
+        with current.activate():
+            yield current
+    except BaseException as exc:
+        current.fail(exc)
+        raise
+    finally:
+        current.end()
+
+
+def add_to_span(name, amount=1):
+    """Add to an attribute of the current span, if there is one"""
+    current = current_span()
+    if current is not None:
+        current.add(name, amount)
+
+
+def traced_iterator(current, iterator, size=len):
+    """Yield from `iterator` with `current` active for each step and end the span once it is exhausted"""
+    try:
+        while True:
+            with current.activate():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            current.add("response_bytes", size(item))
+            yield item
+    except BaseException as exc:
+        if not isinstance(exc, GeneratorExit):
+            current.fail(exc)
+        raise
+    finally:
+        current.end()
+
+
+async def atraced_iterator(current, iterator, size=len):
+    """Async counterpart of traced_iterator()"""
+    try:
+        while True:
+            with current.activate():
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            current.add("response_bytes", size(item))
+            yield item
+    except BaseException as exc:
+        if not isinstance(exc, GeneratorExit):
+            current.fail(exc)
+        raise
+    finally:
+        current.end()
+        await iterator.aclose()
+
+
+def record_http_response(status):
+    """Count a response of the shared HTTP clients; retryable ones count as retries of the current span"""
+    http_client_responses.inc(status=status)
+    if status in RETRY_STATUSES:
+        add_to_span("retries")
+
+
+def _write_trace(finished):
+    global _trace_file
+    line = json.dumps(finished.to_dict(), default=str)
+    with _trace_lock:
+        if _trace_file is None:
+            _trace_file = open(TRACE_FILE, "a", encoding="utf-8")
+        _trace_file.write(line + "\n")
+        _trace_file.flush()
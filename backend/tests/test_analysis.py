@@ -0,0 +1,46 @@
+"""Incremental analysis runs against a store
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from agents.agent_test import news_cache
+from llm_backend import StubBackend, set_backend
+from store import SupplyChainStore
+from supplychains import analyze_and_store
+
+
+@pytest.fixture
+def target(tmp_path):
+    set_backend(StubBackend())
+    news_cache.invalidate()
+    store = SupplyChainStore(str(tmp_path / "scrm.db")).open()
+    yield store
+    store.close()
+
+
+def test_unchanged_rerun_keeps_the_data_version(target):
+    first = asyncio.run(analyze_and_store(target))
+    version = target.data_version()
+
+    second = asyncio.run(analyze_and_store(target))
+    assert second["reanalyzed"] == 0
+    assert second["runId"] == first["runId"]
+    assert target.data_version() == version
+
+
+def test_expired_news_with_the_same_counts_keeps_the_data_version(target):
+    first = asyncio.run(analyze_and_store(target))
+    version = target.data_version()
+    with target._lock, target._conn() as db:
+        db.execute("UPDATE shipment_state SET news_expires_at = 0")
+    news_cache.invalidate()
+
+    second = asyncio.run(analyze_and_store(target))
+    assert second["reanalyzed"] == first["shipments"]
+    assert second["runId"] == first["runId"]
+    assert target.data_version() == version
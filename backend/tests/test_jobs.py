@@ -0,0 +1,119 @@
+"""Jobs shared by worker processes through one store file
+
+Each JobManager gets its own SupplyChainStore connection to the same
+database, as two uvicorn workers would.
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from jobs import FAILED, SUCCEEDED, Job, JobLimitReached, JobManager, SharedJob
+from store import SupplyChainStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    path = str(tmp_path / "scrm.db")
+    opened = [SupplyChainStore(path).open(), SupplyChainStore(path).open()]
+    yield opened
+    for store in opened:
+        store.close()
+
+
+async def _started(*managers):
+    for manager in managers:
+        await manager.start()
+    return managers
+
+
+async def _stopped(*managers):
+    for manager in managers:
+        await manager.stop()
+
+
+async def _sleep_and_return(seconds, value):
+    await asyncio.sleep(seconds)
+    return value
+
+
+def test_submit_once_joins_the_job_of_another_process(stores):
+    async def scenario():
+        first, second = await _started(JobManager(state=stores[0]), JobManager(state=stores[1]))
+        try:
+            job = await first.submit_once("analysis", _sleep_and_return, 0.2, "first")
+            joined = await second.submit_once("analysis", _sleep_and_return, 0.2, "second")
+            assert isinstance(job, Job) and isinstance(joined, SharedJob)
+            assert joined.id == job.id
+
+            finished = await second.wait(job.id, timeout=5, poll_interval=0.05)
+            assert finished.status == SUCCEEDED
+            assert finished.to_dict()["result"] == "first"
+        finally:
+            await _stopped(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_submits_in_one_process_share_a_job(stores):
+    async def scenario():
+        (manager,) = await _started(JobManager(state=stores[0]))
+        try:
+            jobs = await asyncio.gather(*(manager.submit_once("analysis", _sleep_and_return, 0.1, None) for _ in range(5)))
+            assert len({job.id for job in jobs}) == 1
+            assert all(isinstance(job, Job) for job in jobs)
+        finally:
+            await _stopped(manager)
+
+    asyncio.run(scenario())
+
+
+def test_active_limit_is_shared_and_answered_with_429(stores, monkeypatch):
+    import main
+
+    async def scenario():
+        first, second = await _started(
+            JobManager(state=stores[0], max_active=1, retry_after=7),
+            JobManager(state=stores[1], max_active=1, retry_after=7),
+        )
+        try:
+            await first.submit_once("analysis:a", _sleep_and_return, 0.5, None)
+            with pytest.raises(JobLimitReached) as limit:
+                await second.submit_once("analysis:b", _sleep_and_return, 0.5, None)
+            assert limit.value.retry_after == 7
+
+            monkeypatch.setattr(main, "job_manager", second)
+            with pytest.raises(HTTPException) as refused:
+                await main.submit_analysis(None)
+            assert refused.value.status_code == 429
+            assert refused.value.headers["Retry-After"] == "7"
+        finally:
+            await _stopped(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_job_of_a_process_that_stopped_renewing_expires(stores):
+    async def scenario():
+        dead, alive = await _started(
+            JobManager(state=stores[0], lease_seconds=0.3), JobManager(state=stores[1], lease_seconds=0.3),
+        )
+        try:
+            stuck = await dead.submit_once("analysis", _sleep_and_return, 60, None)
+            # The process stops renewing its leases, but its job never finishes
+            dead._heartbeat.cancel()
+            assert (await alive.submit_once("analysis", _sleep_and_return, 0, None)).id == stuck.id
+
+            await asyncio.sleep(0.5)
+            replacement = await alive.submit_once("analysis", _sleep_and_return, 0, "again")
+            assert replacement.id != stuck.id
+            assert (await alive.get(stuck.id)).status == FAILED
+            assert (await alive.wait(replacement.id, timeout=5)).result == "again"
+        finally:
+            await _stopped(alive, dead)
+
+    asyncio.run(scenario())
@@ -0,0 +1,41 @@
+"""News lookups when some of them fail
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import json
+
+from agents.news_cache import NewsRiskCache
+from agents.news_enrichment import enrich_shipments, fetch_news_risk
+
+
+def _ask(content):
+    if "Taiwan" in json.loads(content)["queries"][0]:
+        raise ConnectionError("news service unavailable")
+    return '{"riskCount": 3}'
+
+
+def test_failed_lookup_keeps_the_others():
+    cache = NewsRiskCache()
+    counts = fetch_news_risk(_ask, {"taiwan": "Taiwan", "japan": "Japan", "korea": "Korea"}, cache=cache)
+
+    assert counts == {"japan": 3, "korea": 3}
+    assert cache.get("Japan") == 3
+    assert cache.get("Taiwan") is None
+
+
+def test_failed_lookup_marks_its_shipments():
+    shipments = [{"supplierLocation": "Taiwan"}, {"supplierLocation": "Japan"}]
+    enrich_shipments(shipments, _ask)
+
+    assert shipments[0]["riskArticleCount"] == 0 and shipments[0]["newsLookupFailed"]
+    assert shipments[1]["riskArticleCount"] == 3 and "newsLookupFailed" not in shipments[1]
+
+
+def test_failed_lookup_is_stored_as_expired():
+    from supplychains import shipment_state
+
+    failed = shipment_state({"supplierLocation": "Taiwan", "riskArticleCount": 0, "newsLookupFailed": True},
+                            "hash", {}, scored_at=100.0)
+    assert failed["newsExpiresAt"] == 100.0
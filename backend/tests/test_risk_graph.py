@@ -0,0 +1,50 @@
+"""Chain risk derived from step risk levels
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import pytest
+
+from risk_graph import STEP_RISK_PROBABILITIES, RiskGraph, annotate, step_risk_level
+
+
+def _chain(*levels):
+    return {
+        "id": "chain",
+        "title": "chain",
+        "lastUpdated": "2026-01-01T00:00:00Z",
+        "steps": [
+            {"id": f"step-{number}", "order": number, "company": f"Company {number}", "location": "Taiwan",
+             "riskScore": STEP_RISK_PROBABILITIES[level] if level else None}
+            for number, level in enumerate(levels, start=1)
+        ],
+    }
+
+
+@pytest.mark.parametrize("levels, expected", [
+    (("High", "High"), "High"),
+    (("High", "High", "Low"), "High"),
+    (("High", "High", "Medium"), "High"),
+    (("High", "Medium", "Medium"), "Medium"),
+    (("High", None, "Low"), "Medium"),
+    (("Medium", "Medium", "Medium"), "Medium"),
+    (("Medium", "Medium", "Low"), "Medium"),
+    (("Low", "Low", "Medium"), "Low"),
+    (("Low", "Low", "Low"), "Low"),
+])
+def test_two_high_steps_make_a_high_chain(levels, expected):
+    assert annotate(_chain(*levels))["riskLevel"] == expected
+
+
+def test_step_levels_use_the_step_scale():
+    chain = annotate(_chain("Low", "Medium", "High", None))
+    assert [step["riskLevel"] for step in chain["steps"]] == ["Low", "Medium", "High", None]
+    assert all(step_risk_level(probability) == level for level, probability in STEP_RISK_PROBABILITIES.items())
+
+
+def test_company_index():
+    graph = RiskGraph.from_chains([_chain("High", "Low")])
+    assert graph.chains_of_company(" company 1 ") == ["chain"]
+    graph.remove_chain("chain")
+    assert graph.chains_of_company("Company 1") == []
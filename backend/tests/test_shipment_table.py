@@ -0,0 +1,51 @@
+"""ShipmentTable round trips through pyarrow
+
+Run from the backend directory:
+
+    python -m pytest tests
+"""
+import pytest
+
+from ingestion import RISK_LEVELS
+from risk_scoring import score_shipments
+from shipment_table import CATEGORICAL_FIELDS, LEVEL_FIELDS, CategoricalColumn, ShipmentTable
+
+pa = pytest.importorskip("pyarrow")
+
+
+def _plain_strings(table):
+    """The Arrow table other tools write: every dictionary column decoded to plain strings"""
+    return pa.Table.from_arrays(
+        [column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column for column in table.columns],
+        names=table.column_names,
+    )
+
+
+def test_from_arrow_encodes_plain_string_columns():
+    table = ShipmentTable.load()
+    loaded = ShipmentTable.from_arrow(_plain_strings(table.to_arrow()))
+
+    for field in CATEGORICAL_FIELDS + LEVEL_FIELDS:
+        if field in loaded.columns:
+            assert isinstance(loaded.columns[field], CategoricalColumn), field
+            assert loaded.columns[field].tolist() == table.columns[field].tolist(), field
+    for field in LEVEL_FIELDS:
+        if field in loaded.columns:
+            assert loaded.columns[field].categories == list(RISK_LEVELS), field
+    assert score_shipments(loaded) == score_shipments(table)
+
+
+def test_from_arrow_reorders_level_dictionaries():
+    table = ShipmentTable.load()
+    arrow = table.to_arrow()
+    field = "countryRiskLevel"
+    levels = arrow.column(field).combine_chunks()
+    reversed_levels = pa.DictionaryArray.from_arrays(
+        pa.array([len(RISK_LEVELS) - 1 - RISK_LEVELS.index(value) for value in levels.to_pylist()], pa.int8()),
+        pa.array(list(reversed(RISK_LEVELS)), pa.string()),
+    )
+    arrow = arrow.set_column(arrow.column_names.index(field), field, reversed_levels)
+
+    loaded = ShipmentTable.from_arrow(arrow)
+    assert loaded.columns[field].categories == list(RISK_LEVELS)
+    assert loaded.columns[field].tolist() == table.columns[field].tolist()